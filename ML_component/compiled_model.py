@@ -0,0 +1,348 @@
+"""
+compiled_model.py - Flat-array evaluator for the LightGBM fraud model
+
+The booster's trees are compiled once into contiguous NumPy arrays and evaluated
+without any LightGBM/sklearn code at inference time. Two layouts are built:
+
+* bitvector (QuickScorer-style): every split of every tree is evaluated with one
+  vectorized compare; each split that sends a row right clears the bitmask of the
+  leaves in its left subtree, and the exit leaf of each tree is the lowest bit left
+  set. The number of NumPy calls does not depend on tree depth. Needs <= 64 leaves
+  per tree.
+* node traversal: one slot per node with leaves pointing to themselves, advanced
+  one level per step for max_depth steps. Used for batches, where its
+  (rows x trees) working set beats the (rows x splits) one, and when a tree has
+  more than 64 leaves.
+
+save()/load() store both layouts as plain .npy files; load() memory-maps them, so
+every process that loads the same directory shares one copy through the page cache.
+"""
+
+import json
+import os
+
+import numpy as np
+
+# LightGBM missing value handling per split (see LightGBM's tree.h NumericalDecision)
+MISSING_NONE, MISSING_ZERO, MISSING_NAN = 0, 1, 2
+_MISSING_TYPES = {"None": MISSING_NONE, "Zero": MISSING_ZERO, "NaN": MISSING_NAN}
+_ZERO_THRESHOLD = 1e-35
+
+# Rows evaluated per block, bounds the (rows x trees) working arrays for large batches
+_BLOCK_ROWS = 8192
+# The bitvector layout wins for single rows; batches use node traversal
+_BITVECTOR_MAX_ROWS = 1
+_MAX_BITVECTOR_LEAVES = 64
+_ALL_LEAVES = np.uint64(0xFFFFFFFFFFFFFFFF)
+
+# Arrays written by CompiledForest.save(), in constructor order
+_NODE_ARRAYS = ("roots", "feature", "threshold", "left", "right", "default_left", "missing_type", "value")
+_FOREST_META = "forest.json"
+_FORMAT_VERSION = 1
+
+
+class CompiledForest:
+    """Array-based evaluator equivalent to LightGBM's binary predict/predict_proba."""
+
+    def __init__(self, roots, feature, threshold, left, right, default_left, missing_type, value,
+                 max_depth, sigmoid=1.0, bitvector=None):
+        self.roots = np.ascontiguousarray(roots, dtype=np.int32)
+        self.feature = np.ascontiguousarray(feature, dtype=np.int32)
+        self.threshold = np.ascontiguousarray(threshold, dtype=np.float64)
+        self.left = np.ascontiguousarray(left, dtype=np.int32)
+        self.right = np.ascontiguousarray(right, dtype=np.int32)
+        self.default_left = np.ascontiguousarray(default_left, dtype=bool)
+        self.missing_type = np.ascontiguousarray(missing_type, dtype=np.int8)
+        self.value = np.ascontiguousarray(value, dtype=np.float64)
+        self.max_depth = int(max_depth)
+        self.sigmoid = float(sigmoid)
+
+        # Missing-value handling only costs extra work if some split needs it
+        self._has_missing_rules = bool(np.any(self.missing_type != MISSING_NONE))
+
+        # Bitvector layout (see module docstring), None when some tree is too large
+        self.bitvector = bitvector if bitvector is not None else _build_bitvector(
+            self.roots, self.feature, self.threshold, self.left, self.right,
+            self.default_left, self.missing_type, self.value
+        )
+
+    @classmethod
+    def from_booster(cls, booster):
+        """Compiles a trained lightgbm.Booster (binary objective, numerical splits only)."""
+        dump = booster.dump_model()
+
+        objective = dump.get("objective", "")
+        if not objective.startswith("binary") or dump.get("num_tree_per_iteration", 1) != 1:
+            raise ValueError(f"Unsupported objective for compiled inference: {objective}")
+        if dump.get("average_output"):
+            raise ValueError("Averaged-output (random forest) boosters are not supported")
+
+        sigmoid = 1.0
+        for token in objective.split():
+            if token.startswith("sigmoid:"):
+                sigmoid = float(token.split(":", 1)[1])
+
+        roots, feature, threshold, left, right = [], [], [], [], []
+        default_left, missing_type, value = [], [], []
+        max_depth = 0
+
+        def add_node(node, depth):
+            nonlocal max_depth
+            index = len(feature)
+            feature.append(0)
+            threshold.append(0.0)
+            left.append(index)
+            right.append(index)
+            default_left.append(False)
+            missing_type.append(MISSING_NONE)
+            value.append(0.0)
+
+            if "leaf_value" in node:
+                # Leaf: self-loop so further traversal steps keep the row here
+                value[index] = node["leaf_value"]
+                max_depth = max(max_depth, depth)
+                return index
+
+            if node.get("decision_type", "<=") != "<=":
+                raise ValueError("Categorical splits are not supported by the compiled evaluator")
+
+            feature[index] = node["split_feature"]
+            threshold[index] = node["threshold"]
+            default_left[index] = node.get("default_left", True)
+            missing_type[index] = _MISSING_TYPES[node.get("missing_type", "None")]
+            left[index] = add_node(node["left_child"], depth + 1)
+            right[index] = add_node(node["right_child"], depth + 1)
+            return index
+
+        for tree in dump["tree_info"]:
+            roots.append(add_node(tree["tree_structure"], 0))
+
+        return cls(roots, feature, threshold, left, right, default_left, missing_type, value,
+                   max_depth, sigmoid)
+
+    def save(self, directory):
+        """Writes the forest as one .npy file per array plus forest.json."""
+        os.makedirs(directory, exist_ok=True)
+        for name in _NODE_ARRAYS:
+            np.save(os.path.join(directory, f"{name}.npy"), getattr(self, name))
+
+        bitvector_arrays = []
+        if self.bitvector is not None:
+            for name, array in self.bitvector.items():
+                if isinstance(array, np.ndarray):
+                    np.save(os.path.join(directory, f"bitvector_{name}.npy"), array)
+                    bitvector_arrays.append(name)
+
+        meta = {
+            "format_version": _FORMAT_VERSION,
+            "max_depth": self.max_depth,
+            "sigmoid": self.sigmoid,
+            "bitvector_arrays": bitvector_arrays,
+            "bitvector_constant": self.bitvector["constant"] if self.bitvector is not None else None,
+        }
+        with open(os.path.join(directory, _FOREST_META), "w") as f:
+            json.dump(meta, f, indent=2)
+
+    @classmethod
+    def load(cls, directory, mmap=True):
+        """
+        Loads a forest written by save(). With mmap the arrays are read-only views of
+        the files instead of private copies; nothing is recompiled.
+        """
+        with open(os.path.join(directory, _FOREST_META)) as f:
+            meta = json.load(f)
+        if meta.get("format_version") != _FORMAT_VERSION:
+            raise ValueError(f"Unsupported compiled model format: {meta.get('format_version')}")
+
+        def load_array(name):
+            # Plain ndarray view of the memmap; memmap subclass wrapping slows every operation
+            return np.asarray(np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r" if mmap else None))
+
+        bitvector = None
+        if meta["bitvector_arrays"]:
+            bitvector = {name: load_array(f"bitvector_{name}") for name in meta["bitvector_arrays"]}
+            bitvector["constant"] = meta["bitvector_constant"]
+
+        return cls(*(load_array(name) for name in _NODE_ARRAYS),
+                   meta["max_depth"], meta["sigmoid"], bitvector=bitvector)
+
+    def _raw_block_bitvector(self, X):
+        bv = self.bitvector
+        x = X[:, bv["feature"]]
+
+        if self._has_missing_rules:
+            is_nan = np.isnan(x)
+            x = np.where(is_nan & (bv["missing_type"] != MISSING_NAN), 0.0, x)
+            is_missing = (
+                ((bv["missing_type"] == MISSING_ZERO) & (x > -_ZERO_THRESHOLD) & (x <= _ZERO_THRESHOLD))
+                | ((bv["missing_type"] == MISSING_NAN) & is_nan)
+            )
+            go_left = np.where(is_missing, bv["default_left"], x <= bv["threshold"])
+        else:
+            go_left = x <= bv["threshold"]
+            # NaN inputs are treated as 0.0 when no split has a missing rule
+            nan_mask = x != x
+            if nan_mask.any():
+                go_left = np.where(nan_mask, 0.0 <= bv["threshold"], go_left)
+
+        # Splits that send the row right remove the leaves of their left subtree
+        masks = np.where(go_left, _ALL_LEAVES, bv["left_leaves_removed"])
+        remaining = np.bitwise_and.reduceat(masks, bv["tree_starts"], axis=1)
+
+        # Exit leaf is the lowest set bit; isolate it and take its (exact) log2
+        lowest = remaining & (~remaining + np.uint64(1))
+        leaf_position = np.log2(lowest.astype(np.float64)).astype(np.intp)
+
+        return bv["leaf_values"][bv["leaf_offsets"] + leaf_position].sum(axis=1) + bv["constant"]
+
+    def _raw_row_bitvector(self, row):
+        # Single-row specialisation of _raw_block_bitvector on 1D arrays
+        bv = self.bitvector
+        if self._has_missing_rules or np.isnan(row).any():
+            return self._raw_block_bitvector(row[None, :])[0]
+
+        go_left = row.take(bv["feature"]) <= bv["threshold"]
+        masks = np.where(go_left, _ALL_LEAVES, bv["left_leaves_removed"])
+        remaining = np.bitwise_and.reduceat(masks, bv["tree_starts"])
+        lowest = remaining & (~remaining + np.uint64(1))
+        leaf_position = np.log2(lowest.astype(np.float64)).astype(np.intp)
+        return bv["leaf_values"].take(bv["leaf_offsets"] + leaf_position).sum() + bv["constant"]
+
+    def _raw_block(self, X):
+        if self.bitvector is not None and X.shape[0] <= _BITVECTOR_MAX_ROWS:
+            if X.shape[0] == 1:
+                return np.array([self._raw_row_bitvector(X[0])])
+            return self._raw_block_bitvector(X)
+
+        n_rows = X.shape[0]
+        row_index = np.arange(n_rows)[:, None]
+        nodes = np.broadcast_to(self.roots, (n_rows, self.roots.shape[0])).copy()
+
+        for _ in range(self.max_depth):
+            x = X[row_index, self.feature[nodes]]
+            go_left = x <= self.threshold[nodes]
+
+            if self._has_missing_rules:
+                node_missing = self.missing_type[nodes]
+                is_nan = np.isnan(x)
+                x = np.where(is_nan & (node_missing != MISSING_NAN), 0.0, x)
+                is_missing = (
+                    ((node_missing == MISSING_ZERO) & (x > -_ZERO_THRESHOLD) & (x <= _ZERO_THRESHOLD))
+                    | ((node_missing == MISSING_NAN) & is_nan)
+                )
+                go_left = np.where(is_missing, self.default_left[nodes], x <= self.threshold[nodes])
+            else:
+                # NaN inputs are treated as 0.0 when no split has a missing rule
+                nan_mask = x != x
+                if nan_mask.any():
+                    go_left = np.where(nan_mask, 0.0 <= self.threshold[nodes], go_left)
+
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+
+        return self.value[nodes].sum(axis=1)
+
+    def predict_raw(self, X):
+        """Returns raw margin scores for a 2D float64 feature matrix (already scaled)."""
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X[None, :]
+        if X.shape[0] <= _BLOCK_ROWS:
+            return self._raw_block(X)
+        return np.concatenate([
+            self._raw_block(X[start:start + _BLOCK_ROWS])
+            for start in range(0, X.shape[0], _BLOCK_ROWS)
+        ])
+
+    def predict(self, X):
+        """Returns the positive-class probability, matching booster.predict / predict_proba[:, 1]."""
+        return 1.0 / (1.0 + np.exp(-self.sigmoid * self.predict_raw(X)))
+
+
+def _build_bitvector(roots, feature, threshold, left, right, default_left, missing_type, value):
+    """Builds the QuickScorer-style arrays from the node layout, or None if a tree has > 64 leaves."""
+    split_nodes, left_masks, tree_starts, leaf_offsets, leaf_values = [], [], [], [], []
+    constant = 0.0
+    left_of, right_of = left.tolist(), right.tolist()
+
+    for root in roots.tolist():
+        # In-order walk numbers the leaves left to right
+        tree_leaves = []
+        tree_splits = []
+
+        def walk(node):
+            if left_of[node] == node:
+                tree_leaves.append(node)
+                return 1 << (len(tree_leaves) - 1)
+            left_mask = walk(left_of[node])
+            right_mask = walk(right_of[node])
+            tree_splits.append((node, left_mask))
+            return left_mask | right_mask
+
+        walk(root)
+
+        if len(tree_leaves) > _MAX_BITVECTOR_LEAVES:
+            return None
+        if not tree_splits:
+            # Single-leaf tree contributes a constant
+            constant += value[tree_leaves[0]]
+            continue
+
+        tree_starts.append(len(split_nodes))
+        leaf_offsets.append(len(leaf_values))
+        for node, left_mask in tree_splits:
+            split_nodes.append(node)
+            left_masks.append(~left_mask & 0xFFFFFFFFFFFFFFFF)
+        leaf_values.extend(value[leaf] for leaf in tree_leaves)
+
+    split_nodes = np.asarray(split_nodes, dtype=np.intp)
+    return {
+        "feature": feature[split_nodes],
+        "threshold": threshold[split_nodes],
+        "default_left": default_left[split_nodes],
+        "missing_type": missing_type[split_nodes],
+        "left_leaves_removed": np.asarray(left_masks, dtype=np.uint64),
+        "tree_starts": np.asarray(tree_starts, dtype=np.intp),
+        "leaf_offsets": np.asarray(leaf_offsets, dtype=np.intp),
+        "leaf_values": np.asarray(leaf_values, dtype=np.float64),
+        "constant": float(constant),
+    }
+
+
+def verify_compiled_model(csv_path, tolerance=1e-9):
+    """
+    Compares the compiled evaluator with the pickled sklearn wrapper's predict_proba on a CSV
+    of raw transaction features (extra columns such as 'fraud' are ignored).
+
+    Returns:
+        dict with the number of rows checked and the maximum absolute difference.
+    """
+    import pandas as pd
+    from ML_component import fraud_detection_ml as fraud_ml
+    from ML_component.model_registry import load_pickled_model
+
+    df = pd.read_csv(csv_path)
+    raw = df[fraud_ml.FEATURE_NAMES].to_numpy(dtype=np.float64)
+
+    # The pickled scaler itself, fitted on named columns (the serving backend may fold it away)
+    model, scaler = load_pickled_model()
+    logged = fraud_ml.log_transform_array(raw.copy())
+    processed = scaler.transform(pd.DataFrame(logged, columns=fraud_ml.FEATURE_NAMES))
+    expected = model.predict_proba(pd.DataFrame(processed, columns=fraud_ml.FEATURE_NAMES))[:, 1]
+    actual = CompiledForest.from_booster(model.booster_).predict(processed)
+
+    max_abs_diff = float(np.max(np.abs(expected - actual))) if len(expected) else 0.0
+    return {
+        "rows": int(len(expected)),
+        "max_abs_diff": max_abs_diff,
+        "within_tolerance": bool(max_abs_diff <= tolerance),
+    }
+
+
+if __name__ == "__main__":
+    import sys
+
+    default_csv = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                               "synthetic_transaction_data.csv")
+    report = verify_compiled_model(sys.argv[1] if len(sys.argv) > 1 else default_csv)
+    print(report)
+    sys.exit(0 if report["within_tolerance"] else 1)
@@ -1,30 +1,123 @@
+import json
 import os
-import joblib
-import pandas as pd
+from operator import itemgetter
+
 import numpy as np
 # import lightgbm
 # import sklearn
 
+from ML_component.micro_batcher import MicroBatcher
+from ML_component.model_registry import ModelRegistry
+from result_cache import feature_fingerprint, make_cache
+
 # Define log transformation function
+def log_transform_array(X):
+    """Masked natural log on a float64 array, in place: log(x) where x > 0, 0 elsewhere."""
+    positive = X > 0
+    np.log(X, out=X, where=positive)
+    X[~positive] = 0
+    return X
+
 def log_transform_df(X):
-    X = X.copy()
-    for col in X.columns:
-        X[col] = X[col].apply(lambda x: np.log(x) if x > 0 else 0)
+    import pandas as pd
+
+    values = log_transform_array(X.to_numpy(dtype=np.float64, copy=True))
+    return pd.DataFrame(values, columns=X.columns, index=X.index)
+
+# Load config from JSON
+CONFIG_PATH = os.path.join(os.path.dirname(__file__), "config.json")
+with open(CONFIG_PATH, "r") as file:
+    CONFIG = json.load(file)
+
+# The trained model and scaler are loaded on first use (see model_registry.py)
+MODEL_REGISTRY = ModelRegistry(
+    backend=CONFIG.get("inference_backend", "lightgbm"),
+    flat_model_dir=os.path.join(os.path.dirname(__file__), CONFIG.get("flat_model_dir", "flat_model")),
+    quantized_model_path=os.path.join(os.path.dirname(__file__), CONFIG.get("quantized_model_path", "quantized_model.bin")),
+)
+
+# Define expected feature names (ensuring correct order)
+FEATURE_NAMES = [
+    "Avg min between sent tnx", "Avg min between received tnx",
+    "Time Diff between first and last (Mins)", "Unique Received From Addresses",
+    "min value received", "max value received", "avg val received",
+    "min val sent", "avg val sent",
+    "total transactions (including tnx to create contract)",
+    "total ether received", "total ether balance"
+]
+FEATURE_NAME_SET = frozenset(FEATURE_NAMES)
+
+# ---------------- Fast-path feature pipeline ----------------
+# Pulls the feature values out of a transaction_data dict in FEATURE_NAMES order
+_get_features = itemgetter(*FEATURE_NAMES)
+
+
+def __getattr__(name):
+    # model / scaler / booster stay importable as module attributes, loaded on access
+    if name in ("model", "scaler", "booster"):
+        return getattr(MODEL_REGISTRY.get(), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def preload():
+    """Loads the model artifacts now instead of on the first request."""
+    MODEL_REGISTRY.preload()
+
+
+def check_transaction_features(transaction_data):
+    """Raises ValueError unless transaction_data holds exactly the numeric model features."""
+    if transaction_data.keys() != FEATURE_NAME_SET:
+        raise ValueError(f"Feature mismatch! Expected: {FEATURE_NAMES}, Got: {list(transaction_data)}")
+    if not all(isinstance(value, (int, float)) for value in transaction_data.values()):
+        raise ValueError("Non-numeric value in transaction data")
+
+
+def build_feature_matrix(transaction_data_list):
+    """Builds the raw (n, 12) float64 feature matrix in FEATURE_NAMES order."""
+    X = np.empty((len(transaction_data_list), len(FEATURE_NAMES)), dtype=np.float64)
+    for i, transaction_data in enumerate(transaction_data_list):
+        X[i] = _get_features(transaction_data)
+    return X
+
+
+def preprocess_features(X, artifacts=None):
+    """Applies the log transform and scaler to a raw feature matrix, in place where possible."""
+    artifacts = artifacts or MODEL_REGISTRY.get()
+    log_transform_array(X)
+    if artifacts.scaler_folded:
+        # The quantized model's thresholds already include the scaler
+        return X
+    if artifacts.scale is None:
+        # The scaler is not a plain MinMaxScaler: apply it through sklearn
+        import pandas as pd
+        return artifacts.scaler.transform(pd.DataFrame(X, columns=FEATURE_NAMES))
+    X *= artifacts.scale
+    X += artifacts.min
+    if artifacts.clip is not None:
+        np.clip(X, artifacts.clip[0], artifacts.clip[1], out=X)
     return X
 
-# Load the trained model and scaler
-MODEL_PATH = os.path.join(os.path.dirname(__file__), "lightGBM_fraud_model_final_modified.pkl")
-SCALER_PATH = os.path.join(os.path.dirname(__file__), "modified_scaler.pkl")
 
-with open(MODEL_PATH, "rb") as model_file:
-    model = joblib.load(model_file)
+def predict_fraud_probability(X):
+    """Returns the fraud probability for every row of a raw feature matrix."""
+    artifacts = MODEL_REGISTRY.get()
+    return artifacts.predict_proba(preprocess_features(X, artifacts))
+
+
+# Coalesces concurrent single-transaction calls into one predict call (None when disabled)
+MICRO_BATCHING_CONFIG = CONFIG.get("micro_batching", {})
+MICRO_BATCHER = None
+if MICRO_BATCHING_CONFIG.get("enabled", False):
+    MICRO_BATCHER = MicroBatcher(
+        predict_fraud_probability,
+        max_batch_rows=MICRO_BATCHING_CONFIG.get("max_batch_rows", 64),
+        max_wait_ms=MICRO_BATCHING_CONFIG.get("max_wait_ms", 2.0),
+        result_timeout_seconds=MICRO_BATCHING_CONFIG.get("result_timeout_seconds", 2.0),
+    )
 
-# Ensure compatibility for CPU-based execution
-if hasattr(model, "set_params"):
-    model.set_params(n_jobs=-1)
+# Rounded scores keyed by the raw feature values (None when disabled, see result_cache.py)
+SCORE_CACHE = make_cache("ml_score", CONFIG.get("score_cache", {}))
 
-with open(SCALER_PATH, "rb") as scaler_file:
-    scaler = joblib.load(scaler_file)
 
 def detect_fraud_ml(request_data, results):
     """
@@ -47,37 +140,31 @@ def detect_fraud_ml(request_data, results):
         return
 
     try:
-        # Convert transaction data to a DataFrame
-        df = pd.DataFrame([transaction_data])
-
-        # Define expected feature names (ensuring correct order)
-        feature_names = [
-            "Avg min between sent tnx", "Avg min between received tnx",
-            "Time Diff between first and last (Mins)", "Unique Received From Addresses",
-            "min value received", "max value received", "avg val received",
-            "min val sent", "avg val sent",
-            "total transactions (including tnx to create contract)",
-            "total ether received", "total ether balance"
-        ]
-
         # Validate if all expected features are present in the input data
-        if set(feature_names) != set(df.columns):
-            raise ValueError(f"Feature mismatch! Expected: {feature_names}, Got: {df.columns}")
-
-        # Apply log transformation to the data
-        df = log_transform_df(df)
+        check_transaction_features(transaction_data)
 
-        # Scale the transformed data
-        npArray_processed = scaler.transform(df)
+        # Build the feature row, log-transform, scale and score it (together with
+        # concurrent calls when micro-batching is enabled)
+        X = build_feature_matrix([transaction_data])
 
-        # Convert back to a DataFrame with correct column names
-        df_processed = pd.DataFrame(npArray_processed, columns=feature_names)
+        # Identical feature values were scored recently: reuse the score
+        cache_key = None
+        if SCORE_CACHE is not None:
+            cache_key = feature_fingerprint(X[0])
+            cached_score = SCORE_CACHE.get(cache_key)
+            if cached_score is not None:
+                results["ML_fraud_score"] = cached_score
+                return
 
-        # Predict fraud probability using the trained LightGBM model
-        fraud_probability = model.predict_proba(df_processed)[:, 1][0]
+        if MICRO_BATCHER is not None:
+            fraud_probability = MICRO_BATCHER.score(X)
+        else:
+            fraud_probability = predict_fraud_probability(X)[0]
 
         # Store the fraud probability in the results dictionary (rounded to 4 decimal places)
         results["ML_fraud_score"] = round(fraud_probability, 4)
+        if cache_key is not None:
+            SCORE_CACHE.set(cache_key, float(results["ML_fraud_score"]))
 
     except ValueError as ve:
         print(f"ValueError in ML fraud detection: {ve}")
@@ -85,3 +172,93 @@ def detect_fraud_ml(request_data, results):
     except Exception as e:
         print(f"Unexpected error in ML fraud detection: {e}")
         results["ML_fraud_score"] = None
+
+
+def detect_fraud_ml_batch(request_data_list, results_list, columns=None):
+    """
+    Batch variant of detect_fraud_ml: scores many transactions with a single
+    scaler and model call.
+
+    Args:
+        request_data_list (list): JSON requests containing transaction data.
+        results_list (list): One results dictionary per request, updated in place.
+        columns (validation_logic.RequestColumns, optional): typed columns parsed during
+            validation; rows marked in features_ok are scored without touching the dicts.
+
+    Returns:
+        None (sets "ML_fraud_score" in every results dictionary).
+    """
+
+    # Feature rows parsed by the batch validator (same feature order as the model)
+    parsed = None
+    if columns is not None and tuple(columns.feature_names) == tuple(FEATURE_NAMES):
+        parsed = columns.features_ok
+
+    # Collect the rows that can be scored; everything else gets a None score
+    rows = []
+    row_positions = []
+    for position, request_data in enumerate(request_data_list):
+        results_list[position]["ML_fraud_score"] = None
+        if parsed is not None and parsed[position]:
+            row_positions.append(position)
+            continue
+
+        transaction_data = request_data.get("transaction_data")
+
+        if not transaction_data:
+            continue
+
+        try:
+            check_transaction_features(transaction_data)
+        except (ValueError, AttributeError) as ve:
+            print(f"ValueError in ML fraud detection for batch item {position}: {ve}")
+            continue
+
+        rows.append(transaction_data)
+        row_positions.append(position)
+
+    if not row_positions:
+        return
+
+    try:
+        if parsed is None:
+            X = build_feature_matrix(rows)
+        else:
+            # Parsed rows are copied out of the columns; the rest are built from their dicts
+            X = np.empty((len(row_positions), len(FEATURE_NAMES)), dtype=np.float64)
+            from_columns = parsed[row_positions]
+            X[from_columns] = columns.features[np.asarray(row_positions)[from_columns]]
+            if rows:
+                X[~from_columns] = build_feature_matrix(rows)
+
+        if SCORE_CACHE is not None:
+            # Rows with cached scores are filled in; only the rest go to the model
+            cache_keys = [feature_fingerprint(row) for row in X]
+            to_score = []
+            for i, (position, cache_key) in enumerate(zip(row_positions, cache_keys)):
+                cached_score = SCORE_CACHE.get(cache_key)
+                if cached_score is None:
+                    to_score.append(i)
+                else:
+                    results_list[position]["ML_fraud_score"] = cached_score
+            if len(to_score) < len(row_positions):
+                X = X[to_score]
+                row_positions = [row_positions[i] for i in to_score]
+                cache_keys = [cache_keys[i] for i in to_score]
+            if not row_positions:
+                return
+
+        # Single vectorized prediction for the whole batch
+        fraud_probabilities = predict_fraud_probability(X)
+
+        for position, fraud_probability in zip(row_positions, fraud_probabilities):
+            results_list[position]["ML_fraud_score"] = round(fraud_probability, 4)
+
+        if SCORE_CACHE is not None:
+            for position, cache_key in zip(row_positions, cache_keys):
+                SCORE_CACHE.set(cache_key, float(results_list[position]["ML_fraud_score"]))
+
+    except ValueError as ve:
+        print(f"ValueError in ML batch fraud detection: {ve}")
+    except Exception as e:
+        print(f"Unexpected error in ML batch fraud detection: {e}")
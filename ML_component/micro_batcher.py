@@ -0,0 +1,113 @@
+"""
+micro_batcher.py - Coalesces concurrent single-transaction ML scoring calls into batches
+
+Every detect_fraud_ml call in a process hands its (1, 12) feature row to one
+MicroBatcher. A collector thread takes the rows that are waiting, scores them with a
+single vectorized predict call and hands each caller its probability.
+
+The collection window adapts to load: rows that are already waiting are always
+taken (up to max_batch_rows), and the collector only waits for more - at most
+max_wait_ms after the first row - while the batch is smaller than the previous one.
+Idle or sequential traffic (previous batch of one row) is scored without waiting;
+under load, batches follow the number of overlapping callers.
+
+Metrics (metrics.REGISTRY):
+    fraud_payload_size_items{field="ml_micro_batch_size"}          rows per scoring call
+    fraud_component_latency_seconds{component="ml_micro_batch_queue"}  time a row waited
+    fraud_component_latency_seconds{component="ml_micro_batch_score"}  time per scoring call
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+from metrics import REGISTRY
+
+
+class MicroBatcher:
+    """Scores rows submitted from many threads with one score_batch(X) call per batch."""
+
+    def __init__(self, score_batch, max_batch_rows=64, max_wait_ms=2.0, result_timeout_seconds=2.0):
+        if max_batch_rows < 1:
+            raise ValueError(f"max_batch_rows must be >= 1, got {max_batch_rows}")
+        # Positive-class probability for every row of a raw (n, 12) float64 matrix
+        self.score_batch = score_batch
+        self.max_batch_rows = max_batch_rows
+        self.max_wait_seconds = max_wait_ms / 1000.0
+        self.result_timeout_seconds = result_timeout_seconds
+        self._init_state()
+        os.register_at_fork(after_in_child=self._init_state)
+
+    def _init_state(self):
+        # Also run in forked children: the collector thread does not survive fork
+        self._queue = queue.SimpleQueue()
+        self._start_lock = threading.Lock()
+        self._collector = None
+        self._last_batch_rows = 1
+
+    def score(self, row):
+        """
+        Returns the fraud probability of one raw feature row (shape (12,) or (1, 12)).
+
+        Raises:
+            TimeoutError: no result within result_timeout_seconds.
+            Exception: whatever score_batch raised for the batch holding the row.
+        """
+        if self._collector is None:
+            self._start()
+        future = Future()
+        self._queue.put((row, future, time.perf_counter()))
+        return future.result(timeout=self.result_timeout_seconds)
+
+    def _start(self):
+        with self._start_lock:
+            if self._collector is None:
+                self._collector = threading.Thread(target=self._collect, name="ml-micro-batcher", daemon=True)
+                self._collector.start()
+
+    def _next_batch(self):
+        """Blocks for the first row, then gathers more within the adaptive window."""
+        batch = [self._queue.get()]
+        deadline = batch[0][2] + self.max_wait_seconds
+        # The previous batch size estimates how many callers overlap; no point waiting beyond it
+        target = min(self._last_batch_rows, self.max_batch_rows)
+        while len(batch) < self.max_batch_rows:
+            try:
+                # Rows already queued are always taken; waiting only happens under load
+                if len(batch) < target:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        break
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        self._last_batch_rows = len(batch)
+        return batch
+
+    def _collect(self):
+        while True:
+            batch = self._next_batch()
+            started = time.perf_counter()
+            for _, _, enqueued_at in batch:
+                REGISTRY.observe_component("ml_micro_batch_queue", started - enqueued_at)
+            REGISTRY.observe_payload("ml_micro_batch_size", len(batch))
+
+            futures = [future for _, future, _ in batch]
+            try:
+                X = np.vstack([row for row, _, _ in batch])
+                probabilities = self.score_batch(X)
+            except Exception as e:
+                REGISTRY.observe_component("ml_micro_batch_score", time.perf_counter() - started, error=True)
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            REGISTRY.observe_component("ml_micro_batch_score", time.perf_counter() - started)
+            for future, probability in zip(futures, probabilities):
+                future.set_result(probability)
@@ -0,0 +1,227 @@
+"""
+model_registry.py - Lazy, process-wide loading of the ML model artifacts
+
+Nothing is loaded at import. The first scoring call (or preload()) loads the
+artifacts for the configured inference backend:
+
+* lightgbm / compiled: the pickled LGBMClassifier and scaler (imports joblib,
+  lightgbm and sklearn), scored with the native booster or the compiled evaluator.
+* flat: the forest and folded MinMax scaler exported by export_flat_model() as .npy
+  files and memory-mapped read-only. No pickle, lightgbm or sklearn import, and
+  all processes share the pages through the page cache.
+* quantized: the single-file QuantizedForest exported by export_quantized_model()
+  (binned thresholds with the scaler folded in, int16/float32 leaves), memory-mapped;
+  only the log transform runs before it.
+
+Under gunicorn, gunicorn.conf.py preloads in the master so forked workers inherit
+the loaded artifacts copy-on-write instead of loading their own.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_PATH = os.path.join(BASE_DIR, "lightGBM_fraud_model_final_modified.pkl")
+SCALER_PATH = os.path.join(BASE_DIR, "modified_scaler.pkl")
+DEFAULT_FLAT_MODEL_DIR = os.path.join(BASE_DIR, "flat_model")
+DEFAULT_QUANTIZED_MODEL_PATH = os.path.join(BASE_DIR, "quantized_model.bin")
+
+_FLAT_MODEL_META = "model.json"
+
+logger = logging.getLogger(__name__)
+
+INFERENCE_BACKENDS = ("lightgbm", "compiled", "flat", "quantized")
+
+
+class ModelArtifacts:
+    """Everything the scoring path needs; model/scaler/booster are None for the flat backend."""
+
+    __slots__ = ("backend", "model", "scaler", "booster", "predict_proba", "scale", "min", "clip", "scaler_folded")
+
+    def __init__(self, backend, predict_proba, scale, min_, clip, model=None, scaler=None, booster=None,
+                 scaler_folded=False):
+        self.backend = backend
+        # Positive-class probability for a preprocessed (n, 12) float64 matrix
+        self.predict_proba = predict_proba
+        # Folded MinMaxScaler (None when the scaler has to be called through sklearn)
+        self.scale = scale
+        self.min = min_
+        self.clip = clip
+        # The scaler is part of the model's split thresholds: preprocessing stops after the log transform
+        self.scaler_folded = scaler_folded
+        self.model = model
+        self.scaler = scaler
+        self.booster = booster
+
+
+def load_pickled_model():
+    """Unpickles the LightGBM classifier and the scaler pipeline."""
+    import joblib
+
+    with open(MODEL_PATH, "rb") as model_file:
+        model = joblib.load(model_file)
+
+    # Ensure compatibility for CPU-based execution
+    if hasattr(model, "set_params"):
+        model.set_params(n_jobs=-1)
+
+    with open(SCALER_PATH, "rb") as scaler_file:
+        scaler = joblib.load(scaler_file)
+    return model, scaler
+
+
+def _file_sha256(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def fold_scaler(scaler):
+    """
+    Returns (scale, min, clip) of a MinMaxScaler (or a Pipeline holding only one),
+    so the transform can be applied directly to an array; (None, None, None) otherwise.
+    """
+    minmax = scaler.steps[-1][1] if hasattr(scaler, "steps") and len(scaler.steps) == 1 else scaler
+    if not (hasattr(minmax, "scale_") and hasattr(minmax, "min_")):
+        return None, None, None
+    clip = tuple(minmax.feature_range) if getattr(minmax, "clip", False) else None
+    return np.asarray(minmax.scale_, dtype=np.float64), np.asarray(minmax.min_, dtype=np.float64), clip
+
+
+def export_flat_model(directory=DEFAULT_FLAT_MODEL_DIR):
+    """Compiles the pickled model and scaler into the memory-mappable flat format."""
+    from ML_component.compiled_model import CompiledForest
+
+    model, scaler = load_pickled_model()
+    scale, min_, clip = fold_scaler(scaler)
+    if scale is None:
+        raise ValueError("The flat model format needs a MinMaxScaler")
+
+    CompiledForest.from_booster(model.booster_).save(directory)
+    np.save(os.path.join(directory, "scaler_scale.npy"), scale)
+    np.save(os.path.join(directory, "scaler_min.npy"), min_)
+    meta = {**_source_hashes(), "scaler_clip": list(clip) if clip is not None else None}
+    with open(os.path.join(directory, _FLAT_MODEL_META), "w") as f:
+        json.dump(meta, f, indent=2)
+
+
+def _source_hashes():
+    return {
+        "source_model": os.path.basename(MODEL_PATH),
+        "source_model_sha256": _file_sha256(MODEL_PATH),
+        "source_scaler": os.path.basename(SCALER_PATH),
+        "source_scaler_sha256": _file_sha256(SCALER_PATH),
+    }
+
+
+def _check_source_hashes(meta):
+    # A retrained pickle without a re-export must not be shadowed by the old export
+    for path, key in ((MODEL_PATH, "source_model_sha256"), (SCALER_PATH, "source_scaler_sha256")):
+        if os.path.exists(path) and _file_sha256(path) != meta.get(key):
+            raise ValueError(f"{os.path.basename(path)} changed since the model was exported")
+
+
+def export_quantized_model(path=DEFAULT_QUANTIZED_MODEL_PATH, leaf_dtype="int16"):
+    """Compiles the pickled model and scaler into the single-file quantized format."""
+    from ML_component.compiled_model import CompiledForest
+    from ML_component.quantized_model import QuantizedForest
+
+    model, scaler = load_pickled_model()
+    scale, min_, clip = fold_scaler(scaler)
+    if scale is None:
+        raise ValueError("The quantized model format needs a MinMaxScaler")
+
+    forest = QuantizedForest.from_compiled(CompiledForest.from_booster(model.booster_), scale, min_, clip, leaf_dtype)
+    forest.save(path, meta=_source_hashes())
+
+
+class ModelRegistry:
+    """Loads the artifacts for one backend exactly once per process, on first use."""
+
+    def __init__(self, backend="lightgbm", flat_model_dir=DEFAULT_FLAT_MODEL_DIR,
+                 quantized_model_path=DEFAULT_QUANTIZED_MODEL_PATH):
+        if backend not in INFERENCE_BACKENDS:
+            raise ValueError(f"Unknown inference backend '{backend}'. Allowed: {list(INFERENCE_BACKENDS)}")
+        self.backend = backend
+        self.flat_model_dir = flat_model_dir
+        self.quantized_model_path = quantized_model_path
+        self._artifacts = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._artifacts is not None
+
+    def get(self):
+        """Returns the ModelArtifacts, loading them on the first call."""
+        artifacts = self._artifacts
+        if artifacts is None:
+            with self._lock:
+                if self._artifacts is None:
+                    self._artifacts = self._load()
+                artifacts = self._artifacts
+        return artifacts
+
+    def preload(self):
+        """Loads the artifacts now (e.g. in the gunicorn master before workers fork)."""
+        self.get()
+
+    def _load(self):
+        if self.backend == "flat":
+            try:
+                return self._load_flat()
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Flat model unavailable ({e}); loading the pickled model instead")
+        elif self.backend == "quantized":
+            try:
+                return self._load_quantized()
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Quantized model unavailable ({e}); loading the pickled model instead")
+
+        model, scaler = load_pickled_model()
+        booster = model.booster_
+        scale, min_, clip = fold_scaler(scaler)
+
+        # A flat backend that could not be loaded falls back to the native booster
+        backend = "compiled" if self.backend == "compiled" else "lightgbm"
+        if backend == "compiled":
+            from ML_component.compiled_model import CompiledForest
+            predict_proba = CompiledForest.from_booster(booster).predict
+        else:
+            predict_proba = booster.predict
+
+        return ModelArtifacts(backend, predict_proba, scale, min_, clip,
+                              model=model, scaler=scaler, booster=booster)
+
+    def _load_flat(self):
+        from ML_component.compiled_model import CompiledForest
+
+        with open(os.path.join(self.flat_model_dir, _FLAT_MODEL_META)) as f:
+            meta = json.load(f)
+
+        _check_source_hashes(meta)
+
+        forest = CompiledForest.load(self.flat_model_dir, mmap=True)
+        scale = np.asarray(np.load(os.path.join(self.flat_model_dir, "scaler_scale.npy"), mmap_mode="r"))
+        min_ = np.asarray(np.load(os.path.join(self.flat_model_dir, "scaler_min.npy"), mmap_mode="r"))
+        clip = tuple(meta["scaler_clip"]) if meta.get("scaler_clip") is not None else None
+        return ModelArtifacts("flat", forest.predict, scale, min_, clip)
+
+    def _load_quantized(self):
+        from ML_component.quantized_model import QuantizedForest
+
+        forest, meta = QuantizedForest.load(self.quantized_model_path, mmap=True)
+        _check_source_hashes(meta)
+        return ModelArtifacts("quantized", forest.predict, None, None, None, scaler_folded=True)
+
+
+if __name__ == "__main__":
+    import sys
+
+    target = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_FLAT_MODEL_DIR
+    export_flat_model(target)
+    print(f"Flat model written to {target}")
@@ -0,0 +1,387 @@
+"""
+quantized_model.py - Compact quantized LightGBM forest with the scaler folded in
+
+Export format for the "quantized" inference backend, built from a CompiledForest and
+the folded MinMaxScaler:
+
+* Scaler folded into the splits: a split "x * scale + min <= threshold" on a scaled
+  feature becomes "sign * x <= sign * (threshold - min) / scale" on the log-transformed
+  feature, so no scaling step runs at inference. Clipping scalers turn splits outside
+  the clip range into always-left / always-right ones.
+* Quantized thresholds: the distinct split thresholds of each feature form a sorted cut
+  table. A batch is binned once (one searchsorted per feature) and every split compares
+  the bin index with a uint8 (uint16 past 255 cuts) threshold index. Binning is exact:
+  bin(x) <= k exactly when x <= cut[k], which is what single rows test directly.
+* Leaf values as int16 with one scale factor (error <= scale / 2 per tree), or float32.
+  Node indices use the smallest integer type that fits.
+
+Evaluation mirrors CompiledForest: the bitvector layout for single rows, node traversal
+for batches. Only splits without missing-value rules are supported (NaN inputs count as
+0.0, which is what LightGBM does for them; the log transform never produces NaN).
+
+Everything is written to one binary file - a JSON header followed by 64-byte aligned
+arrays - and load() memory-maps it, so workers share one copy through the page cache.
+
+    python -m ML_component.quantized_model [--leaf-dtype int16|float32] [--output PATH]
+
+exports the pickled model and prints the accuracy report against it
+(verify_quantized_model) on synthetic_transaction_data.csv.
+"""
+
+import json
+import struct
+
+import numpy as np
+
+from ML_component.compiled_model import (
+    _ALL_LEAVES, _BITVECTOR_MAX_ROWS, _BLOCK_ROWS, MISSING_NONE, CompiledForest, _build_bitvector,
+)
+
+_MAGIC = b"FRAUDQM\x00"
+_FORMAT_VERSION = 1
+_ALIGNMENT = 64
+LEAF_DTYPES = ("int16", "float32")
+
+# Arrays written by QuantizedForest.save(), in constructor order
+_ARRAYS = ("feature_sign", "cut_offsets", "cuts", "roots", "feature", "threshold_bin", "left", "right", "value")
+_BITVECTOR_ARRAYS = ("feature", "threshold_bin", "left_leaves_removed", "tree_starts", "leaf_offsets", "leaf_values")
+
+
+def _index_dtype(max_value):
+    for dtype in (np.int16, np.int32):
+        if max_value <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+class QuantizedForest:
+    """Evaluator over binned features, quantized leaves and folded scaler thresholds."""
+
+    def __init__(self, feature_sign, cut_offsets, cuts, roots, feature, threshold_bin, left, right, value,
+                 max_depth, sigmoid=1.0, leaf_scale=1.0, bitvector=None):
+        self.feature_sign = np.asarray(feature_sign, dtype=np.float64)
+        self.cut_offsets = np.asarray(cut_offsets)
+        self.cuts = np.asarray(cuts, dtype=np.float64)
+        self.roots = np.asarray(roots)
+        self.feature = np.asarray(feature)
+        self.threshold_bin = np.asarray(threshold_bin)
+        self.left = np.asarray(left)
+        self.right = np.asarray(right)
+        self.value = np.asarray(value)
+        self.max_depth = int(max_depth)
+        self.sigmoid = float(sigmoid)
+        # Raw margin = sum of leaf values * leaf_scale (1.0 for float32 leaves)
+        self.leaf_scale = float(leaf_scale)
+        self.n_features = len(self.feature_sign)
+        self._flip = bool(np.any(self.feature_sign < 0))
+        # Per-feature cut tables as views, so binning does not slice on every call
+        self._feature_cuts = [self.cuts[self.cut_offsets[f]:self.cut_offsets[f + 1]] for f in range(self.n_features)]
+        self._bin_dtype = np.uint8 if np.max(np.diff(self.cut_offsets), initial=0) <= 255 else np.uint16
+        self.bitvector = bitvector if bitvector is not None else self._build_bitvector()
+        # Single rows skip binning: each split compares against its cut value directly
+        self._row_thresholds = None
+        if self.bitvector is not None:
+            bv = self.bitvector
+            self._row_thresholds = self.cuts[self.cut_offsets[bv["feature"]] + bv["threshold_bin"]]
+
+    @classmethod
+    def from_compiled(cls, forest, scale, min_, clip=None, leaf_dtype="int16"):
+        """Quantizes a CompiledForest trained on features scaled as x * scale + min_ (then clipped)."""
+        if leaf_dtype not in LEAF_DTYPES:
+            raise ValueError(f"Unknown leaf dtype '{leaf_dtype}'. Allowed: {list(LEAF_DTYPES)}")
+        if np.any(forest.missing_type != MISSING_NONE):
+            raise ValueError("Splits with missing-value rules are not supported by the quantized format")
+
+        scale = np.asarray(scale, dtype=np.float64)
+        min_ = np.asarray(min_, dtype=np.float64)
+        n_features = len(scale)
+        is_leaf = forest.left == np.arange(len(forest.left))
+        splits = np.flatnonzero(~is_leaf)
+
+        # Fold the scaler: thresholds move to the log-transformed feature's space; a
+        # negative scale flips the comparison, handled by negating the feature
+        feature_sign = np.where(scale < 0, -1.0, 1.0)
+        split_feature = forest.feature[splits]
+        raw_threshold = forest.threshold[splits]
+        split_scale = scale[split_feature]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            folded = feature_sign[split_feature] * (raw_threshold - min_[split_feature]) / split_scale
+        # Zero scale: the scaled feature is the constant min, the split always goes one way
+        constant = split_scale == 0
+        folded[constant] = np.where(min_[split_feature][constant] <= raw_threshold[constant], np.inf, -np.inf)
+        if clip is not None:
+            low, high = clip
+            folded[raw_threshold >= high] = np.inf
+            folded[raw_threshold < low] = -np.inf
+
+        # Per-feature cut tables and the bin index of every split threshold
+        cut_tables = [np.unique(folded[split_feature == f]) for f in range(n_features)]
+        cut_offsets = np.concatenate([[0], np.cumsum([len(table) for table in cut_tables])]).astype(np.int32)
+        bin_dtype = np.uint8 if max(len(table) for table in cut_tables) <= 256 else np.uint16
+        threshold_bin = np.zeros(len(forest.feature), dtype=bin_dtype)
+        for f in range(n_features):
+            on_feature = split_feature == f
+            threshold_bin[splits[on_feature]] = np.searchsorted(cut_tables[f], folded[on_feature])
+
+        leaf_values = forest.value[is_leaf]
+        if leaf_dtype == "int16":
+            max_abs = float(np.max(np.abs(leaf_values), initial=0.0))
+            leaf_scale = max_abs / np.iinfo(np.int16).max if max_abs > 0 else 1.0
+            value = np.zeros(len(forest.value), dtype=np.int16)
+            value[is_leaf] = np.round(leaf_values / leaf_scale).astype(np.int16)
+        else:
+            leaf_scale = 1.0
+            value = np.zeros(len(forest.value), dtype=np.float32)
+            value[is_leaf] = leaf_values
+
+        node_dtype = _index_dtype(len(forest.feature))
+        return cls(
+            feature_sign.astype(np.int8), cut_offsets, np.concatenate(cut_tables) if cut_tables else np.empty(0),
+            forest.roots.astype(node_dtype), forest.feature.astype(np.uint8 if n_features <= 256 else np.uint16),
+            threshold_bin, forest.left.astype(node_dtype), forest.right.astype(node_dtype), value,
+            forest.max_depth, forest.sigmoid, leaf_scale,
+        )
+
+    def _build_bitvector(self):
+        bitvector = _build_bitvector(
+            self.roots.astype(np.int64), self.feature.astype(np.int64), self.threshold_bin.astype(np.float64),
+            self.left.astype(np.int64), self.right.astype(np.int64), np.zeros(len(self.feature), dtype=bool),
+            np.zeros(len(self.feature), dtype=np.int8), self.value.astype(np.float64),
+        )
+        if bitvector is None:
+            return None
+        return {
+            "feature": bitvector["feature"].astype(np.intp),
+            "threshold_bin": bitvector["threshold"].astype(self.threshold_bin.dtype),
+            "left_leaves_removed": bitvector["left_leaves_removed"],
+            "tree_starts": bitvector["tree_starts"].astype(np.int32),
+            "leaf_offsets": bitvector["leaf_offsets"].astype(np.int32),
+            "leaf_values": bitvector["leaf_values"].astype(self.value.dtype),
+            "constant": bitvector["constant"],
+        }
+
+    # ---------------- Persistence ----------------
+
+    def save(self, path, meta=None):
+        """Writes the forest (and optional extra meta) as one binary file."""
+        arrays = {name: getattr(self, name) for name in _ARRAYS}
+        arrays["feature_sign"] = self.feature_sign.astype(np.int8)
+        if self.bitvector is not None:
+            arrays.update({f"bitvector_{name}": self.bitvector[name] for name in _BITVECTOR_ARRAYS})
+
+        layout = {}
+        offset = 0
+        for name, array in arrays.items():
+            array = np.ascontiguousarray(array)
+            arrays[name] = array
+            layout[name] = {"dtype": array.dtype.str, "shape": list(array.shape), "offset": offset}
+            offset += -(-array.nbytes // _ALIGNMENT) * _ALIGNMENT
+
+        header = json.dumps({
+            "format_version": _FORMAT_VERSION,
+            "max_depth": self.max_depth,
+            "sigmoid": self.sigmoid,
+            "leaf_scale": self.leaf_scale,
+            "bitvector_constant": self.bitvector["constant"] if self.bitvector is not None else None,
+            "arrays": layout,
+            "meta": meta or {},
+        }).encode("utf-8")
+        data_start = -(-(len(_MAGIC) + 4 + len(header)) // _ALIGNMENT) * _ALIGNMENT
+
+        with open(path, "wb") as f:
+            f.write(_MAGIC + struct.pack("<I", len(header)) + header)
+            for name, array in arrays.items():
+                f.seek(data_start + layout[name]["offset"])
+                f.write(array.tobytes())
+            f.truncate(data_start + offset)
+
+    @staticmethod
+    def read_header(path):
+        with open(path, "rb") as f:
+            if f.read(len(_MAGIC)) != _MAGIC:
+                raise ValueError(f"{path} is not a quantized model file")
+            (header_size,) = struct.unpack("<I", f.read(4))
+            header = json.loads(f.read(header_size))
+        if header.get("format_version") != _FORMAT_VERSION:
+            raise ValueError(f"Unsupported quantized model format: {header.get('format_version')}")
+        header["data_start"] = -(-(len(_MAGIC) + 4 + header_size) // _ALIGNMENT) * _ALIGNMENT
+        return header
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Loads a file written by save(); returns (forest, meta). With mmap the arrays are
+        read-only views of the file's pages.
+        """
+        header = cls.read_header(path)
+        buffer = np.memmap(path, dtype=np.uint8, mode="r") if mmap else np.fromfile(path, dtype=np.uint8)
+        start = header["data_start"]
+
+        def array(name):
+            spec = header["arrays"][name]
+            dtype = np.dtype(spec["dtype"])
+            count = int(np.prod(spec["shape"], dtype=np.int64))
+            # Plain ndarray views; the memmap subclass would slow every operation
+            view = np.frombuffer(buffer, dtype=dtype, count=count, offset=start + spec["offset"])
+            return view.reshape(spec["shape"])
+
+        bitvector = None
+        if "bitvector_feature" in header["arrays"]:
+            bitvector = {name: array(f"bitvector_{name}") for name in _BITVECTOR_ARRAYS}
+            bitvector["feature"] = bitvector["feature"].astype(np.intp)
+            bitvector["constant"] = header["bitvector_constant"]
+
+        forest = cls(*(array(name) for name in _ARRAYS), header["max_depth"], header["sigmoid"],
+                     header["leaf_scale"], bitvector=bitvector)
+        return forest, header["meta"]
+
+    @property
+    def nbytes(self):
+        """Size of all arrays the evaluator keeps."""
+        total = sum(getattr(self, name).nbytes for name in _ARRAYS)
+        if self.bitvector is not None:
+            total += sum(self.bitvector[name].nbytes for name in _BITVECTOR_ARRAYS)
+        return total
+
+    # ---------------- Evaluation ----------------
+
+    def bin(self, X):
+        """Bin index of every (log-transformed, unscaled) feature value: (n, n_features) uint8/uint16."""
+        if self._flip:
+            X = X * self.feature_sign
+        bins = np.empty(X.shape, dtype=self._bin_dtype)
+        for f, cuts in enumerate(self._feature_cuts):
+            column = X[:, f]
+            # NaN counts as 0.0, as for splits without a missing-value rule
+            if np.isnan(column).any():
+                column = np.where(np.isnan(column), 0.0, column)
+            bins[:, f] = np.searchsorted(cuts, column)
+        return bins
+
+    def _raw_block_bitvector(self, bins):
+        bv = self.bitvector
+        go_left = bins[:, bv["feature"]] <= bv["threshold_bin"]
+        masks = np.where(go_left, _ALL_LEAVES, bv["left_leaves_removed"])
+        remaining = np.bitwise_and.reduceat(masks, bv["tree_starts"], axis=1)
+        lowest = remaining & (~remaining + np.uint64(1))
+        leaf_position = np.log2(lowest.astype(np.float64)).astype(np.intp)
+        leaves = bv["leaf_values"][bv["leaf_offsets"] + leaf_position]
+        return leaves.sum(axis=1, dtype=np.float64) * self.leaf_scale + bv["constant"]
+
+    def _raw_row_bitvector(self, row):
+        # 1D specialisation: x <= cut[k] is the same test as bin(x) <= k
+        bv = self.bitvector
+        if self._flip:
+            row = row * self.feature_sign
+        if np.isnan(row).any():
+            row = np.where(np.isnan(row), 0.0, row)
+        go_left = row.take(bv["feature"]) <= self._row_thresholds
+        masks = np.where(go_left, _ALL_LEAVES, bv["left_leaves_removed"])
+        remaining = np.bitwise_and.reduceat(masks, bv["tree_starts"])
+        lowest = remaining & (~remaining + np.uint64(1))
+        leaf_position = np.log2(lowest.astype(np.float64)).astype(np.intp)
+        leaves = bv["leaf_values"].take(bv["leaf_offsets"] + leaf_position)
+        return leaves.sum(dtype=np.float64) * self.leaf_scale + bv["constant"]
+
+    def _raw_block(self, X):
+        if self.bitvector is not None and X.shape[0] <= _BITVECTOR_MAX_ROWS:
+            if X.shape[0] == 1:
+                return np.array([self._raw_row_bitvector(X[0])])
+            return self._raw_block_bitvector(self.bin(X))
+        bins = self.bin(X)
+
+        n_rows = X.shape[0]
+        row_index = np.arange(n_rows)[:, None]
+        nodes = np.broadcast_to(self.roots.astype(np.intp), (n_rows, self.roots.shape[0])).copy()
+        for _ in range(self.max_depth):
+            go_left = bins[row_index, self.feature[nodes]] <= self.threshold_bin[nodes]
+            nodes = np.where(go_left, self.left[nodes], self.right[nodes])
+        return self.value[nodes].sum(axis=1, dtype=np.float64) * self.leaf_scale
+
+    def predict_raw(self, X):
+        """Raw margin scores for a 2D float64 matrix of log-transformed, unscaled features."""
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim == 1:
+            X = X[None, :]
+        if X.shape[0] <= _BLOCK_ROWS:
+            return self._raw_block(X)
+        return np.concatenate([
+            self._raw_block(X[start:start + _BLOCK_ROWS])
+            for start in range(0, X.shape[0], _BLOCK_ROWS)
+        ])
+
+    def predict(self, X):
+        """Positive-class probability for log-transformed features (the scaler is folded in)."""
+        return 1.0 / (1.0 + np.exp(-self.sigmoid * self.predict_raw(X)))
+
+
+def verify_quantized_model(csv_path, forest=None, decision_thresholds=(0.5, 0.92)):
+    """
+    Compares the quantized evaluator (log transform only) with the pickled model's
+    predict_proba after the full log transform + scaler on a CSV of raw features.
+
+    Returns:
+        dict with probability differences, how many rounded scores (4 decimals) and
+        threshold decisions agree, accuracy against the 'fraud' column when present,
+        and the array sizes.
+    """
+    import pandas as pd
+    from ML_component import fraud_detection_ml as fraud_ml
+    from ML_component.model_registry import fold_scaler, load_pickled_model
+
+    df = pd.read_csv(csv_path)
+    raw = df[fraud_ml.FEATURE_NAMES].to_numpy(dtype=np.float64)
+
+    model, scaler = load_pickled_model()
+    if forest is None:
+        scale, min_, clip = fold_scaler(scaler)
+        forest = QuantizedForest.from_compiled(CompiledForest.from_booster(model.booster_), scale, min_, clip)
+
+    logged = fraud_ml.log_transform_array(raw.copy())
+    expected = model.predict_proba(scaler.transform(pd.DataFrame(logged, columns=fraud_ml.FEATURE_NAMES)))[:, 1]
+    actual = np.concatenate([forest.predict(logged[i:i + 1]) for i in range(len(logged))]) if len(logged) else logged
+    batch = forest.predict(logged)
+
+    diff = np.abs(expected - actual)
+    report = {
+        "rows": int(len(expected)),
+        "max_abs_diff": float(diff.max()) if len(diff) else 0.0,
+        "mean_abs_diff": float(diff.mean()) if len(diff) else 0.0,
+        "single_row_equals_batch": bool(np.array_equal(actual, batch)),
+        "rounded_scores_equal": int(np.sum(np.round(expected, 4) == np.round(actual, 4))),
+        "decisions_equal": {
+            str(threshold): int(np.sum((expected >= threshold) == (actual >= threshold)))
+            for threshold in decision_thresholds
+        },
+        "leaf_dtype": str(forest.value.dtype),
+        "array_bytes": int(forest.nbytes),
+    }
+    if "fraud" in df:
+        labels = df["fraud"].to_numpy()
+        report["accuracy"] = {
+            str(threshold): {
+                "original": float(np.mean((expected >= threshold) == labels)),
+                "quantized": float(np.mean((actual >= threshold) == labels)),
+            }
+            for threshold in decision_thresholds
+        }
+    return report
+
+
+if __name__ == "__main__":
+    import argparse
+    import os
+
+    from ML_component.model_registry import DEFAULT_QUANTIZED_MODEL_PATH, export_quantized_model
+
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description="Export the quantized model and report its accuracy")
+    parser.add_argument("--output", default=DEFAULT_QUANTIZED_MODEL_PATH)
+    parser.add_argument("--leaf-dtype", choices=LEAF_DTYPES, default="int16")
+    parser.add_argument("--csv", default=os.path.join(base_dir, "synthetic_transaction_data.csv"))
+    args = parser.parse_args()
+
+    export_quantized_model(args.output, args.leaf_dtype)
+    forest, _ = QuantizedForest.load(args.output)
+    print(f"Quantized model written to {args.output} ({os.path.getsize(args.output)} bytes)")
+    print(json.dumps(verify_quantized_model(args.csv, forest), indent=2))
@@ -1,14 +1,22 @@
-from flask import Flask, request, jsonify
-from controller import process_transaction
-from validation_logic import validate_request
+from flask import Flask, Response, request, jsonify
+from controller import process_transaction, process_transaction_batch, record_withdrawal_outcomes
+from validation_logic import validate_batch, validate_request
+from metrics import REGISTRY
+from json_codec import FastJSONProvider
 import logging
 
 # Initialize Flask app
 app = Flask(__name__)
 
+# Request parsing and jsonify() go through json_codec (orjson when installed)
+app.json = FastJSONProvider(app)
+
 # Set up logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 
+# Upper bound on the number of transactions accepted by the batch endpoint
+MAX_BATCH_SIZE = 5000
+
 
 @app.route('/detect_fraud', methods=['POST'])
 def detect_fraud():
@@ -26,7 +34,8 @@ def detect_fraud():
             return jsonify({"error": "Request must be in JSON format", "reason": reason}), 400
 
         # Validate request using external validation function
-        validation_error = validate_request(data)
+        with REGISTRY.time_component("validation"):
+            validation_error = validate_request(data)
         if validation_error:
             logging.warning(validation_error[0]["reason"])
             return jsonify(validation_error[0]), validation_error[1]
@@ -46,8 +55,90 @@ def detect_fraud():
         return jsonify({"error": "Internal Server Error", "reason": reason}), 500
 
 
+@app.route('/detect_fraud/batch', methods=['POST'])
+def detect_fraud_batch():
+    try:
+        if request.content_type != "application/json":
+            reason = "Missing or incorrect 'Content-Type' header. Expected 'application/json'."
+            logging.warning(reason)
+            return jsonify({"error": "Invalid Content-Type", "reason": reason}), 400
+
+        # Batch body must be a non-empty JSON array of transaction requests
+        data = request.get_json(silent=True)
+        if not isinstance(data, list) or not data:
+            reason = "Batch request body must be a non-empty JSON array"
+            logging.warning(reason)
+            return jsonify({"error": "Request must be a JSON array", "reason": reason}), 400
+
+        if len(data) > MAX_BATCH_SIZE:
+            reason = f"Batch contains {len(data)} transactions. Maximum allowed: {MAX_BATCH_SIZE}"
+            logging.warning(reason)
+            return jsonify({"error": "Batch too large", "reason": reason}), 413
+
+        # Validate every item; invalid items get their own error entry
+        with REGISTRY.time_component("validation_batch"):
+            validation = validate_batch(data)
+        responses = [
+            {**error[0], "status": error[1]} if error else None
+            for error in validation.errors
+        ]
+        valid_positions = validation.valid_positions
+
+        logging.info(f"Received batch fraud detection request: {len(data)} items, {len(valid_positions)} valid")
+
+        # Process all valid transactions in one pass through the components
+        if valid_positions:
+            batch_results = process_transaction_batch([data[i] for i in valid_positions], validation.columns)
+            for position, result in zip(valid_positions, batch_results):
+                responses[position] = result
+
+        return jsonify({"results": responses}), 200
+
+    except Exception as e:
+        reason = f"Unexpected error: {str(e)}"
+        logging.error(reason, exc_info=True)
+        return jsonify({"error": "Internal Server Error", "reason": reason}), 500
+
+
+@app.route('/withdrawal_outcomes', methods=['POST'])
+def withdrawal_outcomes():
+    try:
+        if request.content_type != "application/json":
+            reason = "Missing or incorrect 'Content-Type' header. Expected 'application/json'."
+            logging.warning(reason)
+            return jsonify({"error": "Invalid Content-Type", "reason": reason}), 400
+
+        # One outcome report or a non-empty JSON array of them
+        data = request.get_json(silent=True)
+        outcomes = [data] if isinstance(data, dict) else data
+        if not isinstance(outcomes, list) or not outcomes:
+            reason = "Body must be a withdrawal outcome or a non-empty JSON array of them"
+            logging.warning(reason)
+            return jsonify({"error": "Request must be a JSON object or array", "reason": reason}), 400
+
+        if len(outcomes) > MAX_BATCH_SIZE:
+            reason = f"Request contains {len(outcomes)} outcomes. Maximum allowed: {MAX_BATCH_SIZE}"
+            logging.warning(reason)
+            return jsonify({"error": "Batch too large", "reason": reason}), 413
+
+        response = record_withdrawal_outcomes(outcomes)
+        if response is None:
+            reason = "Withdrawal velocity counters are disabled (withdrawal config 'velocity_counters')"
+            logging.warning(reason)
+            return jsonify({"error": "Velocity counters disabled", "reason": reason}), 404
+
+        return jsonify(response), 200
+
+    except Exception as e:
+        reason = f"Unexpected error: {str(e)}"
+        logging.error(reason, exc_info=True)
+        return jsonify({"error": "Internal Server Error", "reason": reason}), 500
 
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    # Prometheus text exposition format
+    return Response(REGISTRY.render_prometheus(), mimetype="text/plain; version=0.0.4")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,328 @@
+"""
+asgi_app.py - Asynchronous serving mode: ASGI app with an off-loop compute pool
+
+Serves the same endpoints, bodies and status codes as app.py (Flask), but requests are
+accepted on an event loop and the CPU-bound pipeline runs in a bounded thread or
+process pool, so slow clients do not hold a worker and bursts queue up to a limit:
+
+* at most max_workers requests are processed and max_queue wait; beyond that the
+  request is answered with 429 and a Retry-After header right away
+* a request that is not finished within its deadline gets 503; if it is still queued
+  it is dropped, and work that starts after its deadline is skipped
+
+Settings are in the "async_server" section of controller_config.json. Run with
+
+    uvicorn asgi_app:app --port 8000
+    gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi_app:app
+
+With "pool": "process" the pipeline runs in child processes forked after the model is
+loaded; their stage metrics stay in the children and are not part of /metrics.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from controller import preload_components, process_transaction, process_transaction_batch, record_withdrawal_outcomes
+from json_codec import dumps_bytes, loads
+from metrics import REGISTRY
+from validation_logic import validate_batch, validate_request
+
+# Set up logging
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "controller_config.json")
+with open(CONFIG_PATH, "r") as file:
+    SERVER_CONFIG = json.load(file).get("async_server", {})
+
+POOL_MODE = SERVER_CONFIG.get("pool", "thread")
+POOL_WORKERS = SERVER_CONFIG.get("max_workers", 4)
+MAX_QUEUE = SERVER_CONFIG.get("max_queue", 32)
+REQUEST_TIMEOUT = SERVER_CONFIG.get("request_timeout_seconds", 10.0)
+BATCH_TIMEOUT = SERVER_CONFIG.get("batch_timeout_seconds", 60.0)
+MAX_BODY_BYTES = SERVER_CONFIG.get("max_body_bytes", 64 * 1024 * 1024)
+RETRY_AFTER_SECONDS = SERVER_CONFIG.get("retry_after_seconds", 1)
+
+# Same limit as the Flask batch endpoint
+MAX_BATCH_SIZE = 5000
+
+_CONTENT_TYPE_REASON = "Missing or incorrect 'Content-Type' header. Expected 'application/json'."
+
+
+class DeadlineExceeded(Exception):
+    """The request's deadline passed before a pool worker picked it up."""
+
+
+def _call_before_deadline(deadline, func, *args):
+    """Runs in the pool: skips work whose client has already been answered with 503."""
+    if time.monotonic() > deadline:
+        raise DeadlineExceeded()
+    return func(*args)
+
+
+class ComputePool:
+    """
+    Thread or process pool that admits at most max_workers + max_queue calls at a time.
+    Admission happens on the event loop; completion (also by cancellation) frees the slot.
+    """
+
+    def __init__(self, mode=POOL_MODE, max_workers=POOL_WORKERS, max_queue=MAX_QUEUE):
+        if mode not in ("thread", "process"):
+            raise ValueError(f"Unknown pool mode '{mode}'. Allowed: ['thread', 'process']")
+        self.mode = mode
+        self.max_workers = max_workers
+        self.capacity = max_workers + max_queue
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        if mode == "process":
+            # Children fork from a process that already holds the model
+            preload_components()
+            self._executor = ProcessPoolExecutor(max_workers=max_workers)
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="fraud-asgi")
+
+    @property
+    def in_flight(self):
+        return self._in_flight
+
+    def try_submit(self, func, *args):
+        """Returns a concurrent.futures.Future, or None when the pool is saturated."""
+        with self._lock:
+            if self._in_flight >= self.capacity:
+                return None
+            self._in_flight += 1
+        try:
+            future = self._executor.submit(func, *args)
+        except BaseException:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def _release(self, _future):
+        with self._lock:
+            self._in_flight -= 1
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+_pool = None
+
+
+def get_pool():
+    """The process-wide compute pool, created on first use (lifespan startup or first request)."""
+    global _pool
+    if _pool is None:
+        _pool = ComputePool()
+    return _pool
+
+
+async def run_in_pool(func, *args, timeout):
+    """
+    Runs func(*args) in the compute pool.
+
+    Returns:
+        (status, body): (200, result), (429, error body) when saturated, or
+        (503, error body) when the deadline passes first.
+    """
+    deadline = time.monotonic() + timeout
+    future = get_pool().try_submit(_call_before_deadline, deadline, func, *args)
+    if future is None:
+        REGISTRY.increment("async_rejected_busy")
+        reason = "Too many requests in progress. Retry later."
+        logger.warning(reason)
+        return 429, {"error": "Server busy", "reason": reason}
+
+    try:
+        # Cancelling the wrapper on timeout also cancels the pool future if it has not started
+        return 200, await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+    except (asyncio.TimeoutError, DeadlineExceeded):
+        REGISTRY.increment("async_deadline_exceeded")
+        reason = f"Request was not processed within {timeout}s"
+        logger.warning(reason)
+        return 503, {"error": "Deadline exceeded", "reason": reason}
+
+
+def _detect_fraud_batch_job(items):
+    """Validation and processing of a whole batch, run in the pool (validation is O(batch))."""
+    with REGISTRY.time_component("validation_batch"):
+        validation = validate_batch(items)
+    responses = [{**error[0], "status": error[1]} if error else None for error in validation.errors]
+    valid_positions = validation.valid_positions
+
+    logger.info(f"Received batch fraud detection request: {len(items)} items, {len(valid_positions)} valid")
+
+    if valid_positions:
+        batch_results = process_transaction_batch([items[i] for i in valid_positions], validation.columns)
+        for position, result in zip(valid_positions, batch_results):
+            responses[position] = result
+    return {"results": responses}
+
+
+async def detect_fraud(data):
+    if not data:
+        reason = "Received non-JSON request or empty body"
+        logger.warning(reason)
+        return 400, {"error": "Request must be in JSON format", "reason": reason}
+
+    # Validation is cheap enough to stay on the event loop
+    with REGISTRY.time_component("validation"):
+        validation_error = validate_request(data)
+    if validation_error:
+        logger.warning(validation_error[0]["reason"])
+        return validation_error[1], validation_error[0]
+
+    logger.info("Received fraud detection request")
+    return await run_in_pool(process_transaction, data, timeout=REQUEST_TIMEOUT)
+
+
+async def detect_fraud_batch(data):
+    # Batch body must be a non-empty JSON array of transaction requests
+    if not isinstance(data, list) or not data:
+        reason = "Batch request body must be a non-empty JSON array"
+        logger.warning(reason)
+        return 400, {"error": "Request must be a JSON array", "reason": reason}
+
+    if len(data) > MAX_BATCH_SIZE:
+        reason = f"Batch contains {len(data)} transactions. Maximum allowed: {MAX_BATCH_SIZE}"
+        logger.warning(reason)
+        return 413, {"error": "Batch too large", "reason": reason}
+
+    return await run_in_pool(_detect_fraud_batch_job, data, timeout=BATCH_TIMEOUT)
+
+
+async def withdrawal_outcomes(data):
+    # One outcome report or a non-empty JSON array of them
+    outcomes = [data] if isinstance(data, dict) else data
+    if not isinstance(outcomes, list) or not outcomes:
+        reason = "Body must be a withdrawal outcome or a non-empty JSON array of them"
+        logger.warning(reason)
+        return 400, {"error": "Request must be a JSON object or array", "reason": reason}
+
+    if len(outcomes) > MAX_BATCH_SIZE:
+        reason = f"Request contains {len(outcomes)} outcomes. Maximum allowed: {MAX_BATCH_SIZE}"
+        logger.warning(reason)
+        return 413, {"error": "Batch too large", "reason": reason}
+
+    # O(1) per report, so recorded on the event loop
+    response = record_withdrawal_outcomes(outcomes)
+    if response is None:
+        reason = "Withdrawal velocity counters are disabled (withdrawal config 'velocity_counters')"
+        logger.warning(reason)
+        return 404, {"error": "Velocity counters disabled", "reason": reason}
+    return 200, response
+
+
+# path -> (method, handler taking the parsed JSON body)
+JSON_ROUTES = {
+    "/detect_fraud": ("POST", detect_fraud),
+    "/detect_fraud/batch": ("POST", detect_fraud_batch),
+    "/withdrawal_outcomes": ("POST", withdrawal_outcomes),
+}
+
+
+async def _read_body(receive):
+    """Returns the request body, or None when it exceeds MAX_BODY_BYTES."""
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            break
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            return None
+        chunks.append(chunk)
+        if not message.get("more_body", False):
+            break
+    return b"".join(chunks)
+
+
+async def _send(send, status, body, content_type=b"application/json", headers=()):
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode()), *headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _send_json(send, status, obj, headers=()):
+    # Same bytes as the Flask app's jsonify (json_codec.FastJSONProvider)
+    await _send(send, status, dumps_bytes(obj) + b"\n", headers=headers)
+
+
+async def _handle_http(scope, receive, send):
+    path, method = scope["path"], scope["method"]
+
+    if path == "/metrics":
+        if method not in ("GET", "HEAD"):
+            return await _send_json(send, 405, {"error": "Method Not Allowed"})
+        # Prometheus text exposition format
+        return await _send(send, 200, REGISTRY.render_prometheus().encode(),
+                           content_type=b"text/plain; version=0.0.4; charset=utf-8")
+
+    route = JSON_ROUTES.get(path)
+    if route is None:
+        return await _send_json(send, 404, {"error": "Not Found"})
+    if method != route[0]:
+        return await _send_json(send, 405, {"error": "Method Not Allowed"})
+
+    try:
+        content_type = dict(scope["headers"]).get(b"content-type", b"").decode("latin-1")
+        if content_type != "application/json":
+            logger.warning(_CONTENT_TYPE_REASON)
+            return await _send_json(send, 400, {"error": "Invalid Content-Type", "reason": _CONTENT_TYPE_REASON})
+
+        body = await _read_body(receive)
+        if body is None:
+            reason = f"Request body exceeds {MAX_BODY_BYTES} bytes"
+            logger.warning(reason)
+            return await _send_json(send, 413, {"error": "Request too large", "reason": reason})
+
+        try:
+            data = loads(body) if body else None
+        except ValueError:
+            # Invalid JSON is answered like an empty body
+            data = None
+
+        status, response = await route[1](data)
+        headers = [(b"retry-after", str(RETRY_AFTER_SECONDS).encode())] if status in (429, 503) else ()
+        await _send_json(send, status, response, headers)
+
+    except Exception as e:
+        reason = f"Unexpected error: {str(e)}"
+        logger.error(reason, exc_info=True)
+        await _send_json(send, 500, {"error": "Internal Server Error", "reason": reason})
+
+
+async def _handle_lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            try:
+                get_pool()
+            except Exception as e:
+                await send({"type": "lifespan.startup.failed", "message": str(e)})
+                return
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if _pool is not None:
+                _pool.shutdown()
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    """ASGI 3 entry point."""
+    if scope["type"] == "http":
+        await _handle_http(scope, receive, send)
+    elif scope["type"] == "lifespan":
+        await _handle_lifespan(receive, send)
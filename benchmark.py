@@ -0,0 +1,646 @@
+"""
+benchmark.py - Load-test / latency benchmark harness for the fraud detection pipeline
+
+Replaces mockTest.py. Drives the pipeline with synthetic requests built from
+synthetic_transaction_data.csv and expected_request.json, over a matrix of payload
+shapes, and reports throughput plus p50/p95/p99 for whole requests and for every
+stage recorded in metrics.REGISTRY (validation, each detector, final decision).
+
+Targets:
+    inprocess  validate_request + process_transaction called directly
+    flask      POST /detect_fraud through the Flask test client (no network)
+    http       POST to a running server (--url); only end-to-end latency is available
+
+Examples:
+    python benchmark.py --target inprocess --concurrency 1 4 --geo-points 0 1000 50000
+    python benchmark.py --target flask --transaction-types transfer --device-history 20 5000 --output results.json
+    python benchmark.py --compare old_results.json results.json
+    python benchmark.py --evaluate --target http --url http://127.0.0.1:5000/detect_fraud
+    python benchmark.py --cold-start 5 --output cold_start.json
+    python benchmark.py --clustering 1000 10000 100000 --output clustering.json
+
+Results are written as JSON (--output) with one entry per scenario, so runs of
+different releases can be diffed directly or with --compare.
+
+The result and ML score caches would answer repeated requests: in-process targets run
+with them disabled (--caches cold empties them per scenario and reports hit rates
+instead). State kept across requests must not carry over from one scenario to the
+next either, or latencies would depend on the scenario order: in-process targets
+empty the incremental cluster state, the local device history store, the last login
+cache and the withdrawal velocity counters before each scenario, and every scenario
+uses its own transaction and user ids (user_<run>_<n>), which is all the isolation an
+http target gets (its session userId/deviceId are those of expected_request.json).
+"""
+
+import argparse
+import copy
+import itertools
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CSV_PATH = os.path.join(BASE_DIR, "synthetic_transaction_data.csv")
+TEMPLATE_PATH = os.path.join(BASE_DIR, "expected_request.json")
+DEFAULT_URL = "http://127.0.0.1:5000/detect_fraud"
+
+# Threshold used by --evaluate to turn ML_fraud_score into a fraud label
+THRESHOLD = 0.92
+
+PERCENTILES = (50, 95, 99)
+
+# Feature shifted per request for targets whose caches cannot be disabled (--target http)
+UNIQUE_FEATURE = "Avg min between sent tnx"
+
+
+# ---------------------------------------------------------------------------
+# Payloads
+# ---------------------------------------------------------------------------
+
+class PayloadFactory:
+    """Builds requests of a given shape from the CSV rows and the request template."""
+
+    def __init__(self, seed=0, packed_geo=False):
+        self.rows = pd.read_csv(CSV_PATH)
+        self.labels = self.rows.pop("fraud").astype(int).tolist()
+        self.transaction_data = self.rows.astype(float).to_dict(orient="records")
+        with open(TEMPLATE_PATH) as f:
+            self.template = json.load(f)
+        # Variable-size fields are filled per shape (and shared, not copied, between requests)
+        self.template["geospacial_transaction_data_2d"] = []
+        self.template["login_data"]["device_history_last_3_days"] = []
+        self.seed = seed
+        self.packed_geo = packed_geo
+        self._geo_cache = {}
+        self._packed_geo_cache = {}
+        self._device_cache = {}
+
+    def _geo_history(self, count):
+        """Points spread over a few dense areas plus background noise around the session location."""
+        if count not in self._geo_cache:
+            rng = np.random.default_rng(self.seed)
+            centers = np.array([[12.32, 120.30], [12.35, 120.50], [14.60, 121.00]])
+            dense = centers[rng.integers(0, len(centers), count)] + rng.normal(0, 0.01, (count, 2))
+            noise = np.column_stack([rng.uniform(5, 20, count), rng.uniform(115, 125, count)])
+            points = np.where(rng.random(count)[:, None] < 0.8, dense, noise)
+            self._geo_cache[count] = [
+                {"latitude": f"{lat:.5f}", "longitude": f"{lon:.5f}"} for lat, lon in points
+            ]
+        return self._geo_cache[count]
+
+    def _packed_geo_history(self, count):
+        """Same points as _geo_history, base64 packed (geospacial_transaction_data_2d_b64)."""
+        if count not in self._packed_geo_cache:
+            from geospacial_clustering_component.geo_history import pack_geo_history
+            points = [(float(p["latitude"]), float(p["longitude"])) for p in self._geo_history(count)]
+            self._packed_geo_cache[count] = pack_geo_history(np.array(points).reshape(-1, 2))
+        return self._packed_geo_cache[count]
+
+    def _device_history(self, count):
+        if count not in self._device_cache:
+            self._device_cache[count] = [
+                {"userId": f"user{i % 97}", "deviceId": "device909", "timestamp": "2025-03-09T08:00:00Z"}
+                for i in range(count)
+            ]
+        return self._device_cache[count]
+
+    def build(self, index, transaction_type, geo_points, device_history, user_number=None, run_id=None,
+              unique_features=False):
+        """
+        Returns a fresh request for CSV row (index mod row count) with the given shape.
+
+        run_id makes the transaction and user ids unique per scenario. unique_features shifts one
+        feature by a negligible per-request amount, so the CSV rows repeating after 200
+        requests do not hit a server's ML score cache.
+        """
+        row = index % len(self.transaction_data)
+        request = copy.deepcopy(self.template)
+        request["login_data"]["device_history_last_3_days"] = self._device_history(device_history)
+        scope = "" if run_id is None else f"{run_id}_"
+        request["transaction_id"] = f"txn_{scope}{index}"
+        request["user_id"] = f"user_{scope}{user_number if user_number is not None else index}"
+        request["transaction_type"] = transaction_type
+        request["transaction_data"] = dict(self.transaction_data[row])
+        if unique_features:
+            request["transaction_data"][UNIQUE_FEATURE] += index * 1e-9
+        if self.packed_geo:
+            request["geospacial_transaction_data_2d_b64"] = self._packed_geo_history(geo_points)
+        else:
+            request["geospacial_transaction_data_2d"] = self._geo_history(geo_points)
+        if transaction_type != "withdrawal":
+            request.pop("withdrawal_data", None)
+        return request
+
+
+# ---------------------------------------------------------------------------
+# Targets
+# ---------------------------------------------------------------------------
+
+class InProcessTarget:
+    """Validation + controller in this process; stage latencies come from metrics.REGISTRY."""
+
+    name = "inprocess"
+
+    def __init__(self, args):
+        from controller import process_transaction
+        from metrics import REGISTRY
+        from validation_logic import validate_request
+
+        self._process_transaction = process_transaction
+        self._validate_request = validate_request
+        self.registry = REGISTRY
+
+    def send(self, payload):
+        with self.registry.time_component("validation"):
+            validation_error = self._validate_request(payload)
+        if validation_error:
+            return validation_error[1], validation_error[0]
+        return 200, self._process_transaction(payload)
+
+
+class FlaskTarget:
+    """The real Flask route (JSON parsing, validation, serialization) via its test client."""
+
+    name = "flask"
+
+    def __init__(self, args):
+        from app import app
+        from metrics import REGISTRY
+
+        self.app = app
+        self.registry = REGISTRY
+        self._local = threading.local()
+        # app.py configures INFO logging for every request; keep the benchmark output readable
+        logging.getLogger().setLevel(logging.WARNING)
+
+    def send(self, payload):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.post("/detect_fraud", json=payload)
+        return response.status_code, response.get_json()
+
+
+class HttpTarget:
+    """A running server; stage latencies are not visible from outside."""
+
+    name = "http"
+
+    def __init__(self, args):
+        import requests
+
+        self.url = args.url
+        self._requests = requests
+        self._local = threading.local()
+        self.registry = None
+
+    def send(self, payload):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = self._requests.Session()
+        response = session.post(self.url, json=payload)
+        try:
+            body = response.json()
+        except ValueError:
+            body = None
+        return response.status_code, body
+
+
+TARGETS = {"inprocess": InProcessTarget, "flask": FlaskTarget, "http": HttpTarget}
+
+
+# ---------------------------------------------------------------------------
+# Running and reporting
+# ---------------------------------------------------------------------------
+
+def summarize(samples):
+    """count/mean/max and the configured percentiles of a list of seconds."""
+    if not samples:
+        return {"count": 0}
+    values = np.asarray(samples, dtype=np.float64)
+    summary = {"count": int(values.size), "mean": float(values.mean()), "max": float(values.max())}
+    for p, value in zip(PERCENTILES, np.percentile(values, PERCENTILES)):
+        summary[f"p{p}"] = float(value)
+    return summary
+
+
+def _configure_caches(mode):
+    """
+    In-process targets: "off" disables the result and ML score caches for the run (the
+    default, so repeated shapes and wrapped CSV rows measure the pipeline); "cold" keeps
+    them and empties them before each scenario, whose hit rates are then reported.
+    """
+    import controller
+    from ML_component import fraud_detection_ml
+
+    if mode == "off":
+        controller.RESULT_CACHE = None
+        fraud_detection_ml.SCORE_CACHE = None
+        return
+    for cache in (controller.RESULT_CACHE, fraud_detection_ml.SCORE_CACHE):
+        if cache is not None and hasattr(cache.backend, "clear"):
+            cache.backend.clear()
+
+
+def _reset_stores():
+    """In-process targets: empties the per-process state that requests leave behind."""
+    from config_service import CONFIG_SERVICE
+    from geospacial_clustering_component.detect_geospatial_clusters import get_cluster_state_store
+    from login_anomalies_component.device_history_store import get_device_history_store
+    from login_anomalies_component.last_login_cache import get_last_login_cache
+    from withdrawal_anomalies_component.velocity_counters import get_withdrawal_velocity_counters
+
+    config = CONFIG_SERVICE.current
+    for store in (get_cluster_state_store(config.geospatial), get_device_history_store(config.login),
+                  get_last_login_cache(config.login), get_withdrawal_velocity_counters(config.withdrawal)):
+        # The Redis device history store is shared with other processes and left alone
+        if store is not None and hasattr(store, "clear"):
+            store.clear()
+
+
+def _cache_hit_rates(before, after):
+    rates = {}
+    for name in ("result", "ml_score"):
+        hits = after.get(f"{name}_cache_hits", 0) - before.get(f"{name}_cache_hits", 0)
+        misses = after.get(f"{name}_cache_misses", 0) - before.get(f"{name}_cache_misses", 0)
+        if hits + misses:
+            rates[name] = hits / (hits + misses)
+    return rates
+
+
+def run_scenario(target, factory, scenario, args, run_id=None):
+    """Runs warmup + measured requests for one scenario and returns its result entry."""
+    transaction_type, geo_points, device_history, concurrency = scenario
+    # A running server's caches cannot be switched off from here: every request is made unique
+    unique_features = target.registry is None
+
+    def payload(index):
+        user_number = index % args.users if args.users else None
+        return factory.build(index, transaction_type, geo_points, device_history, user_number, run_id, unique_features)
+
+    if target.registry is not None:
+        _configure_caches(args.caches)
+        _reset_stores()
+
+    # Payloads are built up front so their construction is not timed
+    warmup = [payload(i) for i in range(args.warmup)]
+    measured = [payload(args.warmup + i) for i in range(args.requests)]
+
+    for request in warmup:
+        target.send(request)
+    counters_before = {}
+    if target.registry is not None:
+        target.registry.drain_samples()
+        counters_before = target.registry.counters()
+
+    latencies = [0.0] * len(measured)
+    statuses = [0] * len(measured)
+
+    def send(index):
+        start = time.perf_counter()
+        try:
+            statuses[index], _ = target.send(measured[index])
+        except Exception as e:
+            logging.error(f"Request {index} failed: {str(e)}")
+            statuses[index] = -1
+        latencies[index] = time.perf_counter() - start
+
+    wall_start = time.perf_counter()
+    if concurrency == 1:
+        for index in range(len(measured)):
+            send(index)
+    else:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(send, range(len(measured))))
+    wall_seconds = time.perf_counter() - wall_start
+
+    stages = {}
+    cache_hit_rates = {}
+    if target.registry is not None:
+        stages = {stage: summarize(values) for stage, values in sorted(target.registry.drain_samples().items())}
+        cache_hit_rates = _cache_hit_rates(counters_before, target.registry.counters())
+
+    return {
+        "name": f"{target.name}/{transaction_type}/geo={geo_points}/devices={device_history}/c={concurrency}",
+        "target": target.name,
+        "transaction_type": transaction_type,
+        "geo_points": geo_points,
+        "device_history": device_history,
+        "concurrency": concurrency,
+        "requests": len(measured),
+        "errors": sum(1 for status in statuses if status != 200),
+        "wall_seconds": wall_seconds,
+        "throughput_rps": len(measured) / wall_seconds if wall_seconds > 0 else None,
+        "latency_seconds": {"request": summarize(latencies), "stages": stages},
+        "cache_hit_rates": cache_hit_rates,
+    }
+
+
+def _format_ms(summary, key):
+    value = summary.get(key)
+    return "-" if value is None else f"{value * 1000:.2f}"
+
+
+def print_scenario(result):
+    print(f"\n=== {result['name']} ===")
+    print(f"requests {result['requests']}  errors {result['errors']}  "
+          f"throughput {result['throughput_rps']:.1f} req/s  wall {result['wall_seconds']:.2f}s")
+    if result.get("cache_hit_rates"):
+        print("cache hit rates  " + "  ".join(f"{name} {rate:.1%}" for name, rate in result["cache_hit_rates"].items()))
+    print(f"  {'stage':<26}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    rows = [("request", result["latency_seconds"]["request"])] + list(result["latency_seconds"]["stages"].items())
+    for stage, summary in rows:
+        print(f"  {stage:<26}{summary['count']:>7}{_format_ms(summary, 'p50'):>10}{_format_ms(summary, 'p95'):>10}"
+              f"{_format_ms(summary, 'p99'):>10}{_format_ms(summary, 'max'):>10}")
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(args):
+    target = TARGETS[args.target](args)
+    factory = PayloadFactory(seed=args.seed, packed_geo=args.packed_geo)
+    if target.registry is not None:
+        target.registry.enable_sampling()
+
+    scenarios = list(itertools.product(args.transaction_types, args.geo_points, args.device_history, args.concurrency))
+    results = []
+    for number, scenario in enumerate(scenarios):
+        result = run_scenario(target, factory, scenario, args, run_id=number)
+        print_scenario(result)
+        results.append(result)
+
+    report = {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "argv": sys.argv[1:],
+        },
+        "scenarios": results,
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"\nResults written to {args.output}")
+    return report
+
+
+def compare_results(old_path, new_path):
+    """Prints p50/p99 and throughput changes for scenarios present in both result files."""
+    with open(old_path) as f:
+        old = {s["name"]: s for s in json.load(f)["scenarios"]}
+    with open(new_path) as f:
+        new = {s["name"]: s for s in json.load(f)["scenarios"]}
+
+    def change(before, after):
+        if not before or after is None:
+            return "-"
+        return f"{(after - before) / before * 100:+.1f}%"
+
+    for name in [name for name in new if name in old]:
+        before, after = old[name], new[name]
+        print(f"\n=== {name} ===")
+        print(f"  throughput {before['throughput_rps']:.1f} -> {after['throughput_rps']:.1f} req/s "
+              f"({change(before['throughput_rps'], after['throughput_rps'])})")
+        stages = [("request", before["latency_seconds"]["request"], after["latency_seconds"]["request"])]
+        stages += [(stage, before["latency_seconds"]["stages"].get(stage, {}), summary)
+                   for stage, summary in after["latency_seconds"]["stages"].items()]
+        for stage, old_summary, new_summary in stages:
+            print(f"  {stage:<26}p50 {change(old_summary.get('p50'), new_summary.get('p50')):>8}"
+                  f"  p99 {change(old_summary.get('p99'), new_summary.get('p99')):>8}")
+
+
+# Run in a fresh interpreter per sample; prints one JSON line
+_COLD_START_SCRIPT = """
+import json, resource, sys, time
+start = time.perf_counter()
+import app
+from controller import preload_components, process_transaction
+from validation_logic import validate_request
+imported = time.perf_counter()
+if sys.argv[2] == "preload":
+    preload_components()
+preloaded = time.perf_counter()
+with open(sys.argv[1]) as f:
+    payload = json.load(f)
+validate_request(payload)
+process_transaction(payload)
+first_request = time.perf_counter()
+validate_request(payload)
+process_transaction(payload)
+second_request = time.perf_counter()
+print(json.dumps({
+    "import_seconds": imported - start,
+    "preload_seconds": preloaded - imported,
+    "first_request_seconds": first_request - preloaded,
+    "second_request_seconds": second_request - first_request,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}))
+"""
+
+
+def measure_cold_start(args):
+    """
+    Measures start-up in fresh interpreters: import app, optional preload, first and second request.
+
+    "lazy" is a worker importing everything itself; "preload" also loads the model and
+    heavy imports up front, which under gunicorn (gunicorn.conf.py) happens once in the master.
+    """
+    results = {}
+    for mode in ("lazy", "preload"):
+        samples = []
+        for _ in range(args.cold_start):
+            completed = subprocess.run(
+                [sys.executable, "-W", "ignore", "-c", _COLD_START_SCRIPT, TEMPLATE_PATH, mode],
+                cwd=BASE_DIR, capture_output=True, text=True, check=True,
+                env={**os.environ, "PYTHONPATH": BASE_DIR},
+            )
+            samples.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+        results[mode] = {key: float(np.median([sample[key] for sample in samples])) for key in samples[0]}
+
+        print(f"\n=== cold start ({mode}, median of {len(samples)}) ===")
+        for key, value in results[mode].items():
+            print(f"  {key:<24}{value * 1000:>10.1f} ms" if key.endswith("seconds") else f"  {key:<24}{value:>10.1f}")
+
+    report = {"meta": {"created_at": datetime.now(timezone.utc).isoformat(), "git_revision": _git_revision(),
+                       "python": platform.python_version(), "argv": sys.argv[1:]},
+              "cold_start": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"\nResults written to {args.output}")
+    return report
+
+
+def evaluate_accuracy(args):
+    """Scores every CSV row through the target and reports classification metrics (former mockTest.py)."""
+    from sklearn.metrics import accuracy_score, classification_report, confusion_matrix
+
+    target = TARGETS[args.target](args)
+    factory = PayloadFactory(seed=args.seed)
+
+    scores = []
+    for index in range(len(factory.transaction_data)):
+        try:
+            status, result = target.send(factory.build(index, "withdrawal", 0, 1))
+            score = (result or {}).get("ML_fraud_score") if status == 200 else None
+        except Exception as e:
+            print(f"Error for index {index}: {e}")
+            score = None
+        scores.append(score or 0.0)
+
+    predictions = [1 if s >= THRESHOLD else 0 for s in scores]
+    print("=== Fraud Detection Model Evaluation ===")
+    print(f"Total samples: {len(scores)}")
+    print(f"Accuracy: {accuracy_score(factory.labels, predictions):.4f}")
+    print("\nConfusion Matrix:")
+    print(confusion_matrix(factory.labels, predictions))
+    print("\nClassification Report:")
+    print(classification_report(factory.labels, predictions))
+
+
+def benchmark_clustering(args):
+    """
+    Times the DBSCAN backends (see geospacial_clustering_component/grid_dbscan.py) on geo
+    histories of the --clustering sizes, with the eps/min_samples of the geospatial config.
+    A share of --clustering-repeats points repeats earlier ones (repeat merchants). Plain
+    sklearn is skipped above --clustering-sklearn-max points: its neighbourhood lists grow
+    quadratically in the dense areas. Memory is the peak resident set size above the
+    one before the fit (Linux only: the peak is reset through /proc/self/clear_refs).
+    """
+    from sklearn.cluster import DBSCAN
+    from sklearn.metrics import adjusted_rand_score
+
+    from config_service import CONFIG_SERVICE
+    from geospacial_clustering_component.grid_dbscan import GridDBSCAN
+
+    config = CONFIG_SERVICE.current.geospatial
+    eps_rad = config.eps_km / 6371
+    backend = GridDBSCAN(eps_rad, config.min_samples, config.grid_min_points, config.approximate_min_points,
+                         config.max_candidate_pairs)
+    factory = PayloadFactory(seed=args.seed)
+    rng = np.random.default_rng(args.seed)
+
+    def memory_kb(field):
+        with open("/proc/self/status") as status:
+            return next(int(line.split()[1]) for line in status if line.startswith(field))
+
+    def measure(fit):
+        try:
+            with open("/proc/self/clear_refs", "w") as clear_refs:
+                clear_refs.write("5")
+            resident = memory_kb("VmRSS:")
+        except OSError:
+            resident = None
+        start = time.perf_counter()
+        result = fit()
+        seconds = time.perf_counter() - start
+        peak = (memory_kb("VmHWM:") - resident) / 1024 if resident is not None else None
+        return result, {"seconds": seconds, "peak_mb": peak}
+
+    results = []
+    for size in args.clustering:
+        points = np.array([(float(p["latitude"]), float(p["longitude"])) for p in factory._geo_history(size)])
+        repeats = np.flatnonzero(rng.random(size) < args.clustering_repeats)
+        repeats = repeats[repeats > 0]
+        points[repeats] = points[rng.integers(0, repeats)]
+        entry = {"points": size, "distinct_points": int(len(np.unique(points, axis=0)))}
+
+        (labels, tier), entry["grid"] = measure(lambda: backend.fit_predict(points))
+        entry["grid"]["tier"] = tier
+        entry["grid"]["clusters"] = int(labels.max() + 1)
+        if size <= args.clustering_sklearn_max:
+            reference, entry["sklearn"] = measure(lambda: DBSCAN(
+                eps=eps_rad, min_samples=config.min_samples, metric="haversine", algorithm="ball_tree",
+            ).fit(np.radians(points)).labels_)
+            entry["identical_labels"] = bool(np.array_equal(labels, reference))
+            entry["adjusted_rand_index"] = float(adjusted_rand_score(reference, labels))
+        results.append(entry)
+
+        print(f"\n=== clustering: {size} points ({entry['distinct_points']} distinct) ===")
+        for name in ("sklearn", "grid"):
+            if name in entry:
+                peak = entry[name]["peak_mb"]
+                print(f"  {name:<10}{entry[name]['seconds'] * 1000:>10.1f} ms"
+                      + (f"{peak:>10.1f} MB peak" if peak is not None else "")
+                      + (f"  ({tier})" if name == "grid" else ""))
+        if "identical_labels" in entry:
+            print(f"  identical labels: {entry['identical_labels']}, adjusted Rand index "
+                  f"{entry['adjusted_rand_index']:.4f}")
+
+    report = {"meta": {"created_at": datetime.now(timezone.utc).isoformat(), "git_revision": _git_revision(),
+                       "python": platform.python_version(), "argv": sys.argv[1:]},
+              "clustering": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"\nResults written to {args.output}")
+    return report
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Fraud detection load-test and latency benchmark")
+    parser.add_argument("--target", choices=sorted(TARGETS), default="inprocess")
+    parser.add_argument("--url", default=DEFAULT_URL, help="Endpoint for --target http")
+    parser.add_argument("--requests", type=int, default=200, help="Measured requests per scenario")
+    parser.add_argument("--warmup", type=int, default=20, help="Unmeasured requests per scenario")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1])
+    parser.add_argument("--transaction-types", nargs="+", default=["withdrawal"],
+                        choices=["withdrawal", "transfer", "deposit"])
+    parser.add_argument("--geo-points", type=int, nargs="+", default=[20],
+                        help="Geo history sizes (geospacial_transaction_data_2d)")
+    parser.add_argument("--packed-geo", action="store_true",
+                        help="Send the geo history base64 packed (geospacial_transaction_data_2d_b64)")
+    parser.add_argument("--device-history", type=int, nargs="+", default=[20],
+                        help="Device history sizes (device_history_last_3_days)")
+    parser.add_argument("--users", type=int, default=0,
+                        help="Cycle over this many user ids (0: a new user per request)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--caches", choices=["off", "cold"], default="off",
+                        help="In-process targets: disable the result/ML score caches, or empty them per scenario "
+                             "and report hit rates")
+    parser.add_argument("--output", help="Write machine-readable results to this JSON file")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two result files and exit")
+    parser.add_argument("--cold-start", type=int, default=0, metavar="RUNS",
+                        help="Measure start-up time and memory over this many fresh interpreters")
+    parser.add_argument("--evaluate", action="store_true",
+                        help="Report model accuracy over the CSV instead of benchmarking")
+    parser.add_argument("--clustering", type=int, nargs="+", metavar="POINTS",
+                        help="Benchmark the DBSCAN backends on geo histories of these sizes")
+    parser.add_argument("--clustering-repeats", type=float, default=0.5,
+                        help="Share of points repeating an earlier point in --clustering")
+    parser.add_argument("--clustering-sklearn-max", type=int, default=20000,
+                        help="Largest size --clustering also runs plain sklearn DBSCAN on")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.compare:
+        compare_results(*args.compare)
+    elif args.cold_start:
+        measure_cold_start(args)
+    elif args.evaluate:
+        evaluate_accuracy(args)
+    elif args.clustering:
+        benchmark_clustering(args)
+    else:
+        run_benchmark(args)
@@ -0,0 +1,408 @@
+"""
+bulk_score.py - Offline bulk scoring of CSV / Parquet / JSONL files without HTTP
+
+Rescores historical data (e.g. after the model in ML_component changed) through the
+same batch pipeline as /detect_fraud/batch: validate_batch + process_transaction_batch.
+The input is streamed in chunks, chunks are spread over a process pool forked after
+the model is loaded, and results are written in input order as they complete, so
+memory stays bounded by (workers x 2) chunks whatever the input size.
+
+Input records:
+    jsonl          one request body (as sent to /detect_fraud) per line
+    csv, parquet   one request per row: the 12 model feature columns become
+                   transaction_data; transaction_id, user_id, transaction_type and
+                   the nested fields (login_data, withdrawal_data,
+                   geospacial_transaction_data_2d, as JSON strings) are read from
+                   columns of that name when present
+Fields a record lacks are taken from --template (default expected_request.json);
+a missing transaction_id becomes "row_<n>". With --ml-only only the ML score is
+computed, which is all a model rescoring needs.
+
+Output (format from the extension or --output-format):
+    jsonl          {"transaction_id", <--keep columns>, "status", "result"}, where
+                   result is the full response body (or the validation error)
+    csv, parquet   one flat row: transaction_id, kept columns, status, error and
+                   the scores, flags and block reasons of the response
+
+Examples:
+    python bulk_score.py synthetic_transaction_data.csv scores.csv --keep fraud
+    python bulk_score.py requests_dump.jsonl results.jsonl --workers 8 --chunk-size 5000
+    python bulk_score.py history.parquet rescored.parquet --ml-only
+
+Parquet needs the optional pyarrow package.
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import logging
+import math
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from json_codec import dumps_bytes, loads
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_TEMPLATE_PATH = os.path.join(BASE_DIR, "expected_request.json")
+
+FORMATS = ("csv", "parquet", "jsonl")
+
+# Request fields read from CSV/Parquet columns; the nested ones hold JSON strings
+TOP_LEVEL_FIELDS = ("transaction_id", "user_id", "transaction_type")
+NESTED_FIELDS = ("transaction_data", "login_data", "withdrawal_data", "geospacial_transaction_data_2d")
+
+# Flat output columns after transaction_id and the --keep columns:
+# column name -> (results key, nested key or None)
+RESULT_COLUMNS = {
+    "ML_fraud_score": ("ML_fraud_score", None),
+    "excessive_logins_from_same_device_score": ("login_anomalies", "excessive_logins_from_same_device_score"),
+    "excessive_unique_account_logins_from_same_device_score": (
+        "login_anomalies", "excessive_unique_account_logins_from_same_device_score"),
+    "unlikely_travel_score": ("login_anomalies", "unlikely_travel_score"),
+    "large_withdrawal_score": ("withdrawal_anomalies", "large_withdrawal_score"),
+    "money_laundering_score": ("withdrawal_anomalies", "money_laundering_score"),
+    "withdrawals_limit_flag": ("withdrawal_anomalies", "withdrawals_limit_flag"),
+    "failed_withdrawals_limit_flag": ("withdrawal_anomalies", "failed_withdrawals_limit_flag"),
+    "clusters_identified": ("clusters_info", "clusters_identified"),
+    "this_transaction_is_in_cluster": ("clusters_info", "this_transaction_is_in_cluster"),
+    "this_transaction_is_in_hotspot": ("clusters_info", "this_transaction_is_in_hotspot"),
+    "block_transaction": ("block_transaction", None),
+}
+
+logger = logging.getLogger(__name__)
+
+
+def _format_of(path, explicit=None):
+    fmt = explicit or os.path.splitext(path)[1].lstrip(".").lower()
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown file format '{fmt}' for {path}. Allowed: {list(FORMATS)}")
+    return fmt
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("Parquet input/output requires the pyarrow package")
+    return pyarrow
+
+
+# ---------------------------------------------------------------------------
+# Input
+# ---------------------------------------------------------------------------
+
+def read_chunks(path, fmt, chunk_size):
+    """Yields lists of records (dicts) of at most chunk_size from the input file."""
+    if fmt == "jsonl":
+        with open(path, "rb") as f:
+            lines = (line for line in f if line.strip())
+            while True:
+                chunk = [loads(line) for line in itertools.islice(lines, chunk_size)]
+                if not chunk:
+                    return
+                yield chunk
+
+    elif fmt == "csv":
+        import pandas as pd
+
+        for frame in pd.read_csv(path, chunksize=chunk_size):
+            # Missing cells become None instead of NaN
+            yield frame.astype(object).where(frame.notna(), None).to_dict(orient="records")
+
+    else:
+        pyarrow = _import_pyarrow()
+        for batch in pyarrow.parquet.ParquetFile(path).iter_batches(batch_size=chunk_size):
+            yield batch.to_pylist()
+
+
+class RequestBuilder:
+    """Turns input records into request bodies, filling missing fields from the template."""
+
+    def __init__(self, template):
+        from ML_component.fraud_detection_ml import FEATURE_NAMES
+
+        self.template = template
+        self.feature_names = FEATURE_NAMES
+
+    def build(self, record, row_number):
+        # Nested template values are shared, not copied: the pipeline only reads requests
+        request = dict(self.template)
+        if all(name in record for name in self.feature_names):
+            request["transaction_data"] = {name: record[name] for name in self.feature_names}
+
+        for field in NESTED_FIELDS:
+            value = record.get(field)
+            if value is not None:
+                request[field] = loads(value) if isinstance(value, str) else value
+        for field in TOP_LEVEL_FIELDS:
+            if record.get(field) is not None:
+                request[field] = record[field]
+
+        # A packed geo history in the record replaces the template's list
+        if record.get("geospacial_transaction_data_2d_b64") is not None:
+            request["geospacial_transaction_data_2d_b64"] = record["geospacial_transaction_data_2d_b64"]
+            if "geospacial_transaction_data_2d" not in record:
+                request.pop("geospacial_transaction_data_2d", None)
+
+        if record.get("transaction_id") is None:
+            request["transaction_id"] = f"row_{row_number}"
+        return request
+
+
+# ---------------------------------------------------------------------------
+# Scoring (runs in the pool processes)
+# ---------------------------------------------------------------------------
+
+_builder = None
+
+
+def _init_worker(template):
+    global _builder
+    import controller
+
+    logging.disable(logging.WARNING)
+    # Every row is new: caching results would only cost memory
+    controller.RESULT_CACHE = None
+    _builder = RequestBuilder(template)
+
+
+def score_chunk(records, first_row, keep, ml_only):
+    """
+    Scores one chunk of records.
+
+    Returns:
+        (outputs, blocked, errors): one {"transaction_id", <keep>, "status", "result"}
+        dict per record, in order, plus the number of blocked and rejected rows.
+    """
+    from controller import process_transaction_batch
+    from ML_component.fraud_detection_ml import detect_fraud_ml_batch
+    from validation_logic import validate_batch
+
+    requests = [_builder.build(record, first_row + i) for i, record in enumerate(records)]
+    validation = validate_batch(requests)
+    valid_positions = validation.valid_positions
+    statuses = [error[1] if error else 200 for error in validation.errors]
+    responses = [error[0] if error else None for error in validation.errors]
+
+    if valid_positions:
+        valid_requests = [requests[i] for i in valid_positions]
+        if ml_only:
+            batch_results = [{} for _ in valid_positions]
+            detect_fraud_ml_batch(valid_requests, batch_results, validation.columns)
+        else:
+            batch_results = process_transaction_batch(valid_requests, validation.columns)
+        for position, result in zip(valid_positions, batch_results):
+            responses[position] = result
+
+    outputs = []
+    blocked = 0
+    for request, record, status, response in zip(requests, records, statuses, responses):
+        blocked += bool(response.get("block_transaction"))
+        output = {"transaction_id": request.get("transaction_id")}
+        for column in keep:
+            output[column] = record.get(column)
+        output["status"] = status
+        output["result"] = response
+        outputs.append(output)
+    return outputs, blocked, len(requests) - len(valid_positions)
+
+
+# ---------------------------------------------------------------------------
+# Output
+# ---------------------------------------------------------------------------
+
+def flatten(output, keep):
+    """One flat row (dict) of a score_chunk output for CSV/Parquet."""
+    result = output["result"]
+    row = {"transaction_id": output["transaction_id"]}
+    for column in keep:
+        row[column] = output[column]
+    row["status"] = output["status"]
+    row["error"] = (result.get("reason") or result.get("error")) if output["status"] != 200 else None
+    for column, (key, nested_key) in RESULT_COLUMNS.items():
+        value = result.get(key)
+        if nested_key is not None:
+            value = value.get(nested_key) if isinstance(value, dict) else None
+        row[column] = value
+    reasons = result.get("block_reasons") or {}
+    row["block_reasons"] = "; ".join(reasons[key] for key in sorted(reasons, key=int)) or None
+    return row
+
+
+class JsonlWriter:
+    def __init__(self, path, keep):
+        self._file = open(path, "wb")
+
+    def write(self, outputs):
+        self._file.write(b"".join(dumps_bytes(output, sort_keys=False) + b"\n" for output in outputs))
+
+    def close(self):
+        self._file.close()
+
+
+class CsvWriter:
+    def __init__(self, path, keep):
+        self.keep = keep
+        self._file = open(path, "w", newline="")
+        self._writer = csv.DictWriter(
+            self._file, ["transaction_id", *keep, "status", "error", *RESULT_COLUMNS, "block_reasons"]
+        )
+        self._writer.writeheader()
+
+    def write(self, outputs):
+        self._writer.writerows(flatten(output, self.keep) for output in outputs)
+
+    def close(self):
+        self._file.close()
+
+
+class ParquetWriter:
+    def __init__(self, path, keep):
+        self.path = path
+        self.keep = keep
+        self._pyarrow = _import_pyarrow()
+        self._writer = None
+        self._table_schema = None
+
+    def _schema(self, table):
+        pa = self._pyarrow
+        # Kept columns take the type of the first chunk; result columns are fixed
+        fields = [pa.field("transaction_id", pa.string())]
+        fields += [table.schema.field(column) for column in self.keep]
+        fields += [pa.field("status", pa.int64()), pa.field("error", pa.string())]
+        for column in RESULT_COLUMNS:
+            if column.endswith("_flag") or column == "clusters_identified":
+                fields.append(pa.field(column, pa.int64()))
+            elif column.startswith("this_transaction") or column == "block_transaction":
+                fields.append(pa.field(column, pa.bool_()))
+            else:
+                fields.append(pa.field(column, pa.float64()))
+        fields.append(pa.field("block_reasons", pa.string()))
+        return pa.schema(fields)
+
+    def write(self, outputs):
+        pa = self._pyarrow
+        rows = [flatten(output, self.keep) for output in outputs]
+        for row in rows:
+            row["transaction_id"] = str(row["transaction_id"])
+        table = pa.Table.from_pylist(rows)
+        if self._writer is None:
+            self._table_schema = self._schema(table)
+            self._writer = pa.parquet.ParquetWriter(self.path, self._table_schema)
+        self._writer.write_table(pa.Table.from_pylist(rows, schema=self._table_schema))
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+
+
+WRITERS = {"jsonl": JsonlWriter, "csv": CsvWriter, "parquet": ParquetWriter}
+
+
+# ---------------------------------------------------------------------------
+# Driver
+# ---------------------------------------------------------------------------
+
+class Progress:
+    """Row counts and throughput, reported to stderr at most every interval seconds."""
+
+    def __init__(self, interval=5.0):
+        self.interval = interval
+        self.start = time.perf_counter()
+        self._last_report = self.start
+        self.rows = 0
+        self.blocked = 0
+        self.errors = 0
+
+    def add(self, rows, blocked, errors):
+        self.rows += rows
+        self.blocked += blocked
+        self.errors += errors
+        now = time.perf_counter()
+        if now - self._last_report >= self.interval:
+            self._last_report = now
+            self.report()
+
+    @property
+    def rows_per_second(self):
+        elapsed = time.perf_counter() - self.start
+        return self.rows / elapsed if elapsed > 0 else math.inf
+
+    def report(self, final=False):
+        elapsed = time.perf_counter() - self.start
+        print(f"{'Done: ' if final else ''}{self.rows} rows in {elapsed:.1f}s ({self.rows_per_second:.0f} rows/s), "
+              f"{self.blocked} blocked, {self.errors} rejected by validation", file=sys.stderr)
+
+
+def bulk_score(input_path, output_path, input_format=None, output_format=None, template_path=DEFAULT_TEMPLATE_PATH,
+               chunk_size=2000, workers=None, keep=(), ml_only=False, progress_interval=5.0):
+    """Scores input_path into output_path; returns the Progress with the final counts."""
+    input_format = _format_of(input_path, input_format)
+    output_format = _format_of(output_path, output_format)
+    keep = tuple(keep)
+    workers = workers or os.cpu_count() or 1
+
+    with open(template_path) as f:
+        template = json.load(f)
+
+    # Workers fork from a process that already holds the model and the geospatial imports
+    from controller import preload_components
+    preload_components()
+
+    writer = WRITERS[output_format](output_path, keep)
+    progress = Progress(progress_interval)
+    chunks = read_chunks(input_path, input_format, chunk_size)
+    pending = deque()
+    row_number = 0
+
+    try:
+        if workers == 1:
+            _init_worker(template)
+            for records in chunks:
+                outputs, blocked, errors = score_chunk(records, row_number, keep, ml_only)
+                row_number += len(records)
+                writer.write(outputs)
+                progress.add(len(outputs), blocked, errors)
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(template,)) as pool:
+                # At most 2 chunks per worker in flight; results are written in input order
+                for records in itertools.chain(chunks, [None]):
+                    if records is not None:
+                        pending.append(pool.submit(score_chunk, records, row_number, keep, ml_only))
+                        row_number += len(records)
+                    while pending and (records is None or len(pending) >= 2 * workers or pending[0].done()):
+                        outputs, blocked, errors = pending.popleft().result()
+                        writer.write(outputs)
+                        progress.add(len(outputs), blocked, errors)
+    finally:
+        writer.close()
+
+    progress.report(final=True)
+    return progress
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Score CSV/Parquet/JSONL files through the fraud detection pipeline")
+    parser.add_argument("input", help="Input file (.csv, .parquet or .jsonl)")
+    parser.add_argument("output", help="Output file (.csv, .parquet or .jsonl)")
+    parser.add_argument("--input-format", choices=FORMATS, help="Overrides the input file extension")
+    parser.add_argument("--output-format", choices=FORMATS, help="Overrides the output file extension")
+    parser.add_argument("--template", default=DEFAULT_TEMPLATE_PATH,
+                        help="Request providing the fields an input record lacks")
+    parser.add_argument("--chunk-size", type=int, default=2000, help="Records per batch")
+    parser.add_argument("--workers", type=int, default=None, help="Scoring processes (default: CPU count)")
+    parser.add_argument("--keep", nargs="+", default=[], metavar="COLUMN",
+                        help="Input columns copied to the output (e.g. a label column)")
+    parser.add_argument("--ml-only", action="store_true", help="Only compute the ML fraud score")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    bulk_score(args.input, args.output, args.input_format, args.output_format, args.template,
+               args.chunk_size, args.workers, args.keep, args.ml_only)
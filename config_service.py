@@ -0,0 +1,513 @@
+"""
+config_service.py - Central, hot-reloadable configuration for the detection components
+
+The config.json files of the login, withdrawal, geospatial and final decision
+components are parsed and validated into immutable objects with everything
+derived up front (distance kernels, the hotspot index, ...). Components read
+CONFIG_SERVICE.current.<component>.<field>: attribute lookups only.
+
+A reload builds a complete new Settings object and swaps it in with a single
+reference assignment, so a request sees either the old or the new settings, never
+a mix. A file that fails to parse or validate leaves the running settings in place.
+
+Reloads are triggered by:
+* the watcher thread, polling the files' modification times (controller_config.json
+  "config_reload"); it is restarted in forked children (gunicorn workers, process pools)
+* gunicorn's SIGHUP, through the on_reload hook in gunicorn.conf.py
+* calling CONFIG_SERVICE.reload() directly
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Tuple
+
+import numpy as np
+
+from geo_distance import DISTANCE_FUNCTIONS, get_distance_function
+from geospacial_clustering_component.cluster_index import ClusterIndex
+from geospacial_clustering_component.grid_dbscan import CLUSTERING_BACKENDS
+from final_decision_component.rule_engine import RulePlan, compile_rules
+
+logger = logging.getLogger(__name__)
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_PATHS = {
+    "login": os.path.join(BASE_DIR, "login_anomalies_component", "config.json"),
+    "withdrawal": os.path.join(BASE_DIR, "withdrawal_anomalies_component", "config.json"),
+    "geospatial": os.path.join(BASE_DIR, "geospacial_clustering_component", "config.json"),
+    "decision": os.path.join(BASE_DIR, "final_decision_component", "config.json"),
+}
+CONTROLLER_CONFIG_PATH = os.path.join(BASE_DIR, "controller_config.json")
+
+# Used when the final decision config cannot be read at start-up (previous behaviour)
+DEFAULT_DECISION_CONFIG = {
+    "decision_parameters": {
+        "score_thresholds": {
+            "ml_fraud": 0.5,
+            "unlikely_travel": 0.7,
+            "excessive_logins": 0.6,
+            "excessive_unique_logins": 0.5,
+            "large_withdrawal": 0.4,
+            "money_laundering": 0.1
+        }
+    }
+}
+
+
+class ConfigError(ValueError):
+    """A config file is missing a field or holds an invalid value."""
+
+
+def _number(section, key, source, default=None, minimum=None, exclusive_minimum=None, maximum=None):
+    value = section.get(key, default)
+    # NaN (accepted by json.load) would pass every bound check
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value != value:
+        raise ConfigError(f"{source}: '{key}' must be a number, got {value!r}")
+    if minimum is not None and value < minimum:
+        raise ConfigError(f"{source}: '{key}' must be >= {minimum}, got {value}")
+    if exclusive_minimum is not None and value <= exclusive_minimum:
+        raise ConfigError(f"{source}: '{key}' must be > {exclusive_minimum}, got {value}")
+    if maximum is not None and value > maximum:
+        raise ConfigError(f"{source}: '{key}' must be <= {maximum}, got {value}")
+    return value
+
+
+def _integer(section, key, source, default=None, minimum=None):
+    value = _number(section, key, source, default, minimum)
+    if int(value) != value:
+        raise ConfigError(f"{source}: '{key}' must be an integer, got {value}")
+    return int(value)
+
+
+def _boolean(section, key, source, default=None):
+    value = section.get(key, default)
+    if not isinstance(value, bool):
+        raise ConfigError(f"{source}: '{key}' must be true or false, got {value!r}")
+    return value
+
+
+def _choice(section, key, source, choices, default=None):
+    value = section.get(key, default)
+    if value not in choices:
+        raise ConfigError(f"{source}: '{key}' must be one of {list(choices)}, got {value!r}")
+    return value
+
+
+def _snapshot_path(section, source, base_dir):
+    """'snapshot_path' of a state section, relative to the component directory; None disables snapshots."""
+    path = section.get("snapshot_path")
+    if path is None:
+        return None
+    if not isinstance(path, str):
+        raise ConfigError(f"{source}: 'snapshot_path' must be a string or null, got {path!r}")
+    return os.path.join(base_dir, path)
+
+
+def _section(config, key, source):
+    value = config.get(key)
+    if not isinstance(value, dict):
+        raise ConfigError(f"{source}: missing section '{key}'")
+    return value
+
+
+@dataclass(frozen=True, slots=True)
+class LoginConfig:
+    max_logins_for_full_score: float
+    max_unique_accounts_for_full_score: float
+    max_travel_speed_for_full_score: float
+    distance_method: str
+    distance_km: Callable
+    # Server-side device history (login_anomalies_component/device_history_store.py)
+    device_store_enabled: bool
+    device_store_backend: str
+    device_store_window_seconds: float
+    device_store_bucket_seconds: float
+    device_store_max_devices: int
+    device_store_max_users_per_device: int
+    device_store_redis_url: str
+    # Settings the device history state depends on; the state is dropped when they change
+    device_store_key: tuple
+    # Per-user last login cache (login_anomalies_component/last_login_cache.py)
+    last_login_cache_enabled: bool
+    last_login_cache_max_users: int
+    last_login_snapshot_path: str
+    last_login_snapshot_interval_seconds: float
+    # Settings the cache is built from; it is rebuilt (keeping its entries) when they change
+    last_login_cache_key: tuple
+
+
+@dataclass(frozen=True, slots=True)
+class WithdrawalConfig:
+    large_withdrawal_threshold: float
+    max_daily_withdrawals: float
+    max_laundering_threshold: float
+    max_daily_failed_withdrawals: float
+    # Per-user withdrawal velocity counters (withdrawal_anomalies_component/velocity_counters.py)
+    velocity_enabled: bool
+    velocity_max_users: int
+    velocity_max_transactions: int
+    velocity_snapshot_path: str
+    velocity_snapshot_interval_seconds: float
+    # Settings the counters are built from; they are rebuilt (keeping their state) when these change
+    velocity_key: tuple
+
+
+@dataclass(frozen=True, slots=True)
+class GeospatialConfig:
+    eps_km: float
+    min_samples: int
+    buffer_percentage: float
+    distance_method: str
+    distance_km: Callable
+    coord_precision: int
+    radius_precision: int
+    density_precision: int
+    abs_density_threshold: float
+    rel_density_multiplier: float
+    # Curated hotspots (dicts with precomputed density_per_km2) and their grid index
+    hotspots: Tuple[dict, ...]
+    hotspots_path: str
+    hotspot_index: ClusterIndex
+    report_all_hotspots: bool
+    incremental_enabled: bool
+    incremental_max_users: int
+    incremental_ttl_seconds: float
+    incremental_rebuild_ratio: float
+    # Full-history clustering: "sklearn" (plain DBSCAN) or "grid" (see grid_dbscan.py)
+    clustering_backend: str
+    grid_min_points: int
+    approximate_min_points: int
+    max_candidate_pairs: int
+    # Worker processes for histories above inline_max_points (see geo_worker_pool.py)
+    pool_enabled: bool
+    pool_max_workers: int
+    inline_max_points: int
+    pool_time_budget_seconds: float
+    pool_memory_budget_mb: float
+    # Settings the worker pool depends on; the pool is replaced when they change
+    pool_key: tuple
+    # Settings the per-user cluster state depends on; the state is dropped when they change
+    cluster_state_key: tuple
+
+
+@dataclass(frozen=True, slots=True)
+class DecisionConfig:
+    ml_fraud: float
+    unlikely_travel: float
+    excessive_logins: float
+    excessive_unique_logins: float
+    large_withdrawal: float
+    money_laundering: float
+    consider_suspicious_clusters: bool
+    max_reasons: int
+    # Block rules compiled from "rules" (rule_engine.DEFAULT_RULES when absent)
+    rules: RulePlan
+
+
+@dataclass(frozen=True, slots=True)
+class Settings:
+    login: LoginConfig
+    withdrawal: WithdrawalConfig
+    geospatial: GeospatialConfig
+    decision: DecisionConfig
+    # Increases by one on every successful reload
+    version: int
+    loaded_at: float
+
+
+def parse_login_config(config, source="login config"):
+    distance_method = _choice(config, "distance_method", source, DISTANCE_FUNCTIONS, "vincenty")
+    device_store = config.get("device_history_store", {})
+    device_store_backend = _choice(device_store, "backend", source, ("local", "redis"), "local")
+    device_store_window_seconds = _number(device_store, "window_seconds", source, 259200, exclusive_minimum=0)
+    device_store_bucket_seconds = _number(device_store, "bucket_seconds", source, 3600, exclusive_minimum=0)
+    device_store_max_devices = _integer(device_store, "max_devices", source, 1000000, minimum=1)
+    device_store_max_users_per_device = _integer(device_store, "max_users_per_device", source, 1000, minimum=1)
+    device_store_redis_url = device_store.get("redis_url", "redis://localhost:6379/0")
+    last_login_cache = config.get("last_login_cache", {})
+    last_login_cache_max_users = _integer(last_login_cache, "max_users", source, 1000000, minimum=1)
+    last_login_snapshot_path = _snapshot_path(last_login_cache, source, os.path.dirname(CONFIG_PATHS["login"]))
+    last_login_snapshot_interval_seconds = _number(last_login_cache, "snapshot_interval_seconds", source, 300, minimum=0)
+    return LoginConfig(
+        max_logins_for_full_score=_number(config, "max_logins_for_full_score", source, exclusive_minimum=0),
+        max_unique_accounts_for_full_score=_number(config, "max_unique_accounts_for_full_score", source, exclusive_minimum=0),
+        max_travel_speed_for_full_score=_number(config, "max_travel_speed_for_full_score", source, exclusive_minimum=0),
+        distance_method=distance_method,
+        distance_km=get_distance_function(distance_method),
+        device_store_enabled=_boolean(device_store, "enabled", source, False),
+        device_store_backend=device_store_backend,
+        device_store_window_seconds=device_store_window_seconds,
+        device_store_bucket_seconds=device_store_bucket_seconds,
+        device_store_max_devices=device_store_max_devices,
+        device_store_max_users_per_device=device_store_max_users_per_device,
+        device_store_redis_url=device_store_redis_url,
+        device_store_key=(device_store_backend, device_store_window_seconds, device_store_bucket_seconds,
+                          device_store_max_devices, device_store_max_users_per_device, device_store_redis_url),
+        last_login_cache_enabled=_boolean(last_login_cache, "enabled", source, False),
+        last_login_cache_max_users=last_login_cache_max_users,
+        last_login_snapshot_path=last_login_snapshot_path,
+        last_login_snapshot_interval_seconds=last_login_snapshot_interval_seconds,
+        last_login_cache_key=(last_login_cache_max_users, last_login_snapshot_path, last_login_snapshot_interval_seconds),
+    )
+
+
+def parse_withdrawal_config(config, source="withdrawal config"):
+    velocity = config.get("velocity_counters", {})
+    velocity_max_users = _integer(velocity, "max_users", source, 1000000, minimum=1)
+    velocity_max_transactions = _integer(velocity, "max_transactions", source, 100000, minimum=1)
+    velocity_snapshot_path = _snapshot_path(velocity, source, os.path.dirname(CONFIG_PATHS["withdrawal"]))
+    velocity_snapshot_interval_seconds = _number(velocity, "snapshot_interval_seconds", source, 300, minimum=0)
+    return WithdrawalConfig(
+        large_withdrawal_threshold=_number(config, "LARGE_WITHDRAWAL_THRESHOLD", source, 0.5, exclusive_minimum=0),
+        max_daily_withdrawals=_number(config, "MAX_DAILY_WITHDRAWALS", source, 15, minimum=0),
+        max_laundering_threshold=_number(config, "MAX_LAUNDERING_THRESHOLD", source, 6.0, exclusive_minimum=0),
+        max_daily_failed_withdrawals=_number(config, "MAX_DAILY_FAILED_WITHDRAWALS", source, 10, minimum=0),
+        velocity_enabled=_boolean(velocity, "enabled", source, False),
+        velocity_max_users=velocity_max_users,
+        velocity_max_transactions=velocity_max_transactions,
+        velocity_snapshot_path=velocity_snapshot_path,
+        velocity_snapshot_interval_seconds=velocity_snapshot_interval_seconds,
+        velocity_key=(velocity_max_users, velocity_max_transactions, velocity_snapshot_path,
+                      velocity_snapshot_interval_seconds),
+    )
+
+
+def _load_hotspots(path, source):
+    try:
+        with open(path) as f:
+            hotspots = json.load(f)["hotspots"]
+    except (OSError, ValueError, KeyError) as e:
+        raise ConfigError(f"{source}: cannot read hotspots from {path}: {e}") from None
+
+    parsed = []
+    for position, hotspot in enumerate(hotspots):
+        hotspot_source = f"{source} hotspot {position}"
+        radius_km = _number(hotspot, "radius_km", hotspot_source, minimum=0)
+        hc_area = np.pi * (radius_km ** 2)
+        parsed.append({
+            "latitude_center": _number(hotspot, "latitude_center", hotspot_source, minimum=-90, maximum=90),
+            "longitude_center": _number(hotspot, "longitude_center", hotspot_source, minimum=-180, maximum=180),
+            "radius_km": radius_km,
+            "transaction_count": _integer(hotspot, "transaction_count", hotspot_source, minimum=0),
+            # Use a tiny area if radius is 0 to avoid division by zero and represent high density
+            "density_per_km2": hotspot["transaction_count"] / (hc_area if hc_area > 0 else 0.0001),
+        })
+    return tuple(parsed)
+
+
+def parse_geospatial_config(config, source="geospatial config", base_dir=None):
+    config = _section(config, "geospatial_clustering", source)
+    algorithm = _section(config, "algorithm_parameters", source)
+    output = _section(config, "output_settings", source)
+    validation = _section(config, "validation", source)
+    hotspot_settings = config.get("hotspots", {})
+    incremental = config.get("incremental_state", {})
+    backend = config.get("clustering_backend", {})
+    pool = config.get("worker_pool", {})
+
+    distance_method = _choice(algorithm, "distance_method", source, DISTANCE_FUNCTIONS, "vincenty")
+    buffer_percentage = _number(algorithm, "buffer_percentage", source, minimum=0)
+
+    # Curated hotspot clusters, indexed once for O(1) point-in-hotspot queries
+    base_dir = base_dir or os.path.dirname(CONFIG_PATHS["geospatial"])
+    hotspots_path = os.path.join(base_dir, hotspot_settings.get("file", "hotspots.json"))
+    hotspots = _load_hotspots(hotspots_path, source)
+    hotspot_index = ClusterIndex(
+        cell_deg=_number(hotspot_settings, "index_cell_deg", source, 0.05, exclusive_minimum=0),
+        distance_method=distance_method,
+        buffer_percentage=buffer_percentage,
+    )
+    for hotspot in hotspots:
+        hotspot_index.add(hotspot["latitude_center"], hotspot["longitude_center"], hotspot["radius_km"])
+    hotspot_index.freeze()
+
+    eps_km = _number(algorithm, "eps_km", source, exclusive_minimum=0)
+    min_samples = _integer(algorithm, "min_samples", source, minimum=1)
+    incremental_max_users = _integer(incremental, "max_users", source, 10000, minimum=1)
+    incremental_ttl_seconds = _number(incremental, "ttl_seconds", source, 3600, exclusive_minimum=0)
+    incremental_rebuild_ratio = _number(incremental, "rebuild_ratio", source, 0.5, minimum=0)
+    pool_max_workers = _integer(pool, "max_workers", source, 2, minimum=1)
+    pool_time_budget_seconds = _number(pool, "time_budget_seconds", source, 3.0, exclusive_minimum=0)
+    pool_memory_budget_mb = _number(pool, "memory_budget_mb", source, 512, minimum=0)
+
+    return GeospatialConfig(
+        eps_km=eps_km,
+        min_samples=min_samples,
+        buffer_percentage=buffer_percentage,
+        distance_method=distance_method,
+        distance_km=get_distance_function(distance_method),
+        coord_precision=_integer(output, "coordinate_precision", source, minimum=0),
+        radius_precision=_integer(output, "radius_precision", source, minimum=0),
+        density_precision=_integer(output, "density_precision", source, minimum=0),
+        abs_density_threshold=_number(validation, "absolute_density_threshold", source, minimum=0),
+        rel_density_multiplier=_number(validation, "relative_density_multiplier", source, minimum=0),
+        hotspots=hotspots,
+        hotspots_path=hotspots_path,
+        hotspot_index=hotspot_index,
+        report_all_hotspots=_choice(hotspot_settings, "report", source, ("all", "matching"), "all") == "all",
+        incremental_enabled=_boolean(incremental, "enabled", source, False),
+        incremental_max_users=incremental_max_users,
+        incremental_ttl_seconds=incremental_ttl_seconds,
+        incremental_rebuild_ratio=incremental_rebuild_ratio,
+        clustering_backend=_choice(backend, "backend", source, CLUSTERING_BACKENDS, "sklearn"),
+        grid_min_points=_integer(backend, "grid_min_points", source, 2000, minimum=1),
+        approximate_min_points=_integer(backend, "approximate_min_points", source, 200000, minimum=1),
+        max_candidate_pairs=_integer(backend, "max_candidate_pairs", source, 20000000, minimum=1),
+        pool_enabled=_boolean(pool, "enabled", source, False),
+        pool_max_workers=pool_max_workers,
+        inline_max_points=_integer(pool, "inline_max_points", source, 10000, minimum=0),
+        pool_time_budget_seconds=pool_time_budget_seconds,
+        pool_memory_budget_mb=pool_memory_budget_mb,
+        pool_key=(pool_max_workers, pool_time_budget_seconds, pool_memory_budget_mb),
+        cluster_state_key=(eps_km, min_samples, incremental_max_users, incremental_ttl_seconds, incremental_rebuild_ratio),
+    )
+
+
+def parse_decision_config(config, source="decision config"):
+    parameters = _section(config, "decision_parameters", source)
+    thresholds = _section(parameters, "score_thresholds", source)
+    cluster_impact = parameters.get("cluster_impact", {})
+    # Rules may reference any named threshold, not only the built-in ones
+    named_thresholds = {
+        key: _number(thresholds, key, source) for key in thresholds if not key.startswith("_comment")
+    }
+    consider_suspicious_clusters = _boolean(cluster_impact, "consider_suspicious_clusters", source, True)
+    max_reasons = _integer(cluster_impact, "max_reasons", source, 5, minimum=1)
+
+    rule_definitions = parameters.get("rules")
+    if rule_definitions is not None and not isinstance(rule_definitions, list):
+        raise ConfigError(f"{source}: 'rules' must be a list")
+    try:
+        rules = compile_rules(rule_definitions, named_thresholds, max_reasons, consider_suspicious_clusters)
+    except (ValueError, AttributeError) as e:
+        raise ConfigError(f"{source}: {e}")
+
+    return DecisionConfig(
+        ml_fraud=_number(thresholds, "ml_fraud", source),
+        unlikely_travel=_number(thresholds, "unlikely_travel", source),
+        excessive_logins=_number(thresholds, "excessive_logins", source),
+        excessive_unique_logins=_number(thresholds, "excessive_unique_logins", source),
+        large_withdrawal=_number(thresholds, "large_withdrawal", source),
+        money_laundering=_number(thresholds, "money_laundering", source),
+        consider_suspicious_clusters=consider_suspicious_clusters,
+        max_reasons=max_reasons,
+        rules=rules,
+    )
+
+
+def _read_json(path):
+    with open(path, "r") as file:
+        return json.load(file)
+
+
+class ConfigService:
+    """Holds the current Settings and rebuilds them when the config files change."""
+
+    def __init__(self, paths=None):
+        self.paths = dict(paths or CONFIG_PATHS)
+        self._reload_lock = threading.Lock()
+        self._mtimes = {}
+        # Hotspot definitions are part of the geospatial settings; the path comes from its config
+        self._hotspots_path = os.path.join(os.path.dirname(self.paths["geospatial"]), "hotspots.json")
+        self._watch_interval = None
+        self._watcher = None
+        self._version = 0
+        self.current = self._build(initial=True)
+        os.register_at_fork(after_in_child=self._after_fork_in_child)
+
+    def _stat_mtimes(self):
+        mtimes = {}
+        for name, path in (*self.paths.items(), ("hotspots", self._hotspots_path)):
+            try:
+                mtimes[name] = os.stat(path).st_mtime_ns
+            except OSError:
+                mtimes[name] = None
+        return mtimes
+
+    def _build(self, initial=False):
+        mtimes = self._stat_mtimes()
+
+        try:
+            decision_raw = _read_json(self.paths["decision"])
+        except Exception as e:
+            if not initial:
+                raise
+            # Start-up keeps the previous behaviour of running with default thresholds
+            logger.error(f"Failed to load config: {str(e)}")
+            decision_raw = DEFAULT_DECISION_CONFIG
+
+        settings = Settings(
+            login=parse_login_config(_read_json(self.paths["login"]), self.paths["login"]),
+            withdrawal=parse_withdrawal_config(_read_json(self.paths["withdrawal"]), self.paths["withdrawal"]),
+            geospatial=parse_geospatial_config(_read_json(self.paths["geospatial"]), self.paths["geospatial"],
+                                               os.path.dirname(self.paths["geospatial"])),
+            decision=parse_decision_config(decision_raw, self.paths["decision"]),
+            version=self._version + 1,
+            loaded_at=time.time(),
+        )
+        self._version = settings.version
+        self._mtimes = mtimes
+        self._hotspots_path = settings.geospatial.hotspots_path
+        return settings
+
+    def reload(self):
+        """Re-reads every config file; returns True if new settings were swapped in."""
+        with self._reload_lock:
+            try:
+                settings = self._build()
+            except Exception as e:
+                # Keep serving with the last good settings
+                logger.error(f"Config reload failed, keeping version {self.current.version}: {str(e)}")
+                return False
+            self.current = settings
+        logger.info(f"Config reloaded (version {settings.version})")
+        return True
+
+    def reload_if_changed(self):
+        """Reloads when any config file's modification time changed since the last load."""
+        if self._stat_mtimes() != self._mtimes:
+            return self.reload()
+        return False
+
+    def start_watching(self, interval_seconds):
+        """Polls the config files every interval_seconds in a daemon thread."""
+        self._watch_interval = interval_seconds
+        if self._watcher is None or not self._watcher.is_alive():
+            self._watcher = threading.Thread(target=self._watch, name="config-watcher", daemon=True)
+            self._watcher.start()
+
+    def _watch(self):
+        while True:
+            time.sleep(self._watch_interval)
+            try:
+                self.reload_if_changed()
+            except Exception as e:
+                logger.error(f"Config watcher error: {str(e)}")
+
+    def _after_fork_in_child(self):
+        # Threads do not survive fork: restart the watcher in the child
+        self._reload_lock = threading.Lock()
+        self._watcher = None
+        if self._watch_interval:
+            self.start_watching(self._watch_interval)
+
+
+CONFIG_SERVICE = ConfigService()
+
+
+def _watch_interval_from_controller_config():
+    try:
+        reload_config = _read_json(CONTROLLER_CONFIG_PATH).get("config_reload", {})
+    except Exception as e:
+        logger.error(f"Failed to read config_reload settings: {str(e)}")
+        return None
+    return reload_config.get("watch_interval_seconds") if reload_config.get("watch_files", False) else None
+
+
+_WATCH_INTERVAL = _watch_interval_from_controller_config()
+if _WATCH_INTERVAL:
+    CONFIG_SERVICE.start_watching(_WATCH_INTERVAL)
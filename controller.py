@@ -1,26 +1,331 @@
-from ML_component.fraud_detection_ml import detect_fraud_ml
-from login_anomalies_component.login_anomaly_detection import detect_login_anomalies
-from withdrawal_anomalies_component.withdrawal_anomaly_detection import detect_withdrawal_anomalies
-from geospacial_clustering_component.detect_geospatial_clusters import detect_geospatial_clusters
-from final_decision_component.make_final_decision import make_final_decision
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from ML_component.fraud_detection_ml import detect_fraud_ml, detect_fraud_ml_batch, preload as preload_ml
+from login_anomalies_component.login_anomaly_detection import detect_login_anomalies, detect_login_anomalies_batch
+from withdrawal_anomalies_component.withdrawal_anomaly_detection import (
+    detect_withdrawal_anomalies,
+    detect_withdrawal_anomalies_batch,
+)
+from withdrawal_anomalies_component.velocity_counters import get_withdrawal_velocity_counters
+from geospacial_clustering_component.detect_geospatial_clusters import (
+    detect_geospatial_clusters,
+    preload as preload_geospatial,
+)
+from geospacial_clustering_component.geo_history import geo_history_size
+from final_decision_component.make_final_decision import make_final_decision, make_final_decision_batch
+from config_service import CONFIG_SERVICE
+from metrics import REGISTRY
+from result_cache import make_cache, request_fingerprint
+from validation_logic import validate_withdrawal_outcome
+
+logger = logging.getLogger(__name__)
+
+# Load executor config from JSON
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "controller_config.json")
+with open(CONFIG_PATH, "r") as file:
+    CONTROLLER_CONFIG = json.load(file)
+EXECUTOR_CONFIG = CONTROLLER_CONFIG["executor"]
+
+EXECUTOR_MODE = EXECUTOR_CONFIG.get("mode", "thread")
+MAX_WORKERS = EXECUTOR_CONFIG.get("max_workers", 4)
+COMPONENT_TIMEOUTS = EXECUTOR_CONFIG.get("component_timeouts_seconds", {})
+
+# Independent detectors: name, function, results key it writes, value stored on timeout/failure
+COMPONENTS = {
+    "ml": (detect_fraud_ml, "ML_fraud_score", None),
+    "login": (detect_login_anomalies, "login_anomalies", {"error": "Login anomaly detection timed out"}),
+    "withdrawal": (detect_withdrawal_anomalies, "withdrawal_anomalies", {"error": "Withdrawal anomaly detection timed out"}),
+    "geospatial": (detect_geospatial_clusters, "clusters_info", {"error": "Geospatial clustering timed out"}),
+}
+
+# Whole results of recently processed requests (None when disabled, see result_cache.py)
+RESULT_CACHE = make_cache("result", CONTROLLER_CONFIG.get("result_cache", {}))
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _split_stores():
+    """Enabled in-process stores that "process" mode splits across the pool's children."""
+    config = CONFIG_SERVICE.current
+    stores = []
+    if config.login.device_store_enabled and config.login.device_store_backend == "local":
+        stores.append("device history store (login)")
+    if config.login.last_login_cache_enabled:
+        stores.append("last login cache (login)")
+    if config.withdrawal.velocity_enabled:
+        stores.append("velocity counters (withdrawal)")
+    if config.geospatial.incremental_enabled:
+        stores.append("incremental cluster state (geospatial)")
+    return stores
+
+
+def _get_executor():
+    """Creates the component pool on first use, so each (forked) worker gets its own."""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                if EXECUTOR_MODE == "process":
+                    # Each child keeps its own copy of these, fed only by the requests it happens to run
+                    split_stores = _split_stores()
+                    if split_stores:
+                        logger.warning(
+                            "Executor mode 'process' splits the per-process state of the "
+                            f"{', '.join(split_stores)} across {MAX_WORKERS} pool processes; "
+                            "use 'thread' mode to keep one copy per worker")
+                    _executor = ProcessPoolExecutor(max_workers=MAX_WORKERS)
+                else:
+                    _executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="fraud-component")
+    return _executor
+
+
+def preload_components():
+    """Loads models and heavy imports up front (gunicorn master with preload_app)."""
+    preload_ml()
+    preload_geospatial()
+
+
+def _run_component(component_func, data, name=None, started=None):
+    """Runs one detector against a private results dict (picklable for process pools).
+
+    Returns the detector's results and its own run time, measured where it ran. When
+    given (thread pools), started[name] is set to the time.monotonic() it began.
+    """
+    if started is not None:
+        started[name] = time.monotonic()
+    start = time.perf_counter()
+    component_results = {}
+    component_func(data, component_results)
+    return component_results, time.perf_counter() - start
+
+
+def _component_result(future, name, timeout, submitted_at, started):
+    """Waits for a component until timeout seconds after it started running.
+
+    Time queued behind other requests' components does not count, but a component
+    still queued timeout seconds after submission times out. Process pools do not
+    report when a component starts (started is None): their deadline runs from
+    submission.
+    """
+    try:
+        return future.result(timeout=max(submitted_at + timeout - time.monotonic(), 0))
+    except FutureTimeoutError:
+        start = started.get(name) if started is not None else None
+        if start is None or start <= submitted_at:
+            raise
+    return future.result(timeout=max(start + timeout - time.monotonic(), 0))
+
+
+def _component_failed(results_key, value):
+    """Detectors swallow their exceptions, so failures are read back from their output.
+
+    Clustering skipped for an exceeded budget counts as a failure too (and is not cached).
+    """
+    if results_key == "ML_fraud_score":
+        return value is None
+    return isinstance(value, dict) and ("error" in value or "clustering_error" in value or "clustering_skipped" in value)
+
+
+def _observe_payload_sizes(data):
+    REGISTRY.observe_payload("geospacial_transaction_data_2d", geo_history_size(data))
+    login_data = data.get("login_data") or {}
+    REGISTRY.observe_payload("device_history_last_3_days", len(login_data.get("device_history_last_3_days") or ()))
+
+
+def _components_for(data):
+    names = ["ml", "login"]
+
+    # Run withdrawal fraud detection only if the transaction is a withdrawal
+    if data.get("transaction_type") == "withdrawal":
+        names.append("withdrawal")
+
+    names.append("geospatial")
+    return names
+
+
+def _result_cache_key(data):
+    # Same transaction and content under the same settings; results depend on the config
+    if data.get("transaction_id") is None:
+        return None
+    return request_fingerprint(data, CONFIG_SERVICE.current.version)
+
+
+def _cacheable(results):
+    """Results holding a failed or timed-out component are not cached, so a retry recomputes them."""
+    return not any(
+        _component_failed(results_key, results.get(results_key))
+        for _, results_key, _ in COMPONENTS.values() if results_key in results
+    )
+
 
 def process_transaction(data):
     """Handles fraud detection processing for a transaction request."""
 
+    request_start = time.perf_counter()
+
+    # Retries and duplicate submissions are answered from the result cache
+    cache_key = _result_cache_key(data) if RESULT_CACHE is not None else None
+    if cache_key is not None:
+        cached_results = RESULT_CACHE.get(cache_key)
+        if cached_results is not None:
+            # Hits skip the stages below, so they get their own latency series
+            REGISTRY.observe_component("process_transaction_cached", time.perf_counter() - request_start)
+            return cached_results
+
+    _observe_payload_sizes(data)
+
     # Initialize results dictionary
     results = {}
+    component_names = _components_for(data)
 
-    # Run fraud detection models sequentially
-    detect_fraud_ml(data, results)
-    detect_login_anomalies(data, results)
+    if EXECUTOR_MODE == "sequential":
+        # Run fraud detection models sequentially
+        for name in component_names:
+            component_results, elapsed = _run_component(COMPONENTS[name][0], data)
+            results_key = COMPONENTS[name][1]
+            REGISTRY.observe_component(name, elapsed, _component_failed(results_key, component_results.get(results_key)))
+            results.update(component_results)
+    else:
+        # Detectors only read 'data' and write disjoint keys, so they run concurrently
+        executor = _get_executor()
+        started = {} if EXECUTOR_MODE == "thread" else None
+        submitted_at = time.monotonic()
+        futures = {
+            name: executor.submit(_run_component, COMPONENTS[name][0], data, name, started)
+            for name in component_names
+        }
 
-    # Run withdrawal fraud detection only if the transaction is a withdrawal
-    if data.get("transaction_type") == "withdrawal":
-        detect_withdrawal_anomalies(data, results)
+        # Join every detector before the final decision, each bounded by its own deadline
+        for name, future in futures.items():
+            _, results_key, fallback = COMPONENTS[name]
+            timeout = COMPONENT_TIMEOUTS.get(name, 5.0)
+            try:
+                component_results, elapsed = _component_result(future, name, timeout, submitted_at, started)
+                REGISTRY.observe_component(name, elapsed, _component_failed(results_key, component_results.get(results_key)))
+                results.update(component_results)
+            except FutureTimeoutError:
+                if future.cancel():
+                    logger.warning(f"Component '{name}' did not start within its {timeout}s timeout")
+                else:
+                    # A running detector cannot be interrupted: it keeps its pool worker busy
+                    # until it returns, and its result is dropped
+                    REGISTRY.increment("component_timeouts_still_running")
+                    logger.warning(f"Component '{name}' exceeded its {timeout}s timeout")
+                REGISTRY.observe_component(name, timeout, error=True)
+                results[results_key] = fallback
+            except Exception as e:
+                logger.error(f"Component '{name}' failed: {str(e)}", exc_info=True)
+                REGISTRY.observe_component(name, time.monotonic() - submitted_at, error=True)
+                results[results_key] = fallback
+
+    with REGISTRY.time_component("final_decision"):
+        make_final_decision(data, results)
 
-    detect_geospatial_clusters(data, results)
+    REGISTRY.observe_component("process_transaction", time.perf_counter() - request_start)
 
-    make_final_decision(data, results)
+    if cache_key is not None and _cacheable(results):
+        RESULT_CACHE.set(cache_key, results)
 
     # Return results dictionary
     return results
+
+
+def process_transaction_batch(data_list, columns=None):
+    """Handles fraud detection processing for a batch of already validated transaction requests.
+
+    Each component runs once over the whole batch; the returned list holds one
+    results dictionary per request, in request order. Batch stages are recorded
+    under "<component>_batch" so their latencies are not mixed with single requests.
+    columns are the typed columns from validation_logic.validate_batch (one row per
+    request), handed to the ML, login and withdrawal components. Requests found in
+    the result cache are answered from it and left out of the batch.
+    """
+
+    if RESULT_CACHE is None:
+        return _process_transaction_batch(data_list, columns)
+
+    # Requests answered from the result cache are left out of the batch
+    request_start = time.perf_counter()
+    cache_keys = [_result_cache_key(data) for data in data_list]
+    results_list = [RESULT_CACHE.get(key) if key is not None else None for key in cache_keys]
+    misses = [i for i, results in enumerate(results_list) if results is None]
+    if not misses:
+        REGISTRY.observe_component("process_transaction_batch_cached", time.perf_counter() - request_start)
+        return results_list
+    if len(misses) == len(data_list):
+        batch_results = _process_transaction_batch(data_list, columns)
+    else:
+        batch_results = _process_transaction_batch([data_list[i] for i in misses],
+                                                   columns.take(misses) if columns is not None else None)
+
+    for position, results in zip(misses, batch_results):
+        results_list[position] = results
+        if cache_keys[position] is not None and _cacheable(results):
+            RESULT_CACHE.set(cache_keys[position], results)
+    return results_list
+
+
+def _process_transaction_batch(data_list, columns=None):
+    request_start = time.perf_counter()
+    REGISTRY.observe_payload("batch_size", len(data_list))
+    for data in data_list:
+        _observe_payload_sizes(data)
+
+    results_list = [{} for _ in data_list]
+
+    # Vectorized ML scoring over the whole batch
+    with REGISTRY.time_component("ml_batch"):
+        detect_fraud_ml_batch(data_list, results_list, columns)
+
+    with REGISTRY.time_component("login_batch"):
+        detect_login_anomalies_batch(data_list, results_list, columns)
+
+    # Withdrawal checks only apply to withdrawal transactions
+    withdrawal_positions = [i for i, data in enumerate(data_list) if data.get("transaction_type") == "withdrawal"]
+    if withdrawal_positions:
+        with REGISTRY.time_component("withdrawal_batch"):
+            detect_withdrawal_anomalies_batch(
+                [data_list[i] for i in withdrawal_positions],
+                [results_list[i] for i in withdrawal_positions],
+                columns.take(withdrawal_positions) if columns is not None else None,
+            )
+
+    with REGISTRY.time_component("geospatial_batch"):
+        for data, results in zip(data_list, results_list):
+            detect_geospatial_clusters(data, results)
+
+    # Block rules run column-wise over the whole batch
+    with REGISTRY.time_component("final_decision_batch"):
+        make_final_decision_batch(data_list, results_list)
+
+    REGISTRY.observe_component("process_transaction_batch", time.perf_counter() - request_start)
+
+    return results_list
+
+
+def record_withdrawal_outcomes(outcomes):
+    """Feeds withdrawal outcome reports (success or failed) to the withdrawal velocity counters.
+
+    Invalid reports are skipped and listed with their index. Returns the response body,
+    or None when the velocity counters are disabled.
+    """
+    counters = get_withdrawal_velocity_counters(CONFIG_SERVICE.current.withdrawal)
+    if counters is None:
+        return None
+
+    errors = []
+    for index, outcome in enumerate(outcomes):
+        error = validate_withdrawal_outcome(outcome)
+        if error:
+            errors.append({**error[0], "status": error[1], "index": index})
+            continue
+        counters.record_outcome(outcome["user_id"], outcome["outcome"], outcome["transaction_id"])
+
+    REGISTRY.increment("withdrawal_outcomes", len(outcomes) - len(errors))
+    return {"recorded": len(outcomes) - len(errors), "errors": errors}
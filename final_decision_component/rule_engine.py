@@ -0,0 +1,288 @@
+"""
+rule_engine.py - Declarative block rules for the final decision
+
+Rules come from the "rules" list in config.json (DEFAULT_RULES when absent) and are
+compiled once per loaded config into a flat tuple of steps. Two kinds exist:
+
+* threshold: fires when results[<component>][<field>] (or results[<field>]) compares
+  true against a number or a named entry of "score_thresholds". A missing value counts
+  as 0; a None or non-numeric value (e.g. a failed ML component) never fires.
+* suspicious_cluster: fires when the transaction lies in a DBSCAN cluster flagged as
+  suspicious. Dropped at compile time unless cluster_impact.consider_suspicious_clusters.
+
+Evaluation walks the steps in order and stops as soon as max_reasons rules have fired;
+reason strings are only formatted for the rules that are kept. evaluate_batch() runs
+the same plan over columns of component scores, one vectorized comparison per rule.
+"""
+
+import operator
+import string
+
+import numpy as np
+
+THRESHOLD, SUSPICIOUS_CLUSTER = "threshold", "suspicious_cluster"
+
+# operator -> (scalar comparison, array comparison)
+OPERATORS = {
+    ">=": (operator.ge, np.greater_equal),
+    ">": (operator.gt, np.greater),
+    "<=": (operator.le, np.less_equal),
+    "<": (operator.lt, np.less),
+    "==": (operator.eq, np.equal),
+}
+
+# Equivalent of the previous hand-written decision chain
+DEFAULT_RULES = (
+    {"name": "ml_fraud", "field": "ML_fraud_score", "threshold": "ml_fraud",
+     "reason": "High ML fraud risk (score: {value:.2f})"},
+    {"name": "suspicious_cluster", "type": SUSPICIOUS_CLUSTER,
+     "reason": "Suspicious cluster: {reason}"},
+    {"name": "unlikely_travel", "component": "login_anomalies", "field": "unlikely_travel_score",
+     "threshold": "unlikely_travel", "reason": "Unlikely travel (score: {value:.2f})"},
+    {"name": "excessive_logins", "component": "login_anomalies", "field": "excessive_logins_from_same_device_score",
+     "threshold": "excessive_logins", "reason": "Excessive device logins (score: {value:.2f})"},
+    {"name": "excessive_unique_logins", "component": "login_anomalies",
+     "field": "excessive_unique_account_logins_from_same_device_score",
+     "threshold": "excessive_unique_logins", "reason": "Multiple account logins (score: {value:.2f})"},
+    {"name": "large_withdrawal", "component": "withdrawal_anomalies", "field": "large_withdrawal_score",
+     "threshold": "large_withdrawal", "reason": "Large withdrawal (score: {value:.2f})"},
+    {"name": "money_laundering", "component": "withdrawal_anomalies", "field": "money_laundering_score",
+     "threshold": "money_laundering", "reason": "Money laundering risk (score: {value:.2f})"},
+    {"name": "failed_withdrawals_limit", "component": "withdrawal_anomalies", "field": "failed_withdrawals_limit_flag",
+     "threshold": 1, "reason": "Excessive failed withdrawal attempts"},
+    {"name": "withdrawals_limit", "component": "withdrawal_anomalies", "field": "withdrawals_limit_flag",
+     "threshold": 1, "reason": "Withdrawal frequency limit exceeded"},
+)
+
+
+def _compile_template(template, placeholder, name):
+    """
+    Turns a reason template into a one-argument formatter (a bound str.format over a
+    positional copy of the template). Only the rule's own placeholder ({value} or
+    {reason}, with an optional format spec) is allowed.
+    """
+    positional = []
+    for literal, field, spec, conversion in string.Formatter().parse(template):
+        positional.append(literal.replace("{", "{{").replace("}", "}}"))
+        if field is None:
+            continue
+        if field != placeholder or conversion:
+            raise ValueError(f"rule '{name}': reason may only use {{{placeholder}}}, got {{{field}}}")
+        positional.append(f"{{0:{spec}}}" if spec else "{0}")
+    return "".join(positional).format
+
+
+class Rule:
+    """One compiled rule; the hot loop reads its fields from the plan tuple instead."""
+
+    __slots__ = ("name", "kind", "component", "field", "compare", "array_compare", "threshold", "template", "format")
+
+    def __init__(self, name, kind, component, field, compare, array_compare, threshold, template):
+        self.name = name
+        self.kind = kind
+        self.component = component
+        self.field = field
+        self.compare = compare
+        self.array_compare = array_compare
+        self.threshold = threshold
+        self.template = template
+        # Reason string for a fired rule (value is the score, or the cluster's reason)
+        self.format = _compile_template(template, "reason" if kind == SUSPICIOUS_CLUSTER else "value", name)
+
+    def __repr__(self):
+        return f"Rule({self.name!r})"
+
+
+class RulePlan:
+    """Compiled rules plus the reason limit; immutable once built."""
+
+    __slots__ = ("rules", "steps", "columns", "max_reasons")
+
+    def __init__(self, rules, max_reasons):
+        self.rules = tuple(rules)
+        # Flat steps for the single-result loop: consecutive threshold rules on the same
+        # component share one step, so the component dict is looked up once.
+        # (kind, component, ((field, compare or None for >=, threshold, rule), ...))
+        steps = []
+        for r in self.rules:
+            if r.kind == THRESHOLD and steps and steps[-1][0] == THRESHOLD and steps[-1][1] == r.component:
+                steps[-1][2].append((r.field, None if r.compare is operator.ge else r.compare, r.threshold, r))
+            elif r.kind == THRESHOLD:
+                steps.append((THRESHOLD, r.component, [(r.field, None if r.compare is operator.ge else r.compare,
+                                                        r.threshold, r)]))
+            else:
+                steps.append((r.kind, r.component, [(None, None, None, r)]))
+        self.steps = tuple((kind, component, tuple(checks)) for kind, component, checks in steps)
+        # Distinct (component, field) pairs the threshold rules read, for extract_columns()
+        self.columns = tuple(dict.fromkeys((r.component, r.field) for r in self.rules if r.kind == THRESHOLD))
+        self.max_reasons = max_reasons
+
+    def __len__(self):
+        return len(self.rules)
+
+
+def compile_rules(rule_definitions, thresholds, max_reasons, consider_suspicious_clusters=True):
+    """
+    Compiles rule definitions (see DEFAULT_RULES) into a RulePlan.
+
+    Raises:
+        ValueError: unknown rule type/operator/threshold name or missing fields.
+    """
+    rules = []
+    for position, definition in enumerate(DEFAULT_RULES if rule_definitions is None else rule_definitions):
+        name = definition.get("name", f"rule{position + 1}")
+        kind = definition.get("type", THRESHOLD)
+        template = definition.get("reason")
+        if not isinstance(template, str):
+            raise ValueError(f"rule '{name}': 'reason' must be a string")
+
+        if kind == SUSPICIOUS_CLUSTER:
+            if consider_suspicious_clusters:
+                rules.append(Rule(name, SUSPICIOUS_CLUSTER, "clusters_info", None, None, None, None, template))
+            continue
+        if kind != THRESHOLD:
+            raise ValueError(f"rule '{name}': unknown type {kind!r}")
+
+        field = definition.get("field")
+        if not isinstance(field, str):
+            raise ValueError(f"rule '{name}': 'field' must be a string")
+        op = definition.get("operator", ">=")
+        if op not in OPERATORS:
+            raise ValueError(f"rule '{name}': unknown operator {op!r}. Allowed: {list(OPERATORS)}")
+
+        threshold = definition.get("threshold")
+        if isinstance(threshold, str):
+            if threshold not in thresholds:
+                raise ValueError(f"rule '{name}': no score threshold named {threshold!r}")
+            threshold = thresholds[threshold]
+        if isinstance(threshold, bool) or not isinstance(threshold, (int, float)):
+            raise ValueError(f"rule '{name}': 'threshold' must be a number or a score_thresholds name")
+
+        compare, array_compare = OPERATORS[op]
+        rules.append(Rule(name, THRESHOLD, definition.get("component"), field, compare, array_compare, threshold,
+                          template))
+    return RulePlan(rules, max_reasons)
+
+
+def _cluster_reason(cluster_info):
+    """suspicious_reason of the transaction's DBSCAN cluster if it is flagged, else None."""
+    if not isinstance(cluster_info, dict) or not cluster_info.get("this_transaction_is_in_cluster", False):
+        return None
+    cluster = cluster_info.get(f"{cluster_info.get('transaction_cluster_number', '')}_info", {})
+    if not cluster.get("is_suspicious", False):
+        return None
+    return cluster.get("suspicious_reason", "Unknown")
+
+
+def evaluate(plan, results):
+    """
+    Runs the plan against one results dict.
+
+    Returns:
+        List of (rule, value) for the fired rules, at most plan.max_reasons, in rule order.
+    """
+    fired = []
+    max_reasons = plan.max_reasons
+    for kind, component, checks in plan.steps:
+        if kind is SUSPICIOUS_CLUSTER:
+            reason = _cluster_reason(results.get(component))
+            if reason is None:
+                continue
+            fired.append((checks[0][3], reason))
+            # Decision and reasons are settled once max_reasons rules fired
+            if len(fired) == max_reasons:
+                break
+            continue
+
+        source = results if component is None else results.get(component)
+        if not isinstance(source, dict):
+            continue
+        for field, compare, threshold, rule in checks:
+            value = source.get(field, 0)
+            if value is None:
+                continue
+            try:
+                hit = value >= threshold if compare is None else compare(value, threshold)
+            except TypeError:
+                continue
+            if hit:
+                fired.append((rule, value))
+                if len(fired) == max_reasons:
+                    return fired
+    return fired
+
+
+# "1", "2", ... keys of block_reasons
+_REASON_KEYS = tuple(str(i + 1) for i in range(64))
+
+
+def format_reasons(fired):
+    """{"1": reason, ...} for the fired rules; formatting happens only here."""
+    keys = _REASON_KEYS if len(fired) <= len(_REASON_KEYS) else [str(i + 1) for i in range(len(fired))]
+    return {key: rule.format(value) for key, (rule, value) in zip(keys, fired)}
+
+
+def _to_float_column(values):
+    """float64 array with NaN for None and anything non-numeric."""
+    try:
+        return np.array(values, dtype=np.float64)
+    except (TypeError, ValueError):
+        return np.array([v if isinstance(v, (int, float)) else None for v in values], dtype=np.float64)
+
+
+def extract_columns(plan, results_list):
+    """
+    Columnar view of the values the plan reads: one float64 array per (component, field)
+    pair (NaN where the value is None/non-numeric or the component is not a dict) and,
+    under (clusters_info, None), an object array of suspicious-cluster reasons (None
+    where that rule does not fire).
+    """
+    values = {key: [] for key in plan.columns}
+    components = {}
+    for component, field in plan.columns:
+        components.setdefault(component, []).append((field, values[(component, field)]))
+
+    for results in results_list:
+        for component, fields in components.items():
+            source = results if component is None else results.get(component)
+            if isinstance(source, dict):
+                for field, column in fields:
+                    column.append(source.get(field, 0))
+            else:
+                for _, column in fields:
+                    column.append(None)
+
+    columns = {key: _to_float_column(column) for key, column in values.items()}
+    if any(rule.kind == SUSPICIOUS_CLUSTER for rule in plan.rules):
+        columns[("clusters_info", None)] = np.array(
+            [_cluster_reason(results.get("clusters_info")) for results in results_list], dtype=object)
+    return columns
+
+
+def evaluate_batch(plan, columns, size):
+    """
+    Runs the plan over a columnar batch (see extract_columns).
+
+    Returns:
+        One list of (rule, value) per row, identical to evaluate() on that row.
+    """
+    fired = [[] for _ in range(size)]
+    counts = np.zeros(size, dtype=np.int64)
+
+    for rule in plan.rules:
+        column = columns[(rule.component, rule.field)]
+        open_rows = counts < plan.max_reasons
+        if rule.kind == SUSPICIOUS_CLUSTER:
+            hits = np.flatnonzero(np.not_equal(column, None) & open_rows)
+        else:
+            # NaN compares false, so failed components never fire
+            hits = np.flatnonzero(rule.array_compare(column, rule.threshold) & open_rows)
+
+        for row in hits.tolist():
+            value = column[row]
+            fired[row].append((rule, value if rule.kind == SUSPICIOUS_CLUSTER else float(value)))
+        counts[hits] += 1
+
+        if not open_rows.any():
+            break
+    return fired
@@ -0,0 +1,100 @@
+"""
+cluster_index.py - Grid index over circular clusters for O(1) point-in-cluster lookups
+
+Clusters (centroid + radius) are registered in every lat/lon grid cell their bounding
+box overlaps. After freeze() the index is a flat array of cluster ids plus a dict of
+cell -> (start, end) offsets, so a query reads one cell's candidates and checks them
+with a single vectorized distance call. Query cost depends on how many clusters
+overlap the query cell, not on how many clusters are indexed.
+"""
+
+import math
+
+import numpy as np
+
+from geo_distance import get_distance_function
+
+# Kilometres per degree of latitude on the mean-radius sphere
+_KM_PER_DEGREE = 111.195
+
+
+class ClusterIndex:
+    """Static spatial index over circles given as (lat, lon, radius_km).
+
+    buffer_percentage enlarges every radius (as the cluster inclusion buffer does) and is
+    fixed at construction, so the cells each circle is registered in cover the buffer too.
+    """
+
+    def __init__(self, cell_deg=0.05, distance_method="vincenty", buffer_percentage=0.0):
+        self.cell_deg = cell_deg
+        self.buffer_percentage = buffer_percentage
+        self._columns = int(math.ceil(360.0 / cell_deg))
+        self._distance_km = get_distance_function(distance_method)
+        self._cells = {}
+        self._centers = []
+        self._radii = []
+        self._frozen = False
+
+    def _cell(self, lat, lon):
+        row = int(math.floor(lat / self.cell_deg))
+        column = int(math.floor(((lon + 180.0) % 360.0) / self.cell_deg)) % self._columns
+        return row, column
+
+    def add(self, lat, lon, radius_km):
+        """Registers a circle and returns its id (ids are assigned in insertion order)."""
+        if self._frozen:
+            raise RuntimeError("ClusterIndex is frozen")
+        cluster_id = len(self._centers)
+        self._centers.append((lat, lon))
+        self._radii.append(radius_km)
+
+        # Bounding box of the buffered circle in degrees, with a small margin for the
+        # spherical approximation; longitude span widens with latitude
+        reach_km = radius_km * (1 + self.buffer_percentage) * 1.01
+        dlat = reach_km / _KM_PER_DEGREE
+        cos_lat = math.cos(math.radians(min(abs(lat) + dlat, 90.0)))
+        dlon = 180.0 if cos_lat < 1e-9 else min(reach_km / (_KM_PER_DEGREE * cos_lat), 180.0)
+
+        row_min, _ = self._cell(max(lat - dlat, -90.0), lon)
+        row_max, _ = self._cell(min(lat + dlat, 90.0), lon)
+        _, column_min = self._cell(lat, lon - dlon)
+        column_span = min(int(math.ceil(2 * dlon / self.cell_deg)) + 1, self._columns)
+
+        for row in range(row_min, row_max + 1):
+            for step in range(column_span):
+                self._cells.setdefault((row, (column_min + step) % self._columns), []).append(cluster_id)
+        return cluster_id
+
+    def freeze(self):
+        """Packs the cell lists into flat arrays; no more add() calls afterwards."""
+        offsets = {}
+        flat = []
+        for cell, ids in self._cells.items():
+            offsets[cell] = (len(flat), len(flat) + len(ids))
+            flat.extend(ids)
+        self._offsets = offsets
+        self._flat_ids = np.asarray(flat, dtype=np.int64)
+        self.centers = np.asarray(self._centers, dtype=np.float64).reshape(-1, 2)
+        self.radii = np.asarray(self._radii, dtype=np.float64)
+        self._cells = None
+        self._frozen = True
+        return self
+
+    def query(self, lat, lon):
+        """
+        Ids of the (buffered) circles containing (lat, lon).
+
+        Returns:
+            (ids, distances_km) as arrays, ordered by id.
+        """
+        span = self._offsets.get(self._cell(lat, lon))
+        if span is None:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+        candidates = self._flat_ids[span[0]:span[1]]
+        distances = self._distance_km(lat, lon, self.centers[candidates, 0], self.centers[candidates, 1])
+        inside = distances <= self.radii[candidates] * (1 + self.buffer_percentage)
+        return candidates[inside], distances[inside]
+
+    def __len__(self):
+        return len(self._centers)
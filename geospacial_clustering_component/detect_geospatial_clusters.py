@@ -237,23 +237,69 @@ geospatial_clustering.py - Fraud detection through geographical transaction clus
 """
 
 # Standard library imports
-import json
-import os
 import logging
+import threading
 
 # Third-party imports
 import numpy as np
-from sklearn.cluster import DBSCAN
-from geopy.distance import geodesic
+
+from config_service import CONFIG_SERVICE
+from metrics import REGISTRY
+from geospacial_clustering_component.geo_history import geo_history_from_request
+from geospacial_clustering_component.geo_worker_pool import get_geo_worker_pool
+from geospacial_clustering_component.grid_dbscan import GridDBSCAN
+from geospacial_clustering_component.incremental_clustering import ClusterStateStore
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Load configuration
-CONFIG_PATH = os.path.join(os.path.dirname(__file__), "config.json")
-with open(CONFIG_PATH) as f:
-    CLUSTER_CONFIG = json.load(f)["geospatial_clustering"]
+# Per-user incremental cluster state shared by all requests of this process. It is
+# recreated (state dropped) when a config reload changes the settings it depends on.
+_cluster_state_store = None
+_cluster_state_key = None
+_cluster_state_lock = threading.Lock()
+
+# Analyzer for the current settings object (see get_analyzer)
+_analyzer = None
+
+
+def get_cluster_state_store(config):
+    """Returns the ClusterStateStore for the given settings, or None when incremental state is disabled."""
+    global _cluster_state_store, _cluster_state_key
+    if not config.incremental_enabled:
+        return None
+
+    key = config.cluster_state_key
+    if key != _cluster_state_key:
+        with _cluster_state_lock:
+            if key != _cluster_state_key:
+                _cluster_state_store = ClusterStateStore(
+                    eps_rad=config.eps_km / 6371,
+                    min_samples=config.min_samples,
+                    max_users=config.incremental_max_users,
+                    ttl_seconds=config.incremental_ttl_seconds,
+                    rebuild_ratio=config.incremental_rebuild_ratio,
+                )
+                _cluster_state_key = key
+    return _cluster_state_store
+
+
+def get_analyzer(config):
+    """Returns an analyzer for the given settings; a new one is built only after a config reload."""
+    global _analyzer
+    analyzer = _analyzer
+    if analyzer is None or analyzer.config is not config:
+        analyzer = _analyzer = GeospatialClusterAnalyzer(config)
+    return analyzer
+
+
+def preload():
+    """Imports the clustering dependencies now instead of on the first request."""
+    from sklearn.cluster import DBSCAN  # noqa: F401
+    from sklearn.neighbors import NearestNeighbors  # noqa: F401
+    from scipy.sparse.csgraph import connected_components  # noqa: F401
+
 
 class GeospatialClusterAnalyzer:
     """
@@ -261,24 +307,38 @@ class GeospatialClusterAnalyzer:
     with configurable parameters from config.json
     """
     
-    def __init__(self):
-        algo_params = CLUSTER_CONFIG["algorithm_parameters"]
-        self.eps_km = algo_params["eps_km"]
-        self.min_samples = algo_params["min_samples"]
-        self.buffer_percentage = algo_params["buffer_percentage"]
+    def __init__(self, config=None):
+        # Immutable geospatial settings from the config service (config.json + hotspots.json)
+        self.config = config = config or CONFIG_SERVICE.current.geospatial
+        self.eps_km = config.eps_km
+        self.min_samples = config.min_samples
+        self.buffer_percentage = config.buffer_percentage
         self.earth_radius_km = 6371
+        self.distance_km = config.distance_km
+
+        self.coord_precision = config.coord_precision
+        self.radius_precision = config.radius_precision
+        self.density_precision = config.density_precision
+
+        self.abs_density_threshold = config.abs_density_threshold
+        self.rel_density_multiplier = config.rel_density_multiplier
 
-        output_settings = CLUSTER_CONFIG["output_settings"]
-        self.coord_precision = output_settings["coordinate_precision"]
-        self.radius_precision = output_settings["radius_precision"]
-        self.density_precision = output_settings["density_precision"]
+        self.hotspots = config.hotspots
+        self.hotspot_index = config.hotspot_index
+        self.report_all_hotspots = config.report_all_hotspots
 
-        validation_params = CLUSTER_CONFIG["validation"]
-        self.abs_density_threshold = validation_params["absolute_density_threshold"]
-        self.rel_density_multiplier = validation_params["relative_density_multiplier"]
+        self.grid_dbscan = None
+        if config.clustering_backend == "grid":
+            self.grid_dbscan = GridDBSCAN(
+                eps_rad=self.eps_km / self.earth_radius_km,
+                min_samples=self.min_samples,
+                grid_min_points=config.grid_min_points,
+                approximate_min_points=config.approximate_min_points,
+                max_candidate_pairs=config.max_candidate_pairs,
+            )
 
     def _calculate_cluster_metrics(self, cluster_points):
-        if not cluster_points:
+        if len(cluster_points) == 0:
             return None
 
         try:
@@ -286,13 +346,11 @@ class GeospatialClusterAnalyzer:
             centroid = points.mean(axis=0).tolist()
             
             max_distance = 0.0
-            if len(cluster_points) > 1: # Geodesic needs at least one point, centroid itself if 1 point
-                max_distance = max(
-                    geodesic(centroid, point).km 
-                    for point in cluster_points
-                )
-            elif len(cluster_points) == 1: # If cluster has only one point, radius is 0
-                 max_distance = 0.0
+            if len(cluster_points) > 1: # If cluster has only one point, radius is 0
+                # Radius is the largest centroid-to-point distance, one array operation
+                max_distance = float(np.max(
+                    self.distance_km(centroid[0], centroid[1], points[:, 0], points[:, 1])
+                ))
 
 
             area = np.pi * (max_distance ** 2)
@@ -311,210 +369,255 @@ class GeospatialClusterAnalyzer:
             logger.error(f"Cluster metric calculation failed: {str(e)}")
             return None
 
+    def _cluster_labels(self, all_transactions):
+        """DBSCAN label of every point, from the configured backend."""
+        if self.grid_dbscan is not None:
+            labels, tier = self.grid_dbscan.fit_predict(all_transactions)
+            REGISTRY.increment(f"geospatial_clustering_{tier}")
+            return labels
+
+        # sklearn is imported on first use to keep worker start-up light
+        from sklearn.cluster import DBSCAN
+
+        return DBSCAN(
+            eps=self.eps_km / self.earth_radius_km,
+            min_samples=self.min_samples,
+            metric='haversine',
+            algorithm='ball_tree'
+        ).fit(np.radians(all_transactions)).labels_
+
     def analyze_transaction_clusters(self, all_transactions, current_transaction):
         try:
-            coords = np.radians(all_transactions)
-            eps_rad = self.eps_km / self.earth_radius_km
-            
-            db = DBSCAN(
-                eps=eps_rad,
-                min_samples=self.min_samples,
-                metric='haversine',
-                algorithm='ball_tree'
-            ).fit(coords)
+            labels = self._cluster_labels(all_transactions)
+
+            # Point indices of every label in one sort (ascending within a label)
+            order = np.argsort(labels, kind="stable")
+            bounds = np.flatnonzero(np.diff(labels[order])) + 1
+            members = {int(group[0]): indices for group, indices in
+                       zip(np.split(labels[order], bounds), np.split(order, bounds))}
 
             clusters = []
             cluster_map = {}
 
-            # Determine the starting label for hardcoded clusters to ensure uniqueness
-            max_dbscan_label = -1
-            if len(db.labels_) > 0 and np.any(db.labels_ != -1):
-                max_dbscan_label = int(np.max(db.labels_[db.labels_ != -1]))
-            
-            current_max_label = max_dbscan_label
-
-            for label in set(db.labels_):
+            for label in set(labels):
                 if label == -1:
                     continue
 
-                cluster_mask = db.labels_ == label
-                cluster_points_indices = np.where(cluster_mask)[0]
+                cluster_points_indices = members[int(label)]
                 # Ensure we don't try to form a cluster from current_transaction if it's the only point
                 # and DBSCAN behavior might be unexpected with min_samples=1.
                 # However, DBSCAN's min_samples handles this.
                 
-                cluster_points_list = [all_transactions[i] for i in cluster_points_indices]
-                
-                if cluster_info := self._calculate_cluster_metrics(cluster_points_list):
+                if cluster_info := self._calculate_cluster_metrics(all_transactions[cluster_points_indices]):
                     cluster_info['label'] = int(label)
                     clusters.append(cluster_info)
                     cluster_map[label] = cluster_info
 
-            # Calculate baseline density from non-outlier DBSCAN-detected clusters
-            valid_dbscan_clusters = [c for c in clusters 
-                                     if c["density_per_km2"] < self.abs_density_threshold]
-            baseline_density = float(np.median(
-                [c["density_per_km2"] for c in valid_dbscan_clusters]
-            )) if valid_dbscan_clusters else 0.0
-
-            # Add fraud flags to DBSCAN-detected clusters
-            for cluster in clusters: # This loop is for DBSCAN clusters only at this point
-                absolute = cluster["density_per_km2"] > self.abs_density_threshold
-                relative = cluster["density_per_km2"] > (baseline_density * self.rel_density_multiplier)
-                
-                cluster["is_suspicious"] = bool(absolute or relative)
-                cluster["suspicious_reason"] = (
-                    f"Absolute threshold exceeded ({self.abs_density_threshold})" if absolute else
-                    f"Relative threshold ({self.rel_density_multiplier}x baseline)" if relative else "Normal"
+            # Current transaction is the last point of the fit
+            current_cluster = None
+            if len(labels) > 0:
+                current_label = labels[-1]
+                if current_label != -1:
+                    current_cluster = cluster_map.get(current_label)
+
+            return self._build_cluster_result(clusters, current_cluster, current_transaction)
+
+        except MemoryError:
+            # Left to the caller: the worker pool reports it as an exceeded memory budget
+            raise
+        except Exception as e:
+            logger.error(f"Clustering failed: {str(e)}", exc_info=True)
+            return {"clustering_error": str(e)}
+
+    def analyze_incremental(self, cluster_state, history, current_transaction):
+        """
+        Same result as analyze_transaction_clusters(history + [current_transaction]), computed
+        from a user's persisted IncrementalDBSCAN state instead of a full refit.
+        """
+        try:
+            with cluster_state.lock:
+                cluster_state.sync_history(history)
+                clusters, current_cluster = cluster_state.clusters_with_point(
+                    current_transaction, self._calculate_cluster_metrics
                 )
+            return self._build_cluster_result(clusters, current_cluster, current_transaction)
 
-            # --- START OF HARDCODED CLUSTER INJECTION ---
-            hardcoded_clusters_definitions = [
-                { # Karachi - Normal density
-                    "latitude_center": 24.8607, "longitude_center": 67.0011,
-                    "radius_km": 1.0, "transaction_count": 10 
-                },
-                { # Lahore - Relatively high density
-                    "latitude_center": 31.5204, "longitude_center": 74.3587,
-                    "radius_km": 0.5, "transaction_count": 50 
-                },
-                { # Islamabad - Absolutely high density
-                    "latitude_center": 33.6844, "longitude_center": 73.0479,
-                    "radius_km": 0.2, "transaction_count": 30 
-                }
-            ]
+        except Exception as e:
+            logger.error(f"Clustering failed: {str(e)}", exc_info=True)
+            return {"clustering_error": str(e)}
 
-            for hc_def in hardcoded_clusters_definitions:
-                current_max_label += 1 # Assign a new unique label
-                
-                hc_area = np.pi * (hc_def["radius_km"] ** 2)
-                # Use a tiny area if radius is 0 to avoid division by zero and represent high density
-                hc_density = hc_def["transaction_count"] / (hc_area if hc_area > 0 else 0.0001)
-
-                # Determine if suspicious using the baseline_density from DBSCAN clusters
-                hc_abs_suspicious = hc_density > self.abs_density_threshold
-                # Relative check: only if baseline_density is positive, otherwise any positive density is "infinitely" larger
-                hc_rel_suspicious = hc_density > (baseline_density * self.rel_density_multiplier)
-                
-                hc_is_suspicious = bool(hc_abs_suspicious or hc_rel_suspicious)
-                hc_suspicious_reason = "Normal"
-                if hc_abs_suspicious:
-                    hc_suspicious_reason = f"Absolute threshold exceeded ({self.abs_density_threshold})"
-                elif hc_rel_suspicious: # Check this only if not absolute, to give priority to absolute
-                    hc_suspicious_reason = f"Relative threshold ({self.rel_density_multiplier}x baseline)"
-
-                hardcoded_cluster = {
-                    "latitude_center": round(hc_def["latitude_center"], self.coord_precision),
-                    "longitude_center": round(hc_def["longitude_center"], self.coord_precision),
-                    "radius_km": round(hc_def["radius_km"], self.radius_precision),
-                    "density_per_km2": round(hc_density, self.density_precision),
-                    "transaction_count": hc_def["transaction_count"],
-                    "label": current_max_label, # Unique label for this hardcoded cluster
-                    "is_suspicious": hc_is_suspicious,
-                    "suspicious_reason": hc_suspicious_reason
-                }
-                clusters.append(hardcoded_cluster)
-            # --- END OF HARDCODED CLUSTER INJECTION ---
-
-
-            # Find current transaction's cluster (only considers DBSCAN clusters)
-            current_in_cluster = False
-            current_cluster_info = None
-            # Ensure all_transactions is not empty before trying to access its last element's label
-            if all_transactions: # Should always be true as current_transaction is appended
-                current_label_index = len(all_transactions) - 1
-                if current_label_index < len(db.labels_): # Check if current_transaction was part of fit
-                    current_label = db.labels_[current_label_index]
-
-                    if current_label != -1 and current_label in cluster_map:
-                        # current_transaction is part of a DBSCAN cluster
-                        cluster = cluster_map[current_label] 
-                        centroid = (cluster["latitude_center"], cluster["longitude_center"])
-                        distance = geodesic(centroid, current_transaction).km
-                        buffer_radius = cluster["radius_km"] * (1 + self.buffer_percentage)
-                        
-                        if distance <= buffer_radius:
-                            current_in_cluster = True
-                            # Find the index of this cluster in the 'clusters' list for user-friendly numbering
-                            # This needs care if clusters list was reordered or hardcoded clusters are mixed in before this point.
-                            # Since hardcoded clusters are appended, indices of DBSCAN clusters remain stable if we search early.
-                            # However, it's safer to find the index in the *final* clusters list.
-                            try:
-                                cluster_index_in_final_list = clusters.index(cluster) + 1
-                            except ValueError: # Should not happen if cluster is from cluster_map and clusters list
-                                cluster_index_in_final_list = "N/A"
-
-
-                            current_cluster_info = {
-                                "cluster_number": f"cluster{cluster_index_in_final_list}",
-                                "density": float(cluster["density_per_km2"]),
-                                "distance_km": round(distance, self.radius_precision)
-                            }
+    def _build_cluster_result(self, clusters, current_cluster, current_transaction):
+        """
+        Flags suspicious clusters, appends the curated hotspot clusters and builds the result dict.
+
+        Args:
+            clusters (list): DBSCAN cluster metric dicts (with 'label'), in label order.
+            current_cluster (dict): Entry of 'clusters' holding the current transaction, or None.
+            current_transaction (tuple): (lat, lon) of the current transaction.
+        """
+        # Determine the starting label for hotspot clusters to ensure uniqueness
+        current_max_label = max((c["label"] for c in clusters), default=-1)
+
+        # Calculate baseline density from non-outlier DBSCAN-detected clusters
+        valid_dbscan_clusters = [c for c in clusters 
+                                 if c["density_per_km2"] < self.abs_density_threshold]
+        baseline_density = float(np.median(
+            [c["density_per_km2"] for c in valid_dbscan_clusters]
+        )) if valid_dbscan_clusters else 0.0
+
+        # Add fraud flags to DBSCAN-detected clusters
+        for cluster in clusters: # This loop is for DBSCAN clusters only at this point
+            absolute = cluster["density_per_km2"] > self.abs_density_threshold
+            relative = cluster["density_per_km2"] > (baseline_density * self.rel_density_multiplier)
+            
+            cluster["is_suspicious"] = bool(absolute or relative)
+            cluster["suspicious_reason"] = (
+                f"Absolute threshold exceeded ({self.abs_density_threshold})" if absolute else
+                f"Relative threshold ({self.rel_density_multiplier}x baseline)" if relative else "Normal"
+            )
+
+        # --- START OF CURATED HOTSPOT CLUSTER INJECTION (hotspots.json) ---
+        # Hotspots holding the current transaction come from the grid index, not a scan
+        hotspot_ids, hotspot_distances = self.hotspot_index.query(*current_transaction)
+        reported_hotspots = range(len(self.hotspots)) if self.report_all_hotspots else hotspot_ids.tolist()
+        hotspot_numbers = {}
+
+        for hotspot_id in reported_hotspots:
+            hc_def = self.hotspots[hotspot_id]
+            current_max_label += 1 # Assign a new unique label
+
+            # Density is precomputed at load; the relative check depends on this request's baseline
+            hc_density = hc_def["density_per_km2"]
+            hc_abs_suspicious = hc_density > self.abs_density_threshold
+            # Relative check: only if baseline_density is positive, otherwise any positive density is "infinitely" larger
+            hc_rel_suspicious = hc_density > (baseline_density * self.rel_density_multiplier)
             
-            # Build result with explicit type conversions
-            result = {
-                "clusters_identified": int(len(clusters)), # Now includes hardcoded clusters
-                "this_transaction_is_in_cluster": bool(current_in_cluster),
-                "baseline_density": float(baseline_density)
+            hc_is_suspicious = bool(hc_abs_suspicious or hc_rel_suspicious)
+            hc_suspicious_reason = "Normal"
+            if hc_abs_suspicious:
+                hc_suspicious_reason = f"Absolute threshold exceeded ({self.abs_density_threshold})"
+            elif hc_rel_suspicious: # Check this only if not absolute, to give priority to absolute
+                hc_suspicious_reason = f"Relative threshold ({self.rel_density_multiplier}x baseline)"
+
+            hotspot_cluster = {
+                "latitude_center": round(hc_def["latitude_center"], self.coord_precision),
+                "longitude_center": round(hc_def["longitude_center"], self.coord_precision),
+                "radius_km": round(hc_def["radius_km"], self.radius_precision),
+                "density_per_km2": round(hc_density, self.density_precision),
+                "transaction_count": hc_def["transaction_count"],
+                "label": current_max_label, # Unique label for this hotspot cluster
+                "is_suspicious": hc_is_suspicious,
+                "suspicious_reason": hc_suspicious_reason
             }
-
-            for i, cluster_data in enumerate(clusters, 1): # Iterates over all clusters (DBSCAN + hardcoded)
-                result[f"cluster{i}_info"] = {
-                    key: (float(value) if isinstance(value, (float, np.floating)) else
-                          bool(value) if isinstance(value, (bool, np.bool_)) else
-                          int(value) if isinstance(value, (int, np.integer)) else # Ensure int for count and label
-                          value)
-                    for key, value in cluster_data.items()
+            clusters.append(hotspot_cluster)
+            hotspot_numbers[hotspot_id] = len(clusters)
+        # --- END OF CURATED HOTSPOT CLUSTER INJECTION ---
+
+        # Find current transaction's cluster (only considers DBSCAN clusters)
+        current_in_cluster = False
+        current_cluster_info = None
+        if current_cluster is not None:
+            # current_transaction is part of a DBSCAN cluster
+            cluster = current_cluster
+            centroid = (cluster["latitude_center"], cluster["longitude_center"])
+            distance = float(self.distance_km(*centroid, *current_transaction))
+            buffer_radius = cluster["radius_km"] * (1 + self.buffer_percentage)
+
+            if distance <= buffer_radius:
+                current_in_cluster = True
+                # Hotspot clusters are appended after the DBSCAN ones, so the position
+                # in the final 'clusters' list gives the user-friendly cluster number
+                try:
+                    cluster_index_in_final_list = clusters.index(cluster) + 1
+                except ValueError: # Should not happen, current_cluster comes from 'clusters'
+                    cluster_index_in_final_list = "N/A"
+
+                current_cluster_info = {
+                    "cluster_number": f"cluster{cluster_index_in_final_list}",
+                    "density": float(cluster["density_per_km2"]),
+                    "distance_km": round(distance, self.radius_precision)
                 }
 
-            if current_in_cluster and current_cluster_info:
-                result.update({
-                    "transaction_cluster_number": str(current_cluster_info["cluster_number"]),
-                    "transaction_cluster_density": float(current_cluster_info["density"]),
-                    "distance_from_cluster_center_km": float(current_cluster_info["distance_km"])
-                })
+        # Build result with explicit type conversions
+        result = {
+            "clusters_identified": int(len(clusters)), # Now includes hotspot clusters
+            "this_transaction_is_in_cluster": bool(current_in_cluster),
+            "baseline_density": float(baseline_density)
+        }
+
+        for i, cluster_data in enumerate(clusters, 1): # Iterates over all clusters (DBSCAN + hotspots)
+            result[f"cluster{i}_info"] = {
+                key: (float(value) if isinstance(value, (float, np.floating)) else
+                      bool(value) if isinstance(value, (bool, np.bool_)) else
+                      int(value) if isinstance(value, (int, np.integer)) else # Ensure int for count and label
+                      value)
+                for key, value in cluster_data.items()
+            }
 
-            return result
+        if current_in_cluster and current_cluster_info:
+            result.update({
+                "transaction_cluster_number": str(current_cluster_info["cluster_number"]),
+                "transaction_cluster_density": float(current_cluster_info["density"]),
+                "distance_from_cluster_center_km": float(current_cluster_info["distance_km"])
+            })
 
-        except Exception as e:
-            logger.error(f"Clustering failed: {str(e)}", exc_info=True)
-            return {"clustering_error": str(e)}
+        # Curated hotspot membership (nearest matching hotspot wins)
+        result["this_transaction_is_in_hotspot"] = bool(len(hotspot_ids))
+        if len(hotspot_ids):
+            nearest = int(np.argmin(hotspot_distances))
+            result.update({
+                "transaction_hotspot_number": f"cluster{hotspot_numbers[int(hotspot_ids[nearest])]}",
+                "distance_from_hotspot_center_km": round(float(hotspot_distances[nearest]), self.radius_precision)
+            })
+
+        return result
 
 def detect_geospatial_clusters(data, results):
     try:
-        geo_data = data.get("geospacial_transaction_data_2d", [])
         session = data["login_data"]["session"]
         current_lat = float(session["latitude"])
         current_lon = float(session["longitude"])
-        
-        all_transactions = []
-        # Add historical transactions
-        for point in geo_data:
-            try:
-                lat = float(point["latitude"])
-                lon = float(point["longitude"])
-                all_transactions.append((lat, lon))
-            except (KeyError, ValueError, TypeError) as e: # Added TypeError for point being non-subscriptable
-                logger.warning(f"Invalid historical coordinate data: {point} - {str(e)}")
-        
-        # Add current transaction. It must be added for DBSCAN to potentially label it.
-        all_transactions.append((current_lat, current_lon))
-        
-        if not all_transactions: # Should not happen due to current_transaction
-            logger.warning("No transaction data to analyze.")
-            results["clusters_info"] = {"error": "No transaction data."}
-            return
 
-        analyzer = GeospatialClusterAnalyzer()
-        cluster_info = analyzer.analyze_transaction_clusters(
-            all_transactions, 
-            (current_lat, current_lon) # Pass current transaction coords for distance calculations etc.
-        )
+        # Historical transactions as one (N, 2) float64 array (JSON list or packed base64)
+        try:
+            history, invalid_points = geo_history_from_request(data)
+        except ValueError as e:
+            logger.warning(f"Invalid geo history: {str(e)}")
+            results["clusters_info"] = {"error": f"Invalid geo history: {str(e)}"}
+            return
+        if invalid_points:
+            logger.warning(f"Skipped {invalid_points} invalid historical coordinate points")
+
+        config = CONFIG_SERVICE.current.geospatial
+        analyzer = get_analyzer(config)
+        cluster_state_store = get_cluster_state_store(config)
+        worker_pool = get_geo_worker_pool(config) if len(history) > config.inline_max_points else None
+        user_id = data.get("user_id")
+
+        if worker_pool is not None:
+            # Large history: clustered in a worker process, within the pool's budgets
+            cluster_info = worker_pool.analyze(history, (current_lat, current_lon))
+        elif cluster_state_store is not None and user_id is not None:
+            # Reuse the user's cluster state; only new history points are clustered
+            cluster_info = analyzer.analyze_incremental(
+                cluster_state_store.get(user_id),
+                history,
+                (current_lat, current_lon)
+            )
+        else:
+            # Add current transaction. It must be added for DBSCAN to potentially label it.
+            all_transactions = np.concatenate([history, [(current_lat, current_lon)]])
+
+            cluster_info = analyzer.analyze_transaction_clusters(
+                all_transactions, 
+                (current_lat, current_lon) # Pass current transaction coords for distance calculations etc.
+            )
         
-        # Ensure all values are JSON serializable using a robust method
-        # The explicit conversions in analyze_transaction_clusters should mostly handle this
-        # but json.dumps with default=str is a final safeguard.
-        results["clusters_info"] = json.loads(json.dumps(cluster_info, default=str))
+        # _build_cluster_result constructs JSON-native values (str keys, int/float/bool/str),
+        # so the result is stored as is; the response encoder handles anything else
+        if invalid_points and "clustering_error" not in cluster_info:
+            cluster_info["invalid_history_points"] = invalid_points
+        results["clusters_info"] = cluster_info
 
     except KeyError as e:
         logger.warning(f"Missing required field in input data: {str(e)}")
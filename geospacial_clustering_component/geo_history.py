@@ -0,0 +1,133 @@
+"""
+geo_history.py - Parsing of the user's geo history into a contiguous (N, 2) float64 array
+
+Two request encodings are accepted:
+
+* "geospacial_transaction_data_2d": JSON list of {"latitude": ..., "longitude": ...}
+  objects (numbers or numeric strings). The coordinates are streamed straight into one
+  preallocated float64 buffer; no per-point Python tuples are built. A point is invalid
+  (skipped and counted) if it is not an object, lacks a coordinate, holds something
+  that is not a number, or its coordinates are not finite.
+* "geospacial_transaction_data_2d_b64": base64 of little-endian float64 values packed as
+  lat0, lon0, lat1, lon1, ... (16 bytes per point), decoded without copying. Non-finite
+  points are skipped and counted. Takes precedence when both fields are present.
+
+geo_history_from_request keeps its result in the request dict (PARSED_GEO_HISTORY_KEY),
+so the result cache key and the geospatial component parse a history once per request.
+"""
+
+import base64
+import binascii
+import itertools
+from operator import itemgetter
+
+import numpy as np
+
+GEO_HISTORY_FIELD = "geospacial_transaction_data_2d"
+PACKED_GEO_HISTORY_FIELD = "geospacial_transaction_data_2d_b64"
+PARSED_GEO_HISTORY_KEY = "_parsed_geo_history"
+
+_PACKED_DTYPE = np.dtype("<f8")
+_get_coordinates = itemgetter("latitude", "longitude")
+
+
+def _parse_points(points, buffer):
+    """Point-by-point fill of buffer for histories holding invalid entries; returns the valid count."""
+    count = 0
+    for point in points:
+        try:
+            buffer[count, 0] = float(point["latitude"])
+            buffer[count, 1] = float(point["longitude"])
+        except (KeyError, ValueError, TypeError, OverflowError):
+            continue
+        count += 1
+    return count
+
+
+def _drop_non_finite(history):
+    finite = np.isfinite(history).all(axis=1)
+    if finite.all():
+        return history, 0
+    return np.ascontiguousarray(history[finite]), int(len(finite) - finite.sum())
+
+
+def parse_geo_history(points):
+    """
+    Parses a JSON geo history list.
+
+    Returns:
+        (history, invalid_count): (N, 2) float64 array of [lat, lon] in degrees, in
+        request order, and the number of skipped points.
+    """
+    if not points:
+        return np.empty((0, 2), dtype=np.float64), 0
+
+    size = len(points)
+    try:
+        # One pass into a buffer of known size: values convert like float(), None becomes NaN
+        flat = np.fromiter(
+            itertools.chain.from_iterable(map(_get_coordinates, points)),
+            dtype=np.float64, count=2 * size,
+        )
+        history = flat.reshape(size, 2)
+    except (KeyError, ValueError, TypeError, OverflowError):
+        history = np.empty((size, 2), dtype=np.float64)
+        history = history[:_parse_points(points, history)]
+
+    history, _ = _drop_non_finite(history)
+    return history, size - len(history)
+
+
+def parse_packed_geo_history(packed):
+    """
+    Decodes a base64 packed-float64 geo history.
+
+    Returns:
+        (history, invalid_count) as parse_geo_history.
+
+    Raises:
+        ValueError: not base64, or not a whole number of 16-byte points.
+    """
+    try:
+        raw = base64.b64decode(packed, validate=True)
+    except (binascii.Error, ValueError, TypeError) as e:
+        raise ValueError(f"'{PACKED_GEO_HISTORY_FIELD}' is not valid base64: {e}")
+    if len(raw) % (2 * _PACKED_DTYPE.itemsize):
+        raise ValueError(f"'{PACKED_GEO_HISTORY_FIELD}' must hold float64 (latitude, longitude) pairs")
+
+    history = np.frombuffer(raw, dtype=_PACKED_DTYPE).reshape(-1, 2)
+    if not _PACKED_DTYPE.isnative:
+        history = history.astype(np.float64)
+    return _drop_non_finite(history)
+
+
+def geo_history_from_request(data):
+    """
+    (history, invalid_count) from whichever geo history encoding the request uses.
+
+    The first call parses and stores the (read-only) result in data; later calls return it.
+    """
+    parsed = data.get(PARSED_GEO_HISTORY_KEY)
+    if parsed is not None:
+        return parsed
+    packed = data.get(PACKED_GEO_HISTORY_FIELD)
+    if packed is not None:
+        history, invalid_count = parse_packed_geo_history(packed)
+    else:
+        history, invalid_count = parse_geo_history(data.get(GEO_HISTORY_FIELD, []))
+    history.flags.writeable = False
+    parsed = data[PARSED_GEO_HISTORY_KEY] = (history, invalid_count)
+    return parsed
+
+
+def geo_history_size(data):
+    """Number of history points in the request (valid or not), without parsing them."""
+    packed = data.get(PACKED_GEO_HISTORY_FIELD)
+    if isinstance(packed, str):
+        return (len(packed.rstrip("=")) * 3 // 4) // (2 * _PACKED_DTYPE.itemsize)
+    return len(data.get(GEO_HISTORY_FIELD) or ())
+
+
+def pack_geo_history(history):
+    """Encodes an (N, 2) [lat, lon] array (or list of pairs) for PACKED_GEO_HISTORY_FIELD."""
+    return base64.b64encode(np.asarray(history, dtype=_PACKED_DTYPE).tobytes()).decode("ascii")
@@ -0,0 +1,290 @@
+"""
+geo_worker_pool.py - Separate processes for clustering large geo histories
+
+A history of a few hundred thousand points can keep detect_geospatial_clusters busy
+for seconds, holding the gunicorn worker's GIL and starving the other detectors of
+every request it serves. Histories above inline_max_points are therefore clustered in
+a small pool of dedicated processes; smaller ones stay in the request's own thread
+(see detect_geospatial_clusters).
+
+A task hands the history over in a shared memory block (multiprocessing.shared_memory)
+instead of pickling it: the worker copies it out once and the block is unlinked when
+the task ends. Workers cluster the whole history with the analyzer of their own config
+service (they follow config reloads like any process); the per-user incremental state
+is not used for these histories.
+
+Every task has budgets instead of blocking the request:
+* time_budget_seconds covers waiting for an idle worker and clustering. A worker that
+  misses it is killed and replaced.
+* memory_budget_mb caps the address space a worker may add during a task
+  (RLIMIT_AS, Unix only); allocations beyond it raise MemoryError in the worker.
+Either way the result is {"clustering_skipped": "budget exceeded", ...} (see
+_budget_exceeded), which the controller counts as a failed component and does not
+cache.
+
+The pool is per process, like the other stores; it is created on the first large
+history of a gunicorn worker (or of each process of the "process" executor modes).
+Workers are never forked from the request process, whose other threads (component
+executor, config watcher, snapshots) may hold locks at that moment: they come from a
+forkserver that only preloads the third-party clustering libraries (spawn where there
+is no forkserver). They are started, and replaced after a kill, from background
+threads, so a request only waits for them within its time budget.
+"""
+
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from metrics import REGISTRY
+
+try:
+    import resource
+except ImportError:  # not available on Windows: no memory cap
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+BUDGET_EXCEEDED = "budget exceeded"
+
+# Imported once by the forkserver, so new workers start with them loaded. Only
+# third-party modules: the service's own modules start threads when imported.
+_FORKSERVER_PRELOAD = ["numpy", "scipy.sparse.csgraph", "sklearn.cluster", "sklearn.neighbors"]
+
+
+def _worker_context():
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(_FORKSERVER_PRELOAD)
+        return context
+    return multiprocessing.get_context("spawn")
+
+
+def _budget_exceeded(budget, history_points):
+    REGISTRY.increment(f"geospatial_budget_exceeded_{budget}")
+    return {"clustering_skipped": BUDGET_EXCEEDED, "budget": budget, "history_points": history_points}
+
+
+def _address_space():
+    """Current virtual memory size of this process in bytes, or None when unknown."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[0]) * resource.getpagesize()
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _worker_main(connection, memory_budget_bytes):
+    """Worker process: clusters (shared memory name, point count, current point) tasks until None."""
+    # Imported here: detect_geospatial_clusters imports this module
+    from config_service import CONFIG_SERVICE
+    from geospacial_clustering_component.detect_geospatial_clusters import get_analyzer, preload
+
+    # Loaded before any memory cap applies (mapping the shared libraries needs address space);
+    # the analyzer is built now so the first task does not pay for it
+    preload()
+    get_analyzer(CONFIG_SERVICE.current.geospatial)
+
+    while True:
+        try:
+            task = connection.recv()
+        except EOFError:
+            return
+        if task is None:
+            return
+        name, count, current = task
+        start = time.perf_counter()
+
+        block = SharedMemory(name=name)
+        history = np.ndarray((count, 2), dtype=np.float64, buffer=block.buf)
+        all_transactions = np.concatenate([history, [current]])
+        del history
+        block.close()
+
+        # The budget covers what clustering allocates on top of the worker and its input
+        analyzer = get_analyzer(CONFIG_SERVICE.current.geospatial)
+        limit = None
+        if resource is not None and memory_budget_bytes:
+            address_space = _address_space()
+            if address_space is not None:
+                limit = resource.getrlimit(resource.RLIMIT_AS)
+                resource.setrlimit(resource.RLIMIT_AS, (address_space + memory_budget_bytes, limit[1]))
+        try:
+            result = analyzer.analyze_transaction_clusters(all_transactions, current)
+        except MemoryError:
+            result = None
+        except Exception as e:
+            logger.error(f"Geospatial worker task failed: {str(e)}", exc_info=True)
+            result = {"clustering_error": str(e)}
+        finally:
+            if limit is not None:
+                resource.setrlimit(resource.RLIMIT_AS, limit)
+        del all_transactions
+        connection.send((result, time.perf_counter() - start))
+
+
+class _Worker:
+    __slots__ = ("process", "connection")
+
+    def __init__(self, process, connection):
+        self.process = process
+        self.connection = connection
+
+    def stop(self):
+        try:
+            self.connection.send(None)
+        except OSError:
+            pass
+        self.connection.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+
+
+class GeoWorkerPool:
+    """Worker processes for large histories; see the module docstring."""
+
+    def __init__(self, max_workers=2, time_budget_seconds=3.0, memory_budget_mb=512):
+        self.max_workers = max_workers
+        self.time_budget_seconds = time_budget_seconds
+        self.memory_budget_mb = memory_budget_mb
+        self._context = _worker_context()
+        # Workers share this process's tracker, so the blocks they attach to stay owned here
+        resource_tracker.ensure_running()
+        self._idle = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+        for _ in range(max_workers):
+            self._in_background(self._add_worker)
+
+    def _in_background(self, target, *args):
+        threading.Thread(target=target, args=args, name="geo-worker-start", daemon=True).start()
+
+    def _start_worker(self):
+        connection, child_connection = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_main,
+            args=(child_connection, int(self.memory_budget_mb * 2 ** 20)),
+            name="geo-worker",
+            daemon=True,
+        )
+        process.start()
+        child_connection.close()
+        return _Worker(process, connection)
+
+    def _add_worker(self):
+        try:
+            worker = self._start_worker()
+        except Exception as e:
+            logger.error(f"Could not start a geospatial worker: {str(e)}", exc_info=True)
+            return
+        self._release(worker)
+
+    def _release(self, worker):
+        with self._lock:
+            if not self._closed:
+                self._idle.put(worker)
+                return
+        worker.stop()
+
+    def _replace(self, worker):
+        """Kills worker and starts another one (off the request thread)."""
+        def replace():
+            worker.kill()
+            with self._lock:
+                if self._closed:
+                    return
+            self._add_worker()
+
+        self._in_background(replace)
+
+    def analyze(self, history, current_transaction):
+        """
+        analyze_transaction_clusters(history + [current_transaction]) in a worker process,
+        or the budget exceeded result.
+        """
+        deadline = time.monotonic() + self.time_budget_seconds
+        history = np.ascontiguousarray(history, dtype=np.float64).reshape(-1, 2)
+        try:
+            worker = self._idle.get(timeout=self.time_budget_seconds)
+        except queue.Empty:
+            return _budget_exceeded("time", len(history))
+
+        block = SharedMemory(create=True, size=max(history.nbytes, 1))
+        try:
+            shared = np.ndarray(history.shape, dtype=np.float64, buffer=block.buf)
+            shared[:] = history
+            del shared
+
+            REGISTRY.increment("geospatial_pool_tasks")
+            try:
+                worker.connection.send((block.name, len(history), tuple(current_transaction)))
+                done = worker.connection.poll(max(deadline - time.monotonic(), 0))
+                reply = worker.connection.recv() if done else None
+            except (EOFError, OSError) as e:
+                logger.error(f"Geospatial worker exited: {str(e)}")
+                self._replace(worker)
+                return {"clustering_error": f"Geospatial worker exited: {str(e)}"}
+            if reply is None:
+                logger.warning(f"Clustering {len(history)} points exceeded the {self.time_budget_seconds}s budget")
+                self._replace(worker)
+                return _budget_exceeded("time", len(history))
+            self._release(worker)
+        finally:
+            block.close()
+            try:
+                block.unlink()
+            except FileNotFoundError:
+                pass
+
+        result, elapsed = reply
+        REGISTRY.observe_component("geospatial_pool", elapsed, result is None)
+        if result is None:
+            logger.warning(f"Clustering {len(history)} points exceeded the {self.memory_budget_mb} MB budget")
+            return _budget_exceeded("memory", len(history))
+        return result
+
+    def close(self):
+        """Stops the idle workers now and the busy ones when their task ends."""
+        with self._lock:
+            self._closed = True
+        while True:
+            try:
+                self._idle.get_nowait().stop()
+            except queue.Empty:
+                return
+
+
+# Pool shared by all requests of this process. It is replaced (old workers stopped) when a
+# config reload changes its settings.
+_pool = None
+_pool_key = None
+_pool_lock = threading.Lock()
+
+
+def get_geo_worker_pool(config):
+    """Returns the pool for the given geospatial settings, or None when it is disabled."""
+    global _pool, _pool_key
+    if not config.pool_enabled:
+        return None
+
+    key = config.pool_key
+    if key != _pool_key:
+        with _pool_lock:
+            if key != _pool_key:
+                if _pool is not None:
+                    _pool.close()
+                _pool = GeoWorkerPool(
+                    max_workers=config.pool_max_workers,
+                    time_budget_seconds=config.pool_time_budget_seconds,
+                    memory_budget_mb=config.pool_memory_budget_mb,
+                )
+                _pool_key = key
+    return _pool
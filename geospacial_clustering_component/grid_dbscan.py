@@ -0,0 +1,328 @@
+"""
+grid_dbscan.py - DBSCAN backend for large transaction histories
+
+Same labels as sklearn's DBSCAN(metric="haversine") over the history, computed in
+three tiers by the number of distinct coordinates:
+
+* below grid_min_points: sklearn's DBSCAN over the distinct coordinates, each weighted
+  by its number of occurrences (sample_weight). Identical points have identical
+  neighbourhoods, core status and labels, and sklearn numbers clusters by their first
+  core point and gives a border point the first cluster reaching it, so mapping the
+  labels back to every occurrence reproduces the unweighted fit exactly. Repeat
+  merchants make histories shrink a lot here.
+* from grid_min_points: the same DBSCAN with its own neighbour search (grid DBSCAN).
+  Points are pre-binned into cells with a diagonal of eps over their 3D unit vectors
+  (as in incremental_clustering.py). All points of a cell are neighbours, so dense
+  cells need no distance computations at all; other pairs are only compared between
+  nearby cells, in vectorized chunks, and memory stays bounded by the chunk size
+  instead of growing with the neighbourhood lists of dense areas. Pairs within
+  floating-point noise of eps are decided with sklearn's own formula, so the labels are
+  the same.
+* from approximate_min_points, or when the grid search would compare more than
+  max_candidate_pairs point pairs (very dense histories): approximate DBSCAN. Points
+  are merged into cells whose diagonal is APPROXIMATE_CELL_FRACTION of eps, and each
+  cell's weighted centroid is clustered as above; every point takes its cell's label.
+  A point may be moved by up to that fraction of eps, so clusters can merge or split
+  differently near the eps boundary.
+
+Cluster metrics are still computed from the original points by the analyzer.
+"""
+
+import numpy as np
+
+# Approximate tier: diagonal of the merged cells, as a fraction of eps
+APPROXIMATE_CELL_FRACTION = 0.25
+
+# Candidate point pairs compared per vectorized step of the grid search
+CHUNK_PAIRS = 1 << 19
+
+# Relative width of the band around eps where pairs are tested with sklearn's formula
+_RDIST_BAND = 1e-9
+
+# Cell coordinates are packed into one int64 key while the grid spans fewer cells per axis
+_MAX_CELLS_PER_AXIS = 1 << 20
+
+# Offsets of the cells that can hold points within eps of a cell's points (cells have a
+# diagonal of eps, so up to two cells away on every axis)
+_NEIGHBOR_OFFSETS = tuple(
+    (dx, dy, dz) for dx in range(-2, 3) for dy in range(-2, 3) for dz in range(-2, 3) if (dx, dy, dz) != (0, 0, 0)
+)
+
+# Cells are shrunk by this fraction so that points of a cell are clearly within eps
+_CELL_MARGIN = 1e-6
+
+# Neighbouring cells whose core point pairs are at most this many are linked in bulk;
+# larger pairs are linked one by one, probing _LINK_PROBE points of each cell first
+_LINK_BLOCK = 4096
+_LINK_PROBE = 32
+
+CLUSTERING_BACKENDS = ("sklearn", "grid")
+
+
+def deduplicate(points):
+    """
+    Distinct rows of points in order of first occurrence.
+
+    Returns:
+        (unique, inverse, counts): points == unique[inverse], counts[i] occurrences of unique[i]
+    """
+    unique, first, inverse, counts = np.unique(points, axis=0, return_index=True, return_inverse=True,
+                                               return_counts=True)
+    order = np.argsort(first, kind="stable")
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return unique[order], rank[inverse.reshape(-1)], counts[order]
+
+
+def _unit_vectors(radians):
+    cos_lat = np.cos(radians[:, 0])
+    return np.column_stack([cos_lat * np.cos(radians[:, 1]), cos_lat * np.sin(radians[:, 1]), np.sin(radians[:, 0])])
+
+
+def _cell_keys(unit, cell_size):
+    """int64 key of each point's grid cell and the key stride, or (None, None) if the grid is too fine."""
+    span = int(np.ceil(1.0 / cell_size)) + 2
+    size = 2 * span + 1
+    if size >= _MAX_CELLS_PER_AXIS:
+        return None, None
+    cells = np.floor(unit / cell_size).astype(np.int64) + span
+    return (cells[:, 0] * size + cells[:, 1]) * size + cells[:, 2], size
+
+
+def _cross_pairs(a_start, a_count, b_start, b_count):
+    """Yields (i, j) chunks of every i in [a_start, a_start + a_count) with every j of the paired b range."""
+    sizes = a_count * b_count
+    ends = np.cumsum(sizes)
+    if not len(ends) or ends[-1] == 0:
+        return
+    breaks = np.searchsorted(ends, np.arange(CHUNK_PAIRS, ends[-1], CHUNK_PAIRS), side="right").tolist()
+    for low, high in zip((0, *breaks), (*breaks, len(sizes))):
+        size = sizes[low:high]
+        total = int(size.sum())
+        if total == 0:
+            continue
+        local = np.arange(total) - np.repeat(np.cumsum(size) - size, size)
+        width = np.repeat(b_count[low:high], size)
+        yield np.repeat(a_start[low:high], size) + local // width, np.repeat(b_start[low:high], size) + local % width
+
+
+def _any_within(within, points_a, points_b):
+    return within(np.repeat(points_a, len(points_b)), np.tile(points_b, len(points_a))).any()
+
+
+def _groups(cells, cell_count):
+    """Start and length of each cell's run in a cell-sorted array of cell ids."""
+    count = np.bincount(cells, minlength=cell_count)
+    return np.cumsum(count) - count, count
+
+
+def grid_dbscan(radians, weights, eps_rad, min_samples, max_candidate_pairs=None):
+    """
+    Weighted DBSCAN labels of radians (N x 2 lat/lon) with the grid neighbour search.
+
+    Cells have a diagonal of eps, so the points of a cell are all neighbours of each
+    other: a cell weighing min_samples is all core points, and the core points of a cell
+    always share a cluster. Point pairs are only compared for the points of lighter
+    cells (core status), between the core points of neighbouring cells (until one pair
+    links them) and for border points. Clusters are numbered by their first core point
+    in input order and a border point takes the first cluster among its core
+    neighbours, as in sklearn. Returns None when the grid is too fine for int64 keys or
+    the core search exceeds max_candidate_pairs point pairs.
+    """
+    from scipy.sparse import coo_matrix
+    from scipy.sparse.csgraph import connected_components
+
+    n = len(radians)
+    keys, size = _cell_keys(_unit_vectors(radians), 2 * np.sin(0.5 * eps_rad) / np.sqrt(3) * (1 - _CELL_MARGIN))
+    if keys is None:
+        return None
+
+    # Points sorted by cell; positions below are in this order
+    order = np.argsort(keys, kind="stable")
+    cell_keys, cell_start, cell_count = np.unique(keys[order], return_index=True, return_counts=True)
+    cell_total = len(cell_keys)
+    cell_of = np.repeat(np.arange(cell_total), cell_count)
+
+    # Neighbouring cell pairs (a, b), a != b, both directions. With a diagonal of eps, points
+    # up to eps apart are at most two cells apart on every axis.
+    pair_a, pair_b = [], []
+    for offset in _NEIGHBOR_OFFSETS:
+        target = cell_keys + ((offset[0] * size + offset[1]) * size + offset[2])
+        position = np.minimum(np.searchsorted(cell_keys, target), cell_total - 1)
+        found = cell_keys[position] == target
+        pair_a.append(np.flatnonzero(found))
+        pair_b.append(position[found])
+    pair_a, pair_b = np.concatenate(pair_a), np.concatenate(pair_b)
+
+    unit = _unit_vectors(radians[order])
+    lat, lon = radians[order, 0], radians[order, 1]
+    cos_lat = np.cos(lat)
+    weight = np.asarray(weights, dtype=np.float64)[order]
+    max_rdist = np.sin(0.5 * eps_rad) ** 2
+    # Squared chord / 4 equals sklearn's rdist; its rounding error is far below this band,
+    # inside which sklearn's own formula decides
+    band = max_rdist * _RDIST_BAND
+
+    def within(i, j):
+        delta = unit[i] - unit[j]
+        rdist = 0.25 * np.einsum("ij,ij->i", delta, delta)
+        result = rdist <= max_rdist - band
+        close = np.flatnonzero(np.abs(rdist - max_rdist) <= band)
+        if len(close):
+            # sklearn's haversine rdist, same operation order
+            a, b = i[close], j[close]
+            sin_lat = np.sin(0.5 * (lat[a] - lat[b]))
+            sin_lon = np.sin(0.5 * (lon[a] - lon[b]))
+            result[close] = sin_lat * sin_lat + cos_lat[a] * cos_lat[b] * sin_lon * sin_lon <= max_rdist
+        return result
+
+    # Core points: the own cell counts whole; lighter cells also count their neighbours' points
+    cell_weight = np.bincount(cell_of, weights=weight, minlength=cell_total)
+    neighbor_weight = cell_weight[cell_of]
+    light = cell_weight[pair_a] < min_samples
+    light_a, light_b = pair_a[light], pair_b[light]
+    if max_candidate_pairs is not None and int((cell_count[light_a] * cell_count[light_b]).sum()) > max_candidate_pairs:
+        return None
+    for i, j in _cross_pairs(cell_start[light_a], cell_count[light_a], cell_start[light_b], cell_count[light_b]):
+        linked = within(i, j)
+        neighbor_weight += np.bincount(i[linked], weights=weight[j[linked]], minlength=n)
+    is_core = neighbor_weight >= min_samples
+
+    labels = np.full(n, -1, dtype=np.int64)
+    core = np.flatnonzero(is_core)
+    if not len(core):
+        return labels
+
+    # Core points grouped by cell; cells with core points are linked when any two of
+    # their core points are neighbours
+    core_start, core_count = _groups(cell_of[core], cell_total)
+    linkable = (pair_a < pair_b) & (core_count[pair_a] > 0) & (core_count[pair_b] > 0)
+    link_a, link_b = pair_a[linkable], pair_b[linkable]
+    products = core_count[link_a] * core_count[link_b]
+    small = products <= _LINK_BLOCK
+    edges_a, edges_b = [], []
+    for i, j in _cross_pairs(core_start[link_a[small]], core_count[link_a[small]],
+                             core_start[link_b[small]], core_count[link_b[small]]):
+        linked = within(core[i], core[j])
+        edges_a.append(cell_of[core[i[linked]]])
+        edges_b.append(cell_of[core[j[linked]]])
+    edges_a = np.concatenate(edges_a or [np.empty(0, dtype=np.int64)])
+    edges_b = np.concatenate(edges_b or [np.empty(0, dtype=np.int64)])
+    _, component = connected_components(
+        coo_matrix((np.ones(len(edges_a), dtype=np.int8), (edges_a, edges_b)), shape=(cell_total, cell_total)),
+        directed=False)
+
+    # Large cell pairs one by one, skipping those already connected; the points of each
+    # cell closest to the other cell's centre are tried first
+    parent = list(range(component.max() + 1))
+
+    def find(node):
+        while parent[node] != node:
+            parent[node] = node = parent[parent[node]]
+        return node
+
+    for a, b in zip(link_a[~small].tolist(), link_b[~small].tolist()):
+        root_a, root_b = find(component[a]), find(component[b])
+        if root_a == root_b:
+            continue
+        members_a = core[core_start[a]:core_start[a] + core_count[a]]
+        members_b = core[core_start[b]:core_start[b] + core_count[b]]
+        nearest_a = members_a[np.argsort(unit[members_a] @ unit[members_b].mean(axis=0))[::-1]]
+        nearest_b = members_b[np.argsort(unit[members_b] @ unit[members_a].mean(axis=0))[::-1]]
+        rows = max(CHUNK_PAIRS // len(nearest_b), 1)
+        if _any_within(within, nearest_a[:_LINK_PROBE], nearest_b[:_LINK_PROBE]) or any(
+                _any_within(within, nearest_a[first:first + rows], nearest_b)
+                for first in range(0, len(nearest_a), rows)):
+            parent[root_a] = root_b
+    cluster_of_cell = np.array([find(c) for c in range(component.max() + 1)])[component]
+
+    # Clusters numbered by their first core point in input order
+    first_core = np.full(cell_total, n, dtype=np.int64)
+    np.minimum.at(first_core, cluster_of_cell[cell_of[core]], order[core])
+    clustered = np.flatnonzero(first_core < n)
+    number = np.empty(cell_total, dtype=np.int64)
+    number[clustered[np.argsort(first_core[clustered])]] = np.arange(len(clustered))
+    labels[core] = number[cluster_of_cell[cell_of[core]]]
+
+    # Border points: the lowest cluster among the core points within eps (in their own or
+    # a neighbouring cell)
+    noise = np.flatnonzero(~is_core)
+    if len(noise):
+        noise_start, noise_count = _groups(cell_of[noise], cell_total)
+        own_cells = np.arange(cell_total)
+        border_a = np.concatenate([own_cells, pair_a])
+        border_b = np.concatenate([own_cells, pair_b])
+        keep = (noise_count[border_a] > 0) & (core_count[border_b] > 0)
+        border_a, border_b = border_a[keep], border_b[keep]
+        best = np.full(n, n, dtype=np.int64)
+        for i, j in _cross_pairs(noise_start[border_a], noise_count[border_a],
+                                 core_start[border_b], core_count[border_b]):
+            points, cores = noise[i], core[j]
+            linked = within(points, cores)
+            np.minimum.at(best, points[linked], labels[cores[linked]])
+        border = best < n
+        labels[border] = best[border]
+
+    result = np.empty(n, dtype=np.int64)
+    result[order] = labels
+    return result
+
+
+def approximate_dbscan(radians, weights, eps_rad, min_samples):
+    """Approximate DBSCAN labels: grid_dbscan over weighted centroids of small cells (see the module docstring)."""
+    unit = _unit_vectors(radians)
+    keys, _ = _cell_keys(unit, 2 * np.sin(0.5 * eps_rad) * APPROXIMATE_CELL_FRACTION / np.sqrt(3))
+    if keys is None:
+        return None
+
+    # Cells in order of their first point, so cluster numbering follows the input order
+    _, first, cell_of = np.unique(keys, return_index=True, return_inverse=True)
+    order = np.argsort(first, kind="stable")
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    cell_of = rank[cell_of.reshape(-1)]
+
+    weights = np.asarray(weights, dtype=np.float64)
+    cell_weight = np.bincount(cell_of, weights=weights)
+    centroid = np.column_stack([np.bincount(cell_of, weights=weights * unit[:, k]) for k in range(3)])
+    centroid /= np.linalg.norm(centroid, axis=1)[:, None]
+    cell_radians = np.column_stack([np.arcsin(np.clip(centroid[:, 2], -1.0, 1.0)),
+                                    np.arctan2(centroid[:, 1], centroid[:, 0])])
+
+    cell_labels = grid_dbscan(cell_radians, cell_weight, eps_rad, min_samples)
+    return None if cell_labels is None else cell_labels[cell_of]
+
+
+class GridDBSCAN:
+    """Tiered DBSCAN over (lat, lon) degree histories; see the module docstring."""
+
+    def __init__(self, eps_rad, min_samples, grid_min_points=2000, approximate_min_points=200000,
+                 max_candidate_pairs=20000000):
+        self.eps_rad = eps_rad
+        self.min_samples = min_samples
+        self.grid_min_points = grid_min_points
+        self.approximate_min_points = approximate_min_points
+        self.max_candidate_pairs = max_candidate_pairs
+
+    def fit_predict(self, points):
+        """
+        Returns:
+            (labels, tier): one label per point (-1 for noise) and the tier used
+            ("dedup", "grid" or "approximate")
+        """
+        unique, inverse, counts = deduplicate(np.asarray(points, dtype=np.float64).reshape(-1, 2))
+        radians = np.radians(unique)
+
+        labels, tier = None, "dedup"
+        if len(unique) >= self.grid_min_points:
+            if len(unique) < self.approximate_min_points:
+                labels, tier = grid_dbscan(radians, counts, self.eps_rad, self.min_samples,
+                                           self.max_candidate_pairs), "grid"
+            if labels is None:
+                labels, tier = approximate_dbscan(radians, counts, self.eps_rad, self.min_samples), "approximate"
+        if labels is None:
+            # Small inputs, or an eps too small for the grid keys
+            from sklearn.cluster import DBSCAN
+            labels, tier = DBSCAN(eps=self.eps_rad, min_samples=self.min_samples, metric="haversine",
+                                  algorithm="ball_tree").fit(radians, sample_weight=counts).labels_, "dedup"
+        return labels[inverse], tier
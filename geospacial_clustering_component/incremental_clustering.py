@@ -0,0 +1,379 @@
+"""
+incremental_clustering.py - Per-user incremental DBSCAN state for geospatial clustering
+
+Each user's transaction history is clustered once (sklearn DBSCAN) and kept in an
+IncrementalDBSCAN object. Later requests only insert the points appended to the
+history since the last request, and the current transaction is inserted transiently
+(journaled and rolled back), so the per-request cost depends on the neighbourhood of
+the new points, not on the size of the history.
+
+Equivalence with a full DBSCAN refit (same eps/min_samples, haversine metric):
+* core points, cluster membership of core points and cluster order (sklearn numbers
+  clusters by their lowest-index core point) are identical;
+* a border point within eps of cores from two different clusters keeps the cluster
+  it was first attached to if those clusters' order changes later through a merge.
+  DBSCAN's own border assignment is order-dependent, and such points are rare.
+
+Neighbour search uses a uniform grid over the 3D unit vectors of the points, with
+cell size equal to the chord length of eps, so a neighbourhood is the 27 cells around
+a point anywhere on the globe (no pole or antimeridian special cases).
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+class IncrementalDBSCAN:
+    """DBSCAN labels for one user's points, maintained under point insertion."""
+
+    def __init__(self, eps_rad, min_samples, rebuild_ratio=0.5):
+        self.eps_rad = eps_rad
+        self.min_samples = min_samples
+        self.rebuild_ratio = rebuild_ratio
+        self.lock = threading.RLock()
+
+        # Same neighbourhood test as sklearn's haversine BallTree: rdist <= sin^2(eps / 2)
+        self._max_rdist = np.sin(0.5 * eps_rad) ** 2
+        self._cell_size = 2 * np.sin(0.5 * eps_rad)
+
+        self._reset(capacity=64)
+
+    # ---------------- State ----------------
+
+    def _reset(self, capacity):
+        self.size = 0
+        self.points = np.empty((capacity, 2), dtype=np.float64)    # degrees (lat, lon)
+        self._radians = np.empty((capacity, 2), dtype=np.float64)
+        self._cos_lat = np.empty(capacity, dtype=np.float64)
+        self.neighbor_count = np.zeros(capacity, dtype=np.int64)   # includes the point itself
+        self.is_core = np.zeros(capacity, dtype=bool)
+        self.labels = np.full(capacity, -1, dtype=np.int64)        # internal cluster ids
+        self._grid = {}
+        self._clusters = {}      # cluster id -> {"members": set, "min_core": int, "metrics": dict|None}
+        self._next_cluster_id = 0
+        self._journal = None
+
+    def _ensure_capacity(self, extra):
+        needed = self.size + extra
+        capacity = self.points.shape[0]
+        if needed <= capacity:
+            return
+        new_capacity = max(needed, capacity * 2)
+        for name in ("points", "_radians"):
+            grown = np.empty((new_capacity, 2), dtype=np.float64)
+            grown[:self.size] = getattr(self, name)[:self.size]
+            setattr(self, name, grown)
+        for name, fill, dtype in (("_cos_lat", 0.0, np.float64), ("neighbor_count", 0, np.int64),
+                                  ("is_core", False, bool), ("labels", -1, np.int64)):
+            grown = np.full(new_capacity, fill, dtype=dtype)
+            grown[:self.size] = getattr(self, name)[:self.size]
+            setattr(self, name, grown)
+
+    def _cell_of(self, lat_rad, lon_rad):
+        cos_lat = np.cos(lat_rad)
+        unit = (cos_lat * np.cos(lon_rad), cos_lat * np.sin(lon_rad), np.sin(lat_rad))
+        return tuple(int(np.floor(c / self._cell_size)) for c in unit)
+
+    def _neighbors(self, lat_rad, lon_rad, cos_lat):
+        """Indices of stored points within eps of the given point (including itself if stored)."""
+        cx, cy, cz = self._cell_of(lat_rad, lon_rad)
+        candidates = []
+        grid = self._grid
+        for dx in (-1, 0, 1):
+            for dy in (-1, 0, 1):
+                for dz in (-1, 0, 1):
+                    bucket = grid.get((cx + dx, cy + dy, cz + dz))
+                    if bucket:
+                        candidates.extend(bucket)
+        if not candidates:
+            return np.empty(0, dtype=np.int64)
+
+        candidates = np.asarray(candidates, dtype=np.int64)
+        other = self._radians[candidates]
+        rdist = (np.sin(0.5 * (other[:, 0] - lat_rad)) ** 2
+                 + cos_lat * self._cos_lat[candidates] * np.sin(0.5 * (other[:, 1] - lon_rad)) ** 2)
+        return candidates[rdist <= self._max_rdist]
+
+    # ---------------- Bulk build ----------------
+
+    def rebuild(self, points):
+        """Clusters 'points' from scratch with sklearn's DBSCAN and loads the result."""
+        from sklearn.neighbors import NearestNeighbors
+
+        points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        self._reset(capacity=max(64, len(points) * 2))
+        n = len(points)
+        if n == 0:
+            return
+
+        coords = np.radians(points)
+        self.points[:n] = points
+        self._radians[:n] = coords
+        self._cos_lat[:n] = np.cos(coords[:, 0])
+        self.size = n
+
+        # Neighbourhoods once, in C; labels follow DBSCAN's expansion order below
+        neighbors_model = NearestNeighbors(radius=self.eps_rad, metric="haversine", algorithm="ball_tree").fit(coords)
+        neighborhoods = neighbors_model.radius_neighbors(coords, return_distance=False)
+        counts = np.fromiter((len(nbrs) for nbrs in neighborhoods), dtype=np.int64, count=n)
+        self.neighbor_count[:n] = counts
+        self.is_core[:n] = counts >= self.min_samples
+
+        labels = self.labels
+        for i in np.flatnonzero(self.is_core[:n]):
+            if labels[i] != -1:
+                continue
+            cluster_id = self._new_cluster(int(i))
+            stack = [int(i)]
+            labels[i] = cluster_id
+            while stack:
+                j = stack.pop()
+                if not self.is_core[j]:
+                    continue
+                for k in neighborhoods[j]:
+                    if labels[k] == -1:
+                        labels[k] = cluster_id
+                        stack.append(int(k))
+
+        for cluster_id in range(self._next_cluster_id):
+            self._clusters[cluster_id]["members"] = set(np.flatnonzero(labels[:n] == cluster_id).tolist())
+
+        # Grid for later incremental neighbour queries
+        for i in range(n):
+            self._grid.setdefault(self._cell_of(coords[i, 0], coords[i, 1]), []).append(i)
+
+    # ---------------- Incremental insertion ----------------
+
+    def _record(self, *entry):
+        if self._journal is not None:
+            self._journal.append(entry)
+
+    def _new_cluster(self, min_core):
+        cluster_id = self._next_cluster_id
+        self._next_cluster_id += 1
+        self._clusters[cluster_id] = {"members": set(), "min_core": min_core, "metrics": None}
+        self._record("new_cluster", cluster_id)
+        return cluster_id
+
+    def _touch_cluster(self, cluster_id):
+        cluster = self._clusters[cluster_id]
+        self._record("cluster", cluster_id, cluster["min_core"], cluster["metrics"])
+        cluster["metrics"] = None
+        return cluster
+
+    def _set_label(self, index, cluster_id):
+        old = int(self.labels[index])
+        if old == cluster_id:
+            return
+        if old != -1:
+            self._touch_cluster(old)["members"].discard(index)
+        if cluster_id != -1:
+            self._touch_cluster(cluster_id)["members"].add(index)
+        self.labels[index] = cluster_id
+        self._record("label", index, old)
+
+    def _merge_into(self, target_id, other_ids):
+        target = self._touch_cluster(target_id)
+        for other_id in other_ids:
+            other = self._touch_cluster(other_id)
+            for index in list(other["members"]):
+                self._set_label(index, target_id)
+            target["min_core"] = min(target["min_core"], other["min_core"])
+            self._record("drop_cluster", other_id, other["min_core"])
+            del self._clusters[other_id]
+
+    def insert(self, lat, lon):
+        """Inserts one point and updates neighbour counts, core flags and labels locally."""
+        self._ensure_capacity(1)
+        index = self.size
+        lat_rad, lon_rad = np.radians(lat), np.radians(lon)
+        cos_lat = np.cos(lat_rad)
+
+        self.points[index] = (lat, lon)
+        self._radians[index] = (lat_rad, lon_rad)
+        self._cos_lat[index] = cos_lat
+        self.is_core[index] = False
+        self.labels[index] = -1
+        self.size += 1
+        cell = self._cell_of(lat_rad, lon_rad)
+        self._grid.setdefault(cell, []).append(index)
+        self._record("point", cell)
+
+        neighbors = self._neighbors(lat_rad, lon_rad, cos_lat)   # includes index itself
+        self.neighbor_count[neighbors] += 1
+        self.neighbor_count[index] = len(neighbors)
+        self._record("counts", neighbors)
+
+        # Points whose neighbourhood just reached min_samples become core, in index order
+        promoted = neighbors[~self.is_core[neighbors] & (self.neighbor_count[neighbors] >= self.min_samples)]
+        for core in np.sort(promoted).tolist():
+            self.is_core[core] = True
+            self._record("core", core)
+
+            core_neighbors = neighbors if core == index else self._neighbors(
+                self._radians[core, 0], self._radians[core, 1], self._cos_lat[core]
+            )
+            touching = {int(self.labels[q]) for q in core_neighbors[self.is_core[core_neighbors]].tolist()
+                        if self.labels[q] != -1 and q != core}
+
+            if touching:
+                # Keep the largest cluster's id, move the others' members into it
+                target_id = max(touching, key=lambda cid: len(self._clusters[cid]["members"]))
+                self._merge_into(target_id, touching - {target_id})
+            else:
+                target_id = self._new_cluster(core)
+
+            cluster = self._touch_cluster(target_id)
+            cluster["min_core"] = min(cluster["min_core"], core)
+            self._set_label(core, target_id)
+
+            # Non-core neighbours become border points of the cluster that comes first
+            for q in core_neighbors[~self.is_core[core_neighbors]].tolist():
+                current = int(self.labels[q])
+                if current == -1 or self._clusters[target_id]["min_core"] < self._clusters[current]["min_core"]:
+                    self._set_label(q, target_id)
+
+        # A new non-core point is a border point of the first cluster among its core neighbours
+        if not self.is_core[index]:
+            core_neighbors = neighbors[self.is_core[neighbors]]
+            cluster_ids = {int(self.labels[q]) for q in core_neighbors.tolist()}
+            if cluster_ids:
+                self._set_label(index, min(cluster_ids, key=lambda cid: self._clusters[cid]["min_core"]))
+
+        return index
+
+    def _rollback(self, journal):
+        """Undoes the journaled changes of transient insertions, newest first."""
+        for entry in reversed(journal):
+            kind = entry[0]
+            if kind == "label":
+                _, index, old = entry
+                new = int(self.labels[index])
+                if new != -1 and new in self._clusters:
+                    self._clusters[new]["members"].discard(index)
+                if old != -1:
+                    self._clusters[old]["members"].add(index)
+                self.labels[index] = old
+            elif kind == "cluster":
+                _, cluster_id, min_core, metrics = entry
+                cluster = self._clusters[cluster_id]
+                cluster["min_core"] = min_core
+                cluster["metrics"] = metrics
+            elif kind == "drop_cluster":
+                _, cluster_id, min_core = entry
+                self._clusters[cluster_id] = {"members": set(), "min_core": min_core, "metrics": None}
+            elif kind == "new_cluster":
+                _, cluster_id = entry
+                del self._clusters[cluster_id]
+                self._next_cluster_id = cluster_id
+            elif kind == "core":
+                self.is_core[entry[1]] = False
+            elif kind == "counts":
+                self.neighbor_count[entry[1]] -= 1
+            elif kind == "point":
+                self.size -= 1
+                self._grid[entry[1]].pop()
+                if not self._grid[entry[1]]:
+                    del self._grid[entry[1]]
+
+    # ---------------- Request-level API ----------------
+
+    def sync_history(self, history):
+        """
+        Brings the state in line with the request's history (N x 2 degrees).
+
+        Points appended since the last request are inserted incrementally; any other
+        change (edited or truncated history, or a large jump) triggers a rebuild.
+        """
+        history = np.asarray(history, dtype=np.float64).reshape(-1, 2)
+        known = self.size
+        if len(history) >= known and np.array_equal(history[:known], self.points[:known]):
+            appended = history[known:]
+            if len(appended) <= max(known * self.rebuild_ratio, 1):
+                for lat, lon in appended.tolist():
+                    self.insert(lat, lon)
+                return
+        self.rebuild(history)
+
+    def clusters_with_point(self, point, metrics_fn):
+        """
+        Clusters of history + point, without keeping the point.
+
+        Returns:
+            (clusters, current_cluster): metric dicts (copies, with a sklearn-style 'label')
+            in cluster order, and the entry holding 'point' (None if it is noise).
+        """
+        self._journal = []
+        try:
+            index = self.insert(*point)
+            ordered = sorted(self._clusters.items(), key=lambda item: item[1]["min_core"])
+
+            clusters = []
+            current_cluster = None
+            current_id = int(self.labels[index])
+            for label, (cluster_id, cluster) in enumerate(ordered):
+                if cluster["metrics"] is None:
+                    members = np.fromiter(cluster["members"], dtype=np.int64, count=len(cluster["members"]))
+                    members.sort()
+                    cluster["metrics"] = metrics_fn(self.points[members])
+                if cluster["metrics"] is None:
+                    continue
+                cluster_info = dict(cluster["metrics"], label=label)
+                clusters.append(cluster_info)
+                if cluster_id == current_id:
+                    current_cluster = cluster_info
+            return clusters, current_cluster
+        finally:
+            journal, self._journal = self._journal, None
+            self._rollback(journal)
+
+
+class ClusterStateStore:
+    """LRU + TTL bounded map of user_id -> IncrementalDBSCAN."""
+
+    def __init__(self, eps_rad, min_samples, max_users=10000, ttl_seconds=3600, rebuild_ratio=0.5):
+        self.eps_rad = eps_rad
+        self.min_samples = min_samples
+        self.max_users = max_users
+        self.ttl_seconds = ttl_seconds
+        self.rebuild_ratio = rebuild_ratio
+        self._states = OrderedDict()   # user_id -> (state, last_access)
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """Returns the user's state, creating a fresh one if missing or expired."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._states.get(user_id)
+            if entry is not None and now - entry[1] <= self.ttl_seconds:
+                state = entry[0]
+                self._states.move_to_end(user_id)
+            else:
+                state = IncrementalDBSCAN(self.eps_rad, self.min_samples, self.rebuild_ratio)
+            self._states[user_id] = (state, now)
+            self._evict(now)
+            return state
+
+    def _evict(self, now):
+        while len(self._states) > self.max_users:
+            self._states.popitem(last=False)
+        # Oldest entries sit at the front; drop the expired ones
+        while self._states:
+            user_id, (_, last_access) = next(iter(self._states.items()))
+            if now - last_access <= self.ttl_seconds:
+                break
+            del self._states[user_id]
+
+    def evict(self, user_id):
+        with self._lock:
+            self._states.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._states.clear()
+
+    def __len__(self):
+        return len(self._states)
@@ -0,0 +1,34 @@
+"""
+gunicorn.conf.py - Worker settings for `gunicorn app:app` (read automatically from the working directory)
+
+The app, the ML model and the heavy libraries are loaded once in the master and
+shared copy-on-write by the forked workers, so workers start in milliseconds and
+do not each hold a private copy of the model.
+"""
+
+import gc
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+
+# Import app.py (and everything it imports) in the master before forking
+preload_app = True
+
+
+def when_ready(server):
+    from controller import preload_components
+
+    # Runs in the master after the app is imported and before any worker is forked
+    preload_components()
+
+    # Move everything loaded so far out of the collector's generations, so garbage
+    # collections in the workers do not write to (and un-share) those pages
+    gc.freeze()
+
+
+def on_reload(server):
+    from config_service import CONFIG_SERVICE
+
+    # SIGHUP: re-read the component configs in the master; the replacement workers fork from it
+    CONFIG_SERVICE.reload()
@@ -0,0 +1,81 @@
+"""
+json_codec.py - JSON encoding/decoding for the HTTP layer
+
+Uses orjson when it is installed and the standard library json module otherwise; the
+BACKEND constant tells which one is active. Both paths produce compact output with
+sorted keys (Flask's default), accept NumPy scalars and arrays, and fall back to str()
+for any other type the encoder does not know.
+
+Differences of the orjson backend: NaN/Infinity are written as null instead of the
+non-standard NaN/Infinity tokens, and such tokens are rejected in request bodies.
+
+FastJSONProvider plugs the codec into Flask (app.json), so request.get_json() and
+jsonify() use it.
+"""
+
+import json
+
+import numpy as np
+from flask.json.provider import JSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional dependency
+    orjson = None
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+
+def _default(value):
+    """Types neither encoder handles natively."""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return str(value)
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+    def dumps_bytes(obj, sort_keys=True):
+        """Serializes obj to UTF-8 JSON bytes."""
+        return orjson.dumps(obj, default=_default,
+                            option=_ORJSON_OPTIONS | orjson.OPT_SORT_KEYS if sort_keys else _ORJSON_OPTIONS)
+
+    def loads(data):
+        """Parses JSON from bytes or str; raises ValueError on invalid input."""
+        return orjson.loads(data)
+
+else:
+    def dumps_bytes(obj, sort_keys=True):
+        """Serializes obj to UTF-8 JSON bytes."""
+        return json.dumps(obj, default=_default, sort_keys=sort_keys, separators=(",", ":"),
+                          ensure_ascii=False).encode("utf-8")
+
+    def loads(data):
+        """Parses JSON from bytes or str; raises ValueError on invalid input."""
+        return json.loads(data)
+
+
+def dumps(obj, sort_keys=True):
+    """Serializes obj to a JSON str."""
+    return dumps_bytes(obj, sort_keys).decode("utf-8")
+
+
+class FastJSONProvider(JSONProvider):
+    """Flask JSON provider backed by this module (install with app.json = FastJSONProvider(app))."""
+
+    sort_keys = True
+
+    def dumps(self, obj, **kwargs):
+        return dumps(obj, kwargs.get("sort_keys", self.sort_keys))
+
+    def loads(self, s, **kwargs):
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        # Serialized bytes go straight into the response body, without a str round trip;
+        # the trailing newline matches Flask's default provider
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj, self.sort_keys) + b"\n", mimetype="application/json")
@@ -0,0 +1,286 @@
+"""
+device_history_store.py - Server-side sliding-window login history per device
+
+Replaces scanning "device_history_last_3_days" on every request when the caller does
+not send it: each scored session is recorded under its deviceId, and a request asks the
+store for the number of logins and of distinct users on the device within the window
+(3 days by default) before its own session.
+
+Time is the session timestamp (event time), bucketed into bucket_seconds slots. A
+query at time t counts the buckets (t - window, t], rounded to whole buckets.
+
+Backends:
+* LocalDeviceHistoryStore: per process. Per device, a deque of (bucket, count) with a
+  running total and an exact set of user ids ordered by last login, each with the
+  sorted buckets it logged in; both are expired from the front as the device's newest
+  session moves on, so updates and queries are amortized O(1). A session older than
+  the device's newest one (late event) counts the logins and the users with a login
+  in its own window only. Devices are kept in an LRU of max_devices, and at most
+  max_users_per_device user ids are remembered per device (the oldest are forgotten).
+  With several gunicorn workers each worker sees only its own sessions.
+* RedisDeviceHistoryStore: shared. One counter (INCR) and one HyperLogLog (PFADD) per
+  device and bucket, expiring after the window; a query is one MGET plus one PFCOUNT
+  over the window's buckets. Needs the optional redis package.
+"""
+
+import threading
+from bisect import bisect_left
+from collections import OrderedDict, deque
+
+try:
+    import redis
+except ImportError:  # optional dependency
+    redis = None
+
+DEVICE_STORE_BACKENDS = ("local", "redis")
+
+
+def _logged_in_between(user_buckets, first_bucket, last_bucket):
+    position = bisect_left(user_buckets, first_bucket)
+    return position < len(user_buckets) and user_buckets[position] <= last_bucket
+
+
+class _DeviceWindow:
+    __slots__ = ("buckets", "total", "users", "newest_bucket", "first_bucket")
+
+    def __init__(self):
+        self.buckets = deque()       # [bucket, count], oldest first
+        self.total = 0
+        self.users = OrderedDict()   # user_id -> sorted buckets it logged in, oldest last login first
+        self.newest_bucket = None
+        # Nothing before this bucket is counted any more (users may still list older buckets)
+        self.first_bucket = None
+
+    def expire(self, first_bucket):
+        """Drops everything before first_bucket."""
+        if self.first_bucket is None or first_bucket > self.first_bucket:
+            self.first_bucket = first_bucket
+        buckets = self.buckets
+        while buckets and buckets[0][0] < first_bucket:
+            self.total -= buckets.popleft()[1]
+        users = self.users
+        while users:
+            user_id, user_buckets = next(iter(users.items()))
+            if user_buckets[-1] >= first_bucket:
+                break
+            del users[user_id]
+
+
+class LocalDeviceHistoryStore:
+    """In-process store; see the module docstring."""
+
+    def __init__(self, window_seconds=259200, bucket_seconds=3600, max_devices=1000000, max_users_per_device=1000):
+        self.window_seconds = window_seconds
+        self.bucket_seconds = bucket_seconds
+        self.max_devices = max_devices
+        self.max_users_per_device = max_users_per_device
+        # Buckets per window (the query's own bucket included)
+        self._window_buckets = max(int(window_seconds // bucket_seconds), 1)
+        self._devices = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._devices)
+
+    def _bucket(self, timestamp):
+        return int(timestamp // self.bucket_seconds)
+
+    def _query(self, device_id, bucket):
+        first_bucket = bucket - self._window_buckets + 1
+        window = self._devices.get(device_id)
+        if window is None:
+            return 0, 0
+        window.expire(max(first_bucket, window.newest_bucket - self._window_buckets + 1))
+        if bucket >= window.newest_bucket:
+            return window.total, len(window.users)
+        # Older than the device's newest session: count the covered buckets only
+        logins = sum(count for b, count in window.buckets if first_bucket <= b <= bucket)
+        first_bucket = max(first_bucket, window.first_bucket)
+        users = sum(1 for user_buckets in window.users.values()
+                    if _logged_in_between(user_buckets, first_bucket, bucket))
+        return logins, users
+
+    def _record(self, device_id, user_id, bucket):
+        window = self._devices.get(device_id)
+        if window is None:
+            window = self._devices[device_id] = _DeviceWindow()
+            window.newest_bucket = bucket
+            while len(self._devices) > self.max_devices:
+                self._devices.popitem(last=False)
+        else:
+            self._devices.move_to_end(device_id)
+
+        if bucket > window.newest_bucket:
+            window.newest_bucket = bucket
+        first_bucket = window.newest_bucket - self._window_buckets + 1
+        window.expire(first_bucket)
+        # Older than what the device still counts (a query may have moved past it)
+        if bucket < window.first_bucket:
+            return
+
+        buckets = window.buckets
+        if buckets and buckets[-1][0] == bucket:
+            buckets[-1][1] += 1
+        elif not buckets or buckets[-1][0] < bucket:
+            buckets.append([bucket, 1])
+        else:
+            # Late session: find (or insert) its bucket
+            for position, entry in enumerate(buckets):
+                if entry[0] == bucket:
+                    entry[1] += 1
+                    break
+                if entry[0] > bucket:
+                    buckets.insert(position, [bucket, 1])
+                    break
+        window.total += 1
+
+        users = window.users
+        user_buckets = users.get(user_id)
+        if user_buckets is None:
+            user_buckets = users[user_id] = []
+        else:
+            # Buckets that left the window are dropped as the user logs in again
+            del user_buckets[:bisect_left(user_buckets, first_bucket)]
+        position = bisect_left(user_buckets, bucket)
+        if position == len(user_buckets):
+            user_buckets.append(bucket)
+            users.move_to_end(user_id)
+            # A late session can be the user's last login yet older than another user's:
+            # keep the users ordered by last login, as expire() and eviction expect
+            if len(users) > 1:
+                before_last = reversed(users.values())
+                next(before_last)
+                if next(before_last)[-1] > bucket:
+                    window.users = users = OrderedDict(sorted(users.items(), key=lambda item: item[1][-1]))
+        elif user_buckets[position] != bucket:
+            user_buckets.insert(position, bucket)
+        if len(users) > self.max_users_per_device:
+            users.popitem(last=False)
+
+    def query(self, device_id, timestamp):
+        """(logins, distinct users) recorded for the device within the window ending at timestamp."""
+        with self._lock:
+            return self._query(device_id, self._bucket(timestamp))
+
+    def record(self, device_id, user_id, timestamp):
+        """Adds one login of user_id on device_id at timestamp (epoch seconds)."""
+        with self._lock:
+            self._record(device_id, user_id, self._bucket(timestamp))
+
+    def query_and_record(self, device_id, user_id, timestamp):
+        """query() for the history before this session, then record() it."""
+        bucket = self._bucket(timestamp)
+        with self._lock:
+            counts = self._query(device_id, bucket)
+            self._record(device_id, user_id, bucket)
+            return counts
+
+    def clear(self):
+        with self._lock:
+            self._devices.clear()
+
+
+class RedisDeviceHistoryStore:
+    """Shared store on a Redis-style client (incr/expire/pfadd/mget/pfcount, pipeline())."""
+
+    def __init__(self, client, window_seconds=259200, bucket_seconds=3600, key_prefix="fraud:device:"):
+        self.client = client
+        self.window_seconds = window_seconds
+        self.bucket_seconds = bucket_seconds
+        self.key_prefix = key_prefix
+        self._window_buckets = max(int(window_seconds // bucket_seconds), 1)
+        # Keys outlive the last window they can be part of
+        self._ttl = int(self._window_buckets * bucket_seconds + bucket_seconds)
+
+    def _keys(self, device_id, buckets):
+        prefix = f"{self.key_prefix}{device_id}:"
+        return [f"{prefix}{b}:n" for b in buckets], [f"{prefix}{b}:u" for b in buckets]
+
+    def query(self, device_id, timestamp):
+        bucket = int(timestamp // self.bucket_seconds)
+        count_keys, user_keys = self._keys(device_id, range(bucket - self._window_buckets + 1, bucket + 1))
+        logins = sum(int(value) for value in self.client.mget(count_keys) if value is not None)
+        return logins, int(self.client.pfcount(*user_keys)) if logins else 0
+
+    def record(self, device_id, user_id, timestamp):
+        (count_key,), (user_key,) = self._keys(device_id, [int(timestamp // self.bucket_seconds)])
+        pipe = self.client.pipeline()
+        pipe.incr(count_key)
+        pipe.expire(count_key, self._ttl)
+        pipe.pfadd(user_key, str(user_id))
+        pipe.expire(user_key, self._ttl)
+        pipe.execute()
+
+    def query_and_record(self, device_id, user_id, timestamp):
+        counts = self.query(device_id, timestamp)
+        self.record(device_id, user_id, timestamp)
+        return counts
+
+
+# Store shared by all requests of this process. It is recreated (state dropped) when a
+# config reload changes the settings it depends on.
+_store = None
+_store_key = None
+_store_lock = threading.Lock()
+
+
+def get_device_history_store(config):
+    """Returns the store for the given login settings, or None when it is disabled."""
+    global _store, _store_key
+    if not config.device_store_enabled:
+        return None
+
+    key = config.device_store_key
+    if key != _store_key:
+        with _store_lock:
+            if key != _store_key:
+                if config.device_store_backend == "redis":
+                    if redis is None:
+                        raise ImportError("The redis device history store requires the redis package")
+                    _store = RedisDeviceHistoryStore(
+                        redis.Redis.from_url(config.device_store_redis_url),
+                        window_seconds=config.device_store_window_seconds,
+                        bucket_seconds=config.device_store_bucket_seconds,
+                    )
+                else:
+                    _store = LocalDeviceHistoryStore(
+                        window_seconds=config.device_store_window_seconds,
+                        bucket_seconds=config.device_store_bucket_seconds,
+                        max_devices=config.device_store_max_devices,
+                        max_users_per_device=config.device_store_max_users_per_device,
+                    )
+                _store_key = key
+    return _store
+
+
+def verify_local_store(sessions=20000, devices=20, users=8, seed=0):
+    """
+    Replays random sessions, many of them late (older than the device's newest one),
+    through a LocalDeviceHistoryStore and checks every query_and_record answer: logins
+    always come with at least one user, and never fewer logins than users.
+
+    Returns:
+        dict with the number of queries checked and of inconsistent answers.
+    """
+    import random
+
+    rng = random.Random(seed)
+    store = LocalDeviceHistoryStore(window_seconds=6 * 3600, bucket_seconds=3600)
+    now = 0.0
+    inconsistent = 0
+    for _ in range(sessions):
+        now += rng.uniform(0, 900)
+        timestamp = now - rng.uniform(0, 8 * 3600) if rng.random() < 0.3 else now
+        logins, distinct_users = store.query_and_record(
+            f"device_{rng.randrange(devices)}", f"user_{rng.randrange(users)}", timestamp)
+        if (logins > 0 and distinct_users == 0) or distinct_users > logins:
+            inconsistent += 1
+    return {"queries": sessions, "inconsistent": inconsistent, "consistent": inconsistent == 0}
+
+
+if __name__ == "__main__":
+    import sys
+
+    report = verify_local_store()
+    print(report)
+    sys.exit(0 if report["consistent"] else 1)
@@ -0,0 +1,207 @@
+"""
+last_login_cache.py - Per-user last login kept by the service
+
+Lets callers leave out "last_user_login": every scored session is recorded under its
+userId, and a request without "last_user_login" takes the user's previous session
+(timestamp, latitude, longitude) from here for the unlikely travel score. A user seen
+for the first time has no previous login, so the travel score is 0.
+
+Entries live in parallel arrays (array module, one slot per user, grown up to
+max_users): the timestamp (epoch seconds), latitude and longitude as doubles, and the
+previous/next slots of an intrusive doubly linked LRU list as 32-bit ints. The only
+Python objects per user are the dict entry userId -> slot, the slot int and the userId
+itself. Measured with tracemalloc, one million users with 13-character string ids take
+about 160 MB (~160 bytes per user: 40 bytes of arrays, 8 of id list, the rest dict,
+int and string). The least recently used user is evicted when max_users is reached;
+a lookup or update is O(1), about 2 us.
+
+A session older than the stored one (late delivery) does not replace it.
+
+The cache is per process: with several gunicorn workers each worker knows the users
+whose sessions it scored. Optionally the cache is written to snapshot_path every
+snapshot_interval_seconds and at exit, and restored from it when the cache is
+created (see snapshots.py); with several workers the file holds the cache of the last
+worker that wrote it.
+"""
+
+import threading
+from array import array
+
+import numpy as np
+
+from snapshots import Snapshotter, from_json_array, json_array, restore, save_npz
+
+_NONE = -1
+
+
+class LastLoginCache:
+    """Thread-safe LRU of (timestamp, latitude, longitude) per user; see the module docstring."""
+
+    def __init__(self, max_users=1000000):
+        if max_users < 1:
+            raise ValueError(f"max_users must be >= 1, got {max_users}")
+        self.max_users = max_users
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # Slot columns, grown by one slot per new user up to max_users
+        self._slots = {}
+        self._user_ids = []
+        self._timestamps = array("d")
+        self._latitudes = array("d")
+        self._longitudes = array("d")
+        # LRU list: _head is the least, _tail the most recently used slot
+        self._prev = array("i")
+        self._next = array("i")
+        self._head = self._tail = _NONE
+
+    def __len__(self):
+        return len(self._slots)
+
+    def _unlink(self, slot):
+        prev, next_ = self._prev[slot], self._next[slot]
+        if prev == _NONE:
+            self._head = next_
+        else:
+            self._next[prev] = next_
+        if next_ == _NONE:
+            self._tail = prev
+        else:
+            self._prev[next_] = prev
+
+    def _append(self, slot):
+        self._prev[slot] = self._tail
+        self._next[slot] = _NONE
+        if self._tail == _NONE:
+            self._head = slot
+        else:
+            self._next[self._tail] = slot
+        self._tail = slot
+
+    def _touch(self, slot):
+        if slot != self._tail:
+            self._unlink(slot)
+            self._append(slot)
+
+    def _store(self, user_id, timestamp, latitude, longitude):
+        slot = self._slots.get(user_id)
+        if slot is not None:
+            self._touch(slot)
+            if timestamp < self._timestamps[slot]:
+                return
+        elif len(self._slots) < self.max_users:
+            slot = self._slots[user_id] = len(self._user_ids)
+            self._user_ids.append(user_id)
+            self._timestamps.append(timestamp)
+            self._latitudes.append(latitude)
+            self._longitudes.append(longitude)
+            self._prev.append(_NONE)
+            self._next.append(_NONE)
+            self._append(slot)
+            return
+        else:
+            # Reuse the least recently used slot
+            slot = self._head
+            del self._slots[self._user_ids[slot]]
+            self._slots[user_id] = slot
+            self._user_ids[slot] = user_id
+            self._touch(slot)
+        self._timestamps[slot] = timestamp
+        self._latitudes[slot] = latitude
+        self._longitudes[slot] = longitude
+
+    def get(self, user_id):
+        """(timestamp, latitude, longitude) of the user's last recorded login, or None."""
+        with self._lock:
+            slot = self._slots.get(user_id)
+            if slot is None:
+                return None
+            self._touch(slot)
+            return self._timestamps[slot], self._latitudes[slot], self._longitudes[slot]
+
+    def record(self, user_id, timestamp, latitude, longitude):
+        """Records a login of user_id at timestamp (epoch seconds), unless a later one is known."""
+        with self._lock:
+            self._store(user_id, timestamp, latitude, longitude)
+
+    def get_and_record(self, user_id, timestamp, latitude, longitude):
+        """get() for the login before this session, then record() it."""
+        with self._lock:
+            slot = self._slots.get(user_id)
+            previous = None if slot is None else (self._timestamps[slot], self._latitudes[slot], self._longitudes[slot])
+            self._store(user_id, timestamp, latitude, longitude)
+            return previous
+
+    def items(self):
+        """(user_id, timestamp, latitude, longitude) from the least to the most recently used."""
+        # Copies taken under the lock (memcpy speed); the LRU list is walked outside of it
+        with self._lock:
+            user_ids, next_, slot = list(self._user_ids), self._next[:], self._head
+            timestamps, latitudes, longitudes = self._timestamps[:], self._latitudes[:], self._longitudes[:]
+        entries = []
+        while slot != _NONE:
+            entries.append((user_ids[slot], timestamps[slot], latitudes[slot], longitudes[slot]))
+            slot = next_[slot]
+        return entries
+
+    def update(self, entries):
+        """Records (user_id, timestamp, latitude, longitude) entries, least recently used first."""
+        with self._lock:
+            for user_id, timestamp, latitude, longitude in entries:
+                self._store(user_id, timestamp, latitude, longitude)
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+
+    def save(self, path):
+        """Writes the entries to path (.npz), replacing it atomically."""
+        entries = self.items()
+        user_ids = [entry[0] for entry in entries]
+        values = np.array([entry[1:] for entry in entries], dtype=np.float64).reshape(-1, 3)
+        save_npz(path, user_ids=json_array(user_ids), values=values)
+        return len(entries)
+
+    def load(self, path):
+        """Adds the entries of a snapshot written by save(); returns their number."""
+        with np.load(path) as snapshot:
+            user_ids = from_json_array(snapshot["user_ids"])
+            values = snapshot["values"]
+        # Only the most recently used entries fit when the snapshot is larger than the cache
+        start = max(len(user_ids) - self.max_users, 0)
+        self.update(zip(user_ids[start:], *values[start:].T.tolist()))
+        return len(user_ids) - start
+
+
+# Cache shared by all requests of this process. It is rebuilt when a config reload
+# changes its settings, keeping the entries that still fit.
+_cache = None
+_cache_key = None
+_snapshotter = None
+_cache_lock = threading.Lock()
+
+
+def get_last_login_cache(config):
+    """Returns the cache for the given login settings, or None when it is disabled."""
+    global _cache, _cache_key, _snapshotter
+    if not config.last_login_cache_enabled:
+        return None
+
+    key = config.last_login_cache_key
+    if key != _cache_key:
+        with _cache_lock:
+            if key != _cache_key:
+                cache = LastLoginCache(max_users=config.last_login_cache_max_users)
+                if _snapshotter is not None:
+                    _snapshotter.stop()
+                    _snapshotter = None
+                if _cache is not None:
+                    cache.update(_cache.items()[-cache.max_users:])
+                else:
+                    restore(cache, config.last_login_snapshot_path, "last login")
+                if config.last_login_snapshot_path:
+                    _snapshotter = Snapshotter(cache, config.last_login_snapshot_path,
+                                               config.last_login_snapshot_interval_seconds, "last login")
+                _cache, _cache_key = cache, key
+    return _cache
@@ -1,12 +1,10 @@
 import datetime
-import json
-from geopy.distance import geodesic
-import os
 
-# Load config from JSON
-CONFIG_PATH = os.path.join(os.path.dirname(__file__), "config.json")
-with open(CONFIG_PATH, "r") as file:
-    CONFIG = json.load(file)
+import numpy as np
+
+from config_service import CONFIG_SERVICE
+from login_anomalies_component.device_history_store import get_device_history_store
+from login_anomalies_component.last_login_cache import get_last_login_cache
 
 def detect_login_anomalies(data, results):
     """
@@ -16,10 +14,14 @@ def detect_login_anomalies(data, results):
     3. Unlikely travel logins (based on travel speed between last user login and current login).
 
     Extracts required data from "login_data" in request JSON.
-    Updates 'results' dict with calculated scores.
+    Updates 'results' dict with calculated scores. Without "device_history_last_3_days"
+    the device counts come from the server-side device history store, and without
+    "last_user_login" the previous login comes from the last login cache (when enabled).
     """
 
     try:
+        # Settings (config.json) as currently loaded by the config service
+        config = CONFIG_SERVICE.current.login
         login_data = data.get("login_data", {})
 
         # Extract session details
@@ -31,42 +33,71 @@ def detect_login_anomalies(data, results):
         timestamp_str = session.get("timestamp")
 
         # Extract device history (last 3 days)
-        device_history = login_data.get("device_history_last_3_days", [])
+        device_history = login_data.get("device_history_last_3_days")
 
-        # Extract last login session of the same user
-        last_user_login = login_data.get("last_user_login", {})
+        # Extract last login session of the same user (None: taken from the last login cache)
+        last_user_login = login_data.get("last_user_login")
 
         # Convert timestamps to datetime objects
         try:
             session_time = datetime.datetime.fromisoformat(timestamp_str.replace("Z", "+00:00"))
-            last_user_time = datetime.datetime.fromisoformat(last_user_login.get("timestamp", "").replace("Z", "+00:00"))
+            if last_user_login is not None:
+                last_user_time = datetime.datetime.fromisoformat(last_user_login.get("timestamp", "").replace("Z", "+00:00"))
         except ValueError:
             results["login_anomalies"] = {"error": "Invalid timestamp format"}
             return
 
-        # ---------------- 1. Excessive Logins from the Same Device (Last 3 Days) ----------------
-        logins_from_device = sum(1 for entry in device_history if entry.get("deviceId") == device_id)
-        excessive_logins_score = min(logins_from_device / CONFIG["max_logins_for_full_score"], 1.0)
+        # Device history kept by the service: used when the request has none, and fed by every session
+        device_store = get_device_history_store(config) if device_id is not None else None
+
+        if device_history is None and device_store is not None:
+            # ---------------- 1. and 2. from the device history store ----------------
+            logins_from_device, unique_accounts_on_device = device_store.query_and_record(
+                device_id, user_id, session_time.timestamp())
+        else:
+            device_history = device_history or []
+
+            # ---------------- 1. Excessive Logins from the Same Device (Last 3 Days) ----------------
+            logins_from_device = sum(1 for entry in device_history if entry.get("deviceId") == device_id)
+
+            # ---------------- 2. Excessive Unique Account Logins from Same Device (Last 3 Days) ----------------
+            unique_accounts_on_device = len(set(entry.get("userId") for entry in device_history if entry.get("deviceId") == device_id))
 
-        # ---------------- 2. Excessive Unique Account Logins from Same Device (Last 3 Days) ----------------
-        unique_accounts_on_device = len(set(entry.get("userId") for entry in device_history if entry.get("deviceId") == device_id))
-        excessive_unique_accounts_score = min(unique_accounts_on_device / CONFIG["max_unique_accounts_for_full_score"], 1.0)
+            if device_store is not None:
+                device_store.record(device_id, user_id, session_time.timestamp())
+
+        excessive_logins_score = min(logins_from_device / config.max_logins_for_full_score, 1.0)
+        excessive_unique_accounts_score = min(unique_accounts_on_device / config.max_unique_accounts_for_full_score, 1.0)
 
         # ---------------- 3. Unlikely Travel Detection (Based on Travel Speed) ----------------
-        last_latitude = float(last_user_login.get("latitude", 0))
-        last_longitude = float(last_user_login.get("longitude", 0))
+        # Last logins kept by the service: used when the request has none, and fed by every session
+        last_login_cache = get_last_login_cache(config) if user_id is not None else None
+
+        if last_user_login is None:
+            previous_login = None
+            if last_login_cache is not None:
+                previous_login = last_login_cache.get_and_record(user_id, session_time.timestamp(), latitude, longitude)
+            if previous_login is None:
+                # No earlier login known for the user: no travel
+                last_timestamp, last_latitude, last_longitude = session_time.timestamp(), latitude, longitude
+            else:
+                last_timestamp, last_latitude, last_longitude = previous_login
+            time_difference_hours = abs(session_time.timestamp() - last_timestamp) / 3600
+        else:
+            last_latitude = float(last_user_login.get("latitude", 0))
+            last_longitude = float(last_user_login.get("longitude", 0))
+            time_difference_hours = abs((session_time - last_user_time).total_seconds()) / 3600
+            if last_login_cache is not None:
+                last_login_cache.record(user_id, session_time.timestamp(), latitude, longitude)
 
         # Calculate distance between current and last login locations (in km)
-        distance_km = geodesic((latitude, longitude), (last_latitude, last_longitude)).km
-
-        # Calculate time difference in hours
-        time_difference_hours = abs((session_time - last_user_time).total_seconds()) / 3600
+        distance_km = float(config.distance_km(latitude, longitude, last_latitude, last_longitude))
 
         travel_speed = 0.0  # Default
         if time_difference_hours > 0:  # Prevent division by zero
             travel_speed = distance_km / time_difference_hours  # km/h
 
-        unlikely_travel_score = min(travel_speed / CONFIG["max_travel_speed_for_full_score"], 1.0)
+        unlikely_travel_score = min(travel_speed / config.max_travel_speed_for_full_score, 1.0)
 
         # ---------------- Store Results ----------------
         results["login_anomalies"] = {
@@ -80,3 +111,143 @@ def detect_login_anomalies(data, results):
             "error": "An error occurred while processing login anomalies",
             "reason": str(e)
         }
+
+
+def detect_login_anomalies_batch(data_list, results_list, columns=None):
+    """
+    Batch variant of detect_login_anomalies: travel distances and scores are computed as
+    arrays over the whole batch. With columns (validation_logic.RequestColumns) the
+    login coordinates come from the values parsed during validation. Requests are
+    recorded in the device history store and the last login cache in batch order.
+    """
+    config = CONFIG_SERVICE.current.login
+    device_store = get_device_history_store(config)
+    last_login_cache = get_last_login_cache(config)
+    row_positions = []
+    coordinates = []
+    time_difference_hours = []
+    device_scores = []
+    # Row -> (latitude, longitude) of the previous login, for rows without last_user_login
+    cached_last_coordinates = {}
+
+    for position, data in enumerate(data_list):
+        try:
+            login_data = data.get("login_data", {})
+
+            # Extract session details
+            session = login_data.get("session", {})
+            user_id = session.get("userId")
+            device_id = session.get("deviceId")
+            if columns is None:
+                latitude = float(session.get("latitude", 0))
+                longitude = float(session.get("longitude", 0))
+            else:
+                latitude = float(columns.session_latitude[position])
+                longitude = float(columns.session_longitude[position])
+            timestamp_str = session.get("timestamp")
+
+            # Extract device history (last 3 days)
+            device_history = login_data.get("device_history_last_3_days")
+
+            # Extract last login session of the same user (None: taken from the last login cache)
+            last_user_login = login_data.get("last_user_login")
+
+            # Convert timestamps to datetime objects
+            try:
+                session_time = datetime.datetime.fromisoformat(timestamp_str.replace("Z", "+00:00"))
+                if last_user_login is not None:
+                    last_user_time = datetime.datetime.fromisoformat(last_user_login.get("timestamp", "").replace("Z", "+00:00"))
+            except ValueError:
+                results_list[position]["login_anomalies"] = {"error": "Invalid timestamp format"}
+                continue
+
+            # 1. and 2. Logins and unique accounts from the same device (last 3 days)
+            if device_history is None and device_store is not None and device_id is not None:
+                logins_from_device, unique_accounts_on_device = device_store.query_and_record(
+                    device_id, user_id, session_time.timestamp())
+            else:
+                device_user_ids = [entry.get("userId") for entry in (device_history or ()) if entry.get("deviceId") == device_id]
+                logins_from_device, unique_accounts_on_device = len(device_user_ids), len(set(device_user_ids))
+                if device_store is not None and device_id is not None:
+                    device_store.record(device_id, user_id, session_time.timestamp())
+            excessive_logins_score = min(logins_from_device / config.max_logins_for_full_score, 1.0)
+            excessive_unique_accounts_score = min(unique_accounts_on_device / config.max_unique_accounts_for_full_score, 1.0)
+
+            # 3. Previous login of the user: from the request, else from the last login cache
+            user_cache = last_login_cache if user_id is not None else None
+            if last_user_login is None:
+                previous_login = None
+                if user_cache is not None:
+                    previous_login = user_cache.get_and_record(user_id, session_time.timestamp(), latitude, longitude)
+                if previous_login is None:
+                    # No earlier login known for the user: no travel
+                    previous_login = (session_time.timestamp(), latitude, longitude)
+                last_timestamp, last_latitude, last_longitude = previous_login
+                cached_last_coordinates[len(row_positions)] = (last_latitude, last_longitude)
+                hours = abs(session_time.timestamp() - last_timestamp) / 3600
+            else:
+                if columns is None:
+                    last_latitude = float(last_user_login.get("latitude", 0))
+                    last_longitude = float(last_user_login.get("longitude", 0))
+                hours = abs((session_time - last_user_time).total_seconds()) / 3600
+                if user_cache is not None:
+                    user_cache.record(user_id, session_time.timestamp(), latitude, longitude)
+
+            if columns is None:
+                coordinates.append((latitude, longitude, last_latitude, last_longitude))
+            time_difference_hours.append(hours)
+            device_scores.append((excessive_logins_score, excessive_unique_accounts_score))
+            row_positions.append(position)
+
+        except Exception as e:
+            results_list[position]["login_anomalies"] = {
+                "error": "An error occurred while processing login anomalies",
+                "reason": str(e)
+            }
+
+    if not row_positions:
+        return
+
+    if columns is None:
+        latitude, longitude, last_latitude, last_longitude = np.array(coordinates, dtype=np.float64).reshape(-1, 4).T
+    else:
+        latitude, longitude = columns.session_latitude[row_positions], columns.session_longitude[row_positions]
+        last_latitude, last_longitude = columns.last_latitude[row_positions], columns.last_longitude[row_positions]
+        if cached_last_coordinates:
+            rows = list(cached_last_coordinates)
+            last_latitude[rows], last_longitude[rows] = np.array(list(cached_last_coordinates.values()), dtype=np.float64).T
+    hours = np.array(time_difference_hours, dtype=np.float64)
+
+    try:
+        # ---------------- 3. Unlikely Travel Detection, one distance call for the batch ----------------
+        distance_km = np.asarray(config.distance_km(latitude, longitude, last_latitude, last_longitude), dtype=np.float64)
+        failed = {}
+
+    except Exception:
+        # e.g. a coordinate the distance kernel rejects: distances row by row so only that row fails
+        # (the device counts are kept, sessions are already in the device history store)
+        distance_km = np.zeros(len(row_positions))
+        failed = {}
+        for i in range(len(row_positions)):
+            try:
+                distance_km[i] = float(config.distance_km(latitude[i], longitude[i], last_latitude[i], last_longitude[i]))
+            except Exception as e:
+                failed[i] = e
+
+    travel_speed = np.divide(distance_km, hours, out=np.zeros(len(row_positions)), where=hours > 0)  # km/h
+    unlikely_travel_score = np.minimum(travel_speed / config.max_travel_speed_for_full_score, 1.0)
+
+    # ---------------- Store Results ----------------
+    for i, position in enumerate(row_positions):
+        if i in failed:
+            results_list[position]["login_anomalies"] = {
+                "error": "An error occurred while processing login anomalies",
+                "reason": str(failed[i])
+            }
+            continue
+        excessive_logins_score, excessive_unique_accounts_score = device_scores[i]
+        results_list[position]["login_anomalies"] = {
+            "excessive_logins_from_same_device_score": round(excessive_logins_score, 2),
+            "excessive_unique_account_logins_from_same_device_score": round(excessive_unique_accounts_score, 2),
+            "unlikely_travel_score": round(float(unlikely_travel_score[i]), 2)
+        }
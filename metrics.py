@@ -0,0 +1,153 @@
+"""
+metrics.py - In-process latency/call/error instrumentation with Prometheus text output
+
+Every stage of a fraud detection request records into the module-level REGISTRY.
+Observations are a bisect plus a few integer increments under a lock, cheap enough
+to stay enabled in production. Metrics are per process: with several gunicorn
+workers each worker reports its own series.
+"""
+
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# Latency buckets in seconds (upper bounds, +Inf is implicit)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Payload size buckets in items (e.g. geo points, device history entries, batch size)
+SIZE_BUCKETS = (0, 1, 10, 50, 100, 500, 1000, 5000, 10000, 50000, 100000)
+
+
+class Histogram:
+    """Fixed-bucket histogram; counts are stored per bucket and made cumulative on render."""
+
+    __slots__ = ("buckets", "counts", "total", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def render(self, name, labels):
+        lines = []
+        cumulative = 0
+        for upper, bucket_count in zip(self.buckets, self.counts):
+            cumulative += bucket_count
+            lines.append(f'{name}_bucket{{{labels},le="{upper}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f"{name}_sum{{{labels}}} {self.total}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Thread-safe store for per-component latency, call and error counts and payload sizes."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._latency = {}
+        self._calls = {}
+        self._errors = {}
+        self._payload_sizes = {}
+        self._counters = {}
+        # Raw latency samples per stage, only kept while sampling is enabled (benchmarks)
+        self._samples = None
+
+    def observe_component(self, component, seconds, error=False):
+        with self._lock:
+            histogram = self._latency.get(component)
+            if histogram is None:
+                histogram = self._latency[component] = Histogram(LATENCY_BUCKETS)
+            histogram.observe(seconds)
+            if self._samples is not None:
+                self._samples.setdefault(component, []).append(seconds)
+            self._calls[component] = self._calls.get(component, 0) + 1
+            if error:
+                self._errors[component] = self._errors.get(component, 0) + 1
+
+    def observe_payload(self, field, size):
+        with self._lock:
+            histogram = self._payload_sizes.get(field)
+            if histogram is None:
+                histogram = self._payload_sizes[field] = Histogram(SIZE_BUCKETS)
+            histogram.observe(size)
+
+    def increment(self, name, amount=1):
+        """Increments a free-form counter, rendered as fraud_<name>_total."""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + amount
+
+    def counters(self):
+        """Copy of the free-form counters."""
+        with self._lock:
+            return dict(self._counters)
+
+    def enable_sampling(self):
+        """Starts keeping every stage latency so exact percentiles can be computed."""
+        with self._lock:
+            self._samples = {}
+
+    def drain_samples(self):
+        """Returns {stage: [seconds, ...]} collected since the last drain and starts over."""
+        with self._lock:
+            samples = self._samples or {}
+            if self._samples is not None:
+                self._samples = {}
+            return samples
+
+    @contextmanager
+    def time_component(self, component):
+        """Times a block; an exception escaping the block counts as an error."""
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.observe_component(component, time.perf_counter() - start, error)
+
+    def render_prometheus(self):
+        """Returns all metrics in the Prometheus text exposition format (0.0.4)."""
+        with self._lock:
+            lines = [
+                "# HELP fraud_component_latency_seconds Latency of each fraud detection stage.",
+                "# TYPE fraud_component_latency_seconds histogram",
+            ]
+            for component in sorted(self._latency):
+                lines.extend(self._latency[component].render(
+                    "fraud_component_latency_seconds", f'component="{component}"'
+                ))
+
+            lines.append("# HELP fraud_component_calls_total Number of times each stage ran.")
+            lines.append("# TYPE fraud_component_calls_total counter")
+            for component in sorted(self._calls):
+                lines.append(f'fraud_component_calls_total{{component="{component}"}} {self._calls[component]}')
+
+            lines.append("# HELP fraud_component_errors_total Number of stage runs that failed or timed out.")
+            lines.append("# TYPE fraud_component_errors_total counter")
+            for component in sorted(self._calls):
+                lines.append(f'fraud_component_errors_total{{component="{component}"}} {self._errors.get(component, 0)}')
+
+            lines.append("# HELP fraud_payload_size_items Number of items in variable-size request fields.")
+            lines.append("# TYPE fraud_payload_size_items histogram")
+            for field in sorted(self._payload_sizes):
+                lines.extend(self._payload_sizes[field].render("fraud_payload_size_items", f'field="{field}"'))
+
+            for name in sorted(self._counters):
+                lines.append(f"# TYPE fraud_{name}_total counter")
+                lines.append(f"fraud_{name}_total {self._counters[name]}")
+
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide registry used by the app and controller
+REGISTRY = MetricsRegistry()
@@ -0,0 +1,177 @@
+"""
+result_cache.py - Bounded LRU + TTL caches for pipeline results and ML scores
+
+Two caches skip repeated work:
+
+* results: the full process_transaction output, keyed by transaction_id plus a hash
+  of the scored request fields and the config version (retries and duplicate
+  submissions of the same transaction). The geo history is hashed as its parsed
+  float64 array rather than re-serialized as JSON.
+* ML scores: keyed by a hash of the 12 feature values in model order (consecutive
+  requests of a user often carry identical aggregate features); see
+  ML_component/fraud_detection_ml.py
+
+Values are stored as JSON bytes (json_codec), so a hit returns a fresh object that
+the caller may modify, and every backend stores the same thing. Backends:
+
+* LocalCacheBackend: in-process OrderedDict with LRU eviction at max_entries and a
+  per-entry TTL; per process, like metrics.
+* SharedCacheBackend: any client with Redis-style get(key) / set(key, value, ex=ttl),
+  shared by all workers. "backend": "redis" builds one from redis_url when the
+  optional redis package is installed; tests or single-host setups can pass a
+  LocalCacheBackend (or anything with the same two methods) as the client instead.
+
+Hits, misses and backend errors are counted as fraud_<name>_cache_{hits,misses,errors}_total.
+A backend error is treated as a miss, so the cache never fails a request.
+"""
+
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from geospacial_clustering_component.geo_history import geo_history_from_request
+from json_codec import dumps_bytes, loads
+from metrics import REGISTRY
+
+try:
+    import redis
+except ImportError:  # optional dependency
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+CACHE_BACKENDS = ("local", "redis")
+
+# Request fields the pipeline reads besides transaction_id and the geo history
+SCORED_FIELDS = ("user_id", "transaction_type", "transaction_data", "login_data", "withdrawal_data")
+
+
+class LocalCacheBackend:
+    """Thread-safe in-process LRU cache whose entries also expire after ttl seconds."""
+
+    def __init__(self, max_entries=10000, clock=time.monotonic):
+        if max_entries < 1:
+            raise ValueError(f"max_entries must be >= 1, got {max_entries}")
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= self._clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ex=None):
+        expires_at = self._clock() + ex if ex else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SharedCacheBackend:
+    """Adapter for a Redis-style client; keys are namespaced with key_prefix."""
+
+    def __init__(self, client, key_prefix="fraud:"):
+        self.client = client
+        self.key_prefix = key_prefix
+
+    def get(self, key):
+        return self.client.get(self.key_prefix + key)
+
+    def set(self, key, value, ex=None):
+        # Redis wants a whole number of seconds
+        self.client.set(self.key_prefix + key, value, ex=max(int(ex), 1) if ex else None)
+
+
+class ResultCache:
+    """JSON-serializing cache front end with TTL and hit/miss counters."""
+
+    def __init__(self, name, backend, ttl_seconds):
+        self.name = name
+        self.backend = backend
+        self.ttl_seconds = ttl_seconds
+
+    def get(self, key):
+        """Returns the cached value (a new object), or None on a miss."""
+        try:
+            raw = self.backend.get(key)
+        except Exception as e:
+            REGISTRY.increment(f"{self.name}_cache_errors")
+            logger.warning(f"{self.name} cache get failed: {str(e)}")
+            raw = None
+        if raw is None:
+            REGISTRY.increment(f"{self.name}_cache_misses")
+            return None
+        REGISTRY.increment(f"{self.name}_cache_hits")
+        return loads(raw)
+
+    def set(self, key, value):
+        try:
+            self.backend.set(key, dumps_bytes(value), ex=self.ttl_seconds)
+        except Exception as e:
+            REGISTRY.increment(f"{self.name}_cache_errors")
+            logger.warning(f"{self.name} cache set failed: {str(e)}")
+
+
+def make_cache(name, config):
+    """
+    Builds a ResultCache from a config section, or returns None when it is disabled.
+
+    Keys: enabled, backend (local or redis), max_entries, ttl_seconds, redis_url, key_prefix.
+    """
+    if not config.get("enabled", False):
+        return None
+
+    backend_name = config.get("backend", "local")
+    if backend_name not in CACHE_BACKENDS:
+        raise ValueError(f"Unknown cache backend '{backend_name}'. Allowed: {list(CACHE_BACKENDS)}")
+
+    if backend_name == "redis":
+        if redis is None:
+            raise ImportError("The redis cache backend requires the redis package")
+        backend = SharedCacheBackend(redis.Redis.from_url(config.get("redis_url", "redis://localhost:6379/0")),
+                                     key_prefix=config.get("key_prefix", "fraud:") + name + ":")
+    else:
+        backend = LocalCacheBackend(max_entries=config.get("max_entries", 10000))
+    return ResultCache(name, backend, config.get("ttl_seconds", 300))
+
+
+def request_fingerprint(data, version=None):
+    """Cache key of a request: transaction_id plus a hash of its scored fields (and settings version)."""
+    digest = hashlib.blake2b(dumps_bytes([data.get(field) for field in SCORED_FIELDS]), digest_size=16)
+    try:
+        history, invalid_points = geo_history_from_request(data)
+    except (ValueError, TypeError):  # left to the geospatial component to report
+        history, invalid_points = None, None
+    if history is not None:
+        digest.update(np.ascontiguousarray(history).tobytes())
+    digest.update(str(invalid_points).encode())
+    if version is not None:
+        digest.update(str(version).encode())
+    return f"{data.get('transaction_id')}:{digest.hexdigest()}"
+
+
+def feature_fingerprint(row):
+    """Cache key of one raw float64 feature row in model order."""
+    return hashlib.blake2b(row.tobytes(), digest_size=16).hexdigest()
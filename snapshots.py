@@ -0,0 +1,80 @@
+"""
+snapshots.py - On-disk snapshots of per-process state
+
+Used by the in-process stores that should survive a restart (the last login cache, the
+withdrawal velocity counters). A store implements save(path); Snapshotter calls it
+every interval_seconds from a daemon thread and once more at interpreter exit, and the
+store's getter restores it from the same path when the store is created.
+
+Snapshots are .npz files written through a temporary file, so a restarting process
+never reads a partially written snapshot. Python values (user id lists, ...) are stored
+as JSON bytes in uint8 arrays (json_array / from_json_array).
+"""
+
+import atexit
+import logging
+import os
+import threading
+
+import numpy as np
+
+from json_codec import dumps_bytes, loads
+
+logger = logging.getLogger(__name__)
+
+
+def save_npz(path, **arrays):
+    """np.savez to path, replacing it atomically."""
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    with open(temporary_path, "wb") as file:
+        np.savez(file, **arrays)
+    os.replace(temporary_path, path)
+
+
+def json_array(value):
+    return np.frombuffer(dumps_bytes(value), dtype=np.uint8)
+
+
+def from_json_array(array):
+    return loads(array.tobytes())
+
+
+class Snapshotter:
+    """Saves a store to its snapshot file periodically (daemon thread, if interval_seconds > 0) and at exit."""
+
+    def __init__(self, store, path, interval_seconds, name):
+        self.store = store
+        self.path = path
+        self.name = name
+        self._stopped = threading.Event()
+        if interval_seconds > 0:
+            thread = threading.Thread(target=self._run, args=(interval_seconds,), name=f"{name}-snapshot", daemon=True)
+            thread.start()
+        atexit.register(self.save)
+
+    def _run(self, interval_seconds):
+        while not self._stopped.wait(interval_seconds):
+            self.save()
+
+    def save(self):
+        try:
+            self.store.save(self.path)
+        except Exception as e:
+            logger.warning(f"Could not write the {self.name} snapshot {self.path}: {str(e)}")
+
+    def stop(self):
+        """Stops the periodic saves after a final one (the store is being replaced)."""
+        self._stopped.set()
+        atexit.unregister(self.save)
+        self.save()
+
+
+def restore(store, path, name):
+    """Loads store from path when the snapshot exists; a broken snapshot is logged and skipped."""
+    if not path or not os.path.exists(path):
+        return
+    try:
+        restored = store.load(path)
+        logger.info(f"Restored {restored} {name} entries from {path}")
+    except Exception as e:
+        logger.warning(f"Could not restore the {name} snapshot {path}: {str(e)}")
@@ -1,12 +1,28 @@
+"""
+validation_logic.py - Request validation for the fraud detection endpoints
+
+The REQUIRED_* field tuples and the type rules below are compiled once at import into
+specialized validation functions (validate_request, validate_login_data,
+validate_withdrawal_data, validate_withdrawal_outcome). Missing fields are always
+reported in declaration order.
+
+validate_batch() validates a list of requests and parses, in the same pass, the typed
+NumPy columns (model features, login coordinates, withdrawal amounts) that the batch
+components consume instead of re-parsing every request.
+"""
+
+from operator import itemgetter
+
+import numpy as np
 
 # Allowed transaction types
-ALLOWED_TRANSACTION_TYPES = {"withdrawal", "transfer", "deposit"}
+ALLOWED_TRANSACTION_TYPES = ("withdrawal", "transfer", "deposit")
 
 # Required fields for transaction validation
-REQUIRED_TRANSACTION_FIELDS = {"transaction_id", "user_id", "transaction_type"}
+REQUIRED_TRANSACTION_FIELDS = ("transaction_id", "user_id", "transaction_type")
 
-# Required fields for transaction_data validation
-REQUIRED_TRANSACTION_DATA_FIELDS = {
+# Required fields for transaction_data validation (also the ML model's feature order)
+REQUIRED_TRANSACTION_DATA_FIELDS = (
     "Avg min between sent tnx",
     "Avg min between received tnx",
     "Time Diff between first and last (Mins)",
@@ -19,125 +35,340 @@ REQUIRED_TRANSACTION_DATA_FIELDS = {
     "total transactions (including tnx to create contract)",
     "total ether received",
     "total ether balance",
-}
+)
 
 # Required fields for login validation
-REQUIRED_SESSION_FIELDS = {"userId", "deviceId", "timestamp", "latitude", "longitude"}
-REQUIRED_LAST_USER_LOGIN_FIELDS = {"userId", "timestamp", "latitude", "longitude"}
+REQUIRED_SESSION_FIELDS = ("userId", "deviceId", "timestamp", "latitude", "longitude")
+REQUIRED_LAST_USER_LOGIN_FIELDS = ("userId", "timestamp", "latitude", "longitude")
 
 # Required fields for withdrawal validation
-REQUIRED_WITHDRAWAL_FIELDS = {
+REQUIRED_WITHDRAWAL_FIELDS = (
     "current_wallet_balance",
     "withdrawal_amount",
     "conversion_rate",
+)
+
+# Optional withdrawal fields: filled by the service's velocity counters when left out
+WITHDRAWAL_VELOCITY_FIELDS = (
     "avg_withdrawal_frequency_14d",
     "withdrawals_24h",
     "failed_withdrawals_24h",
+)
+
+# Every withdrawal field, in the order of the batch columns
+WITHDRAWAL_FIELDS = REQUIRED_WITHDRAWAL_FIELDS + WITHDRAWAL_VELOCITY_FIELDS
+
+# Required fields for withdrawal outcome reports (POST /withdrawal_outcomes)
+REQUIRED_WITHDRAWAL_OUTCOME_FIELDS = ("transaction_id", "user_id", "outcome")
+ALLOWED_WITHDRAWAL_OUTCOMES = ("success", "failed")
+
+# Type rules: how each withdrawal field is read (the withdrawal component's conversions)
+WITHDRAWAL_FIELD_TYPES = {
+    "current_wallet_balance": float,
+    "withdrawal_amount": float,
+    "conversion_rate": float,
+    "avg_withdrawal_frequency_14d": float,
+    "withdrawals_24h": int,
+    "failed_withdrawals_24h": int,
 }
 
 
+def _compile_missing_check(fields, error, reason):
+    """
+    Returns check(container) -> error tuple or None for one REQUIRED_* tuple; error and
+    reason are templates receiving the {missing} list. The C-level key-view comparison
+    answers the common case; the ordered list of missing fields is only built for the
+    error message.
+    """
+    required = frozenset(fields)
+
+    def check(container):
+        if not isinstance(container, dict):
+            # e.g. a number or string where an object is expected: nothing is present
+            missing = list(fields)
+        elif container.keys() >= required:
+            return None
+        else:
+            missing = [field for field in fields if field not in container]
+        if not missing:
+            return None
+        return {"error": error.format(missing=missing), "reason": reason.format(missing=missing)}, 400
+
+    return check
+
+
+_NAN = float("nan")
+
+
+def _compile_login_validator():
+    check_session_fields = _compile_missing_check(
+        REQUIRED_SESSION_FIELDS, "Missing fields in 'session'", "Missing fields in 'session': {missing}")
+    check_last_login_fields = _compile_missing_check(
+        REQUIRED_LAST_USER_LOGIN_FIELDS, "Missing fields in 'last_user_login'", "Missing fields in 'last_user_login': {missing}")
+
+    def validate_login(login_data):
+        """Validates login_data; returns (error, None) or (None, (latitude, longitude, last_latitude, last_longitude))."""
+        if not login_data or not isinstance(login_data, dict):
+            return ({"error": "Missing 'login_data'", "reason": "Login data is required for all transactions"}, 400), None
+
+        # Validate session fields
+        session = login_data.get("session")
+        if not session:
+            return ({"error": "Missing 'session' in 'login_data'", "reason": "Session data is required"}, 400), None
+        error = check_session_fields(session)
+        if error:
+            return error, None
+
+        # Validate last user login fields (optional: without them the service's last login cache is used)
+        last_user_login = login_data.get("last_user_login")
+        if last_user_login is not None:
+            error = check_last_login_fields(last_user_login)
+            if error:
+                return error, None
+
+        # Validate device history format
+        if not isinstance(login_data.get("device_history_last_3_days", []), list):
+            reason = "'device_history_last_3_days' must be a list"
+            return ({"error": "'device_history_last_3_days' must be a list", "reason": reason}, 400), None
+
+        # Ensure latitude & longitude are valid numbers (NaN for an omitted last_user_login)
+        try:
+            coordinates = (
+                float(session["latitude"]),
+                float(session["longitude"]),
+                float(last_user_login["latitude"]) if last_user_login is not None else _NAN,
+                float(last_user_login["longitude"]) if last_user_login is not None else _NAN,
+            )
+        except (TypeError, ValueError):
+            reason = "Invalid latitude or longitude format in 'session' or 'last_user_login'"
+            return ({"error": "Invalid latitude or longitude", "reason": reason}, 400), None
+
+        return None, coordinates
+
+    return validate_login
+
+
+def _compile_withdrawal_validator():
+    check_withdrawal_fields = _compile_missing_check(
+        REQUIRED_WITHDRAWAL_FIELDS, "Missing fields in 'withdrawal_data'", "Missing fields in 'withdrawal_data': {missing}")
+
+    def validate_withdrawal(withdrawal_data):
+        """Validates withdrawal-specific fraud detection fields."""
+        if not withdrawal_data:
+            return {
+                "error": "Missing 'withdrawal_data' for withdrawal transaction",
+                "reason": "Withdrawal data is required for withdrawals",
+            }, 400
+        return check_withdrawal_fields(withdrawal_data)
+
+    return validate_withdrawal
+
+
+def _compile_withdrawal_outcome_validator():
+    allowed_outcomes = frozenset(ALLOWED_WITHDRAWAL_OUTCOMES)
+    check_outcome_fields = _compile_missing_check(
+        REQUIRED_WITHDRAWAL_OUTCOME_FIELDS, "Missing required fields: {missing}", "Missing fields in withdrawal outcome: {missing}")
+
+    def validate_outcome(outcome):
+        """Validates one withdrawal outcome report."""
+        error = check_outcome_fields(outcome)
+        if error:
+            return error
+        for field in ("transaction_id", "user_id"):
+            if isinstance(outcome[field], bool) or not isinstance(outcome[field], (str, int)):
+                return {"error": f"Invalid '{field}'", "reason": f"'{field}' must be a string or an integer"}, 400
+        if not isinstance(outcome["outcome"], str) or outcome["outcome"] not in allowed_outcomes:
+            reason = f"Invalid 'outcome': {outcome['outcome']}. Allowed: {list(ALLOWED_WITHDRAWAL_OUTCOMES)}"
+            return {"error": "Invalid 'outcome'", "reason": reason}, 400
+        return None
+
+    return validate_outcome
+
+
+def _compile_request_validator():
+    allowed_types = frozenset(ALLOWED_TRANSACTION_TYPES)
+    check_top_level = _compile_missing_check(
+        REQUIRED_TRANSACTION_FIELDS, "Missing required fields: {missing}", "Missing fields at top level: {missing}")
+    check_transaction_data = _compile_missing_check(
+        REQUIRED_TRANSACTION_DATA_FIELDS, "Missing fields in 'transaction_data'", "Missing fields in 'transaction_data': {missing}")
+
+    def validate(data):
+        """Returns (error, None) or (None, login coordinates); see _compile_login_validator."""
+        if not isinstance(data, dict):
+            return ({"error": "Request must be in JSON format", "reason": "Received non-JSON request"}, 400), None
+
+        # Validate required top-level fields
+        error = check_top_level(data)
+        if error:
+            return error, None
+
+        transaction_type = data["transaction_type"]
+
+        # Validate transaction type
+        if not isinstance(transaction_type, str) or transaction_type not in allowed_types:
+            reason = f"Invalid 'transaction_type': {transaction_type}. Allowed: {list(ALLOWED_TRANSACTION_TYPES)}"
+            return ({"error": "Invalid 'transaction_type'", "reason": reason}, 400), None
+
+        # Validate transaction_data
+        transaction_data = data.get("transaction_data")
+        if not transaction_data:
+            return ({
+                "error": "Missing 'transaction_data'",
+                "reason": "Transaction data is required for fraud analysis",
+            }, 400), None
+        error = check_transaction_data(transaction_data)
+        if error:
+            return error, None
+
+        # Validate login data (mandatory for all transactions)
+        error, coordinates = _validate_login(data.get("login_data"))
+        if error:
+            return error, None
+
+        # Validate withdrawal-specific data if transaction is a withdrawal
+        if transaction_type == "withdrawal":
+            error = validate_withdrawal_data(data.get("withdrawal_data"))
+            if error:
+                return error, None
+
+        return None, coordinates
+
+    return validate
+
+
+_validate_login = _compile_login_validator()
+validate_withdrawal_data = _compile_withdrawal_validator()
+validate_withdrawal_outcome = _compile_withdrawal_outcome_validator()
+_validate = _compile_request_validator()
+
+
 def validate_request(data):
     """Validates the incoming fraud detection request."""
-    if not isinstance(data, dict):
-        return {"error": "Request must be in JSON format", "reason": "Received non-JSON request"}, 400
-
-    # Validate required top-level fields
-    missing_fields = [field for field in REQUIRED_TRANSACTION_FIELDS if field not in data]
-    if missing_fields:
-        return {
-            "error": f"Missing required fields: {missing_fields}",
-            "reason": f"Missing fields at top level: {missing_fields}",
-        }, 400
-
-    transaction_type = data["transaction_type"]
-
-    # Validate transaction type
-    if transaction_type not in ALLOWED_TRANSACTION_TYPES:
-        reason = f"Invalid 'transaction_type': {transaction_type}. Allowed: {list(ALLOWED_TRANSACTION_TYPES)}"
-        return {"error": "Invalid 'transaction_type'", "reason": reason}, 400
-
-    # Validate transaction_data
-    transaction_data = data.get("transaction_data")
-    if not transaction_data:
-        return {
-            "error": "Missing 'transaction_data'",
-            "reason": "Transaction data is required for fraud analysis",
-        }, 400
-
-    missing_txn_fields = [field for field in REQUIRED_TRANSACTION_DATA_FIELDS if field not in transaction_data]
-    if missing_txn_fields:
-        reason = f"Missing fields in 'transaction_data': {missing_txn_fields}"
-        return {"error": "Missing fields in 'transaction_data'", "reason": reason}, 400
-
-    # Validate login data (mandatory for all transactions)
-    login_validation_error = validate_login_data(data.get("login_data"))
-    if login_validation_error:
-        return login_validation_error
-
-    # Validate withdrawal-specific data if transaction is a withdrawal
-    if transaction_type == "withdrawal":
-        withdrawal_validation_error = validate_withdrawal_data(data.get("withdrawal_data"))
-        if withdrawal_validation_error:
-            return withdrawal_validation_error
-
-    return None  # No errors
+    return _validate(data)[0]
 
 
 def validate_login_data(login_data):
     """Validates login-related fraud detection fields (Required for all transactions)."""
-    if not login_data:
-        return {"error": "Missing 'login_data'", "reason": "Login data is required for all transactions"}, 400
-
-    # Validate session fields
-    session = login_data.get("session")
-    if not session:
-        return {"error": "Missing 'session' in 'login_data'", "reason": "Session data is required"}, 400
-
-    missing_session_fields = [field for field in REQUIRED_SESSION_FIELDS if field not in session]
-    if missing_session_fields:
-        reason = f"Missing fields in 'session': {missing_session_fields}"
-        return {"error": "Missing fields in 'session'", "reason": reason}, 400
-
-    # Validate last user login fields
-    last_user_login = login_data.get("last_user_login")
-    if not last_user_login:
-        return {"error": "Missing 'last_user_login' in 'login_data'", "reason": "Last user login data is required"}, 400
-
-    missing_last_login_fields = [field for field in REQUIRED_LAST_USER_LOGIN_FIELDS if field not in last_user_login]
-    if missing_last_login_fields:
-        reason = f"Missing fields in 'last_user_login': {missing_last_login_fields}"
-        return {"error": "Missing fields in 'last_user_login'", "reason": reason}, 400
-
-    # Validate device history format
-    device_history = login_data.get("device_history_last_3_days", [])
-    if not isinstance(device_history, list):
-        reason = "'device_history_last_3_days' must be a list"
-        return {"error": "'device_history_last_3_days' must be a list", "reason": reason}, 400
-
-    # Ensure latitude & longitude are valid numbers
-    try:
-        float(session["latitude"])
-        float(session["longitude"])
-        float(last_user_login["latitude"])
-        float(last_user_login["longitude"])
-    except ValueError:
-        reason = "Invalid latitude or longitude format in 'session' or 'last_user_login'"
-        return {"error": "Invalid latitude or longitude", "reason": reason}, 400
-
-    return None  # No errors
-
-
-def validate_withdrawal_data(withdrawal_data):
-    """Validates withdrawal-specific fraud detection fields."""
-    if not withdrawal_data:
-        return {
-            "error": "Missing 'withdrawal_data' for withdrawal transaction",
-            "reason": "Withdrawal data is required for withdrawals",
-        }, 400
-
-    missing_withdrawal_fields = [field for field in REQUIRED_WITHDRAWAL_FIELDS if field not in withdrawal_data]
-    if missing_withdrawal_fields:
-        reason = f"Missing fields in 'withdrawal_data': {missing_withdrawal_fields}"
-        return {"error": "Missing fields in 'withdrawal_data'", "reason": reason}, 400
-
-    return None  # No errors
+    return _validate_login(login_data)[0]
+
+
+_get_features = itemgetter(*REQUIRED_TRANSACTION_DATA_FIELDS)
+_withdrawal_converters = tuple((field, WITHDRAWAL_FIELD_TYPES[field]) for field in WITHDRAWAL_FIELDS)
+_feature_name_set = frozenset(REQUIRED_TRANSACTION_DATA_FIELDS)
+# Exact types accepted without an isinstance() check per value
+_NUMERIC_TYPES = frozenset((int, float, bool))
+
+
+class RequestColumns:
+    """
+    Typed columns for a batch of valid requests, row i belonging to request i.
+
+    The *_ok masks mark the rows whose values were parsed; components handle the other
+    rows through their regular per-request path (and its error reporting).
+    """
+
+    __slots__ = ("features", "features_ok", "session_latitude", "session_longitude",
+                 "last_latitude", "last_longitude", "withdrawal", "withdrawal_ok")
+
+    feature_names = REQUIRED_TRANSACTION_DATA_FIELDS
+    withdrawal_fields = WITHDRAWAL_FIELDS
+
+    def __init__(self, size):
+        # Model features in REQUIRED_TRANSACTION_DATA_FIELDS order; rows with exactly those keys and numeric values
+        self.features = np.zeros((size, len(REQUIRED_TRANSACTION_DATA_FIELDS)), dtype=np.float64)
+        self.features_ok = np.zeros(size, dtype=bool)
+        # Login coordinates (always parsed: validation rejects requests where they are not numbers;
+        # last_* are NaN when the request has no last_user_login)
+        self.session_latitude = np.empty(size, dtype=np.float64)
+        self.session_longitude = np.empty(size, dtype=np.float64)
+        self.last_latitude = np.empty(size, dtype=np.float64)
+        self.last_longitude = np.empty(size, dtype=np.float64)
+        # Withdrawal fields in WITHDRAWAL_FIELDS order, converted per WITHDRAWAL_FIELD_TYPES
+        # (NaN for velocity fields the request leaves out)
+        self.withdrawal = np.zeros((size, len(WITHDRAWAL_FIELDS)), dtype=np.float64)
+        self.withdrawal_ok = np.zeros(size, dtype=bool)
+
+    def __len__(self):
+        return len(self.features_ok)
+
+    def take(self, positions):
+        """Columns of the given rows, in the given order."""
+        positions = np.asarray(positions, dtype=np.intp)
+        subset = RequestColumns.__new__(RequestColumns)
+        for name in RequestColumns.__slots__:
+            setattr(subset, name, getattr(self, name)[positions])
+        return subset
+
+
+class BatchValidation:
+    """Outcome of validate_batch()."""
+
+    __slots__ = ("errors", "valid", "valid_positions", "columns")
+
+    def __init__(self, errors, valid, valid_positions, columns):
+        # Per item: None or the (body, status) error tuple validate_request would return
+        self.errors = errors
+        # Per item error mask: True where the request is valid
+        self.valid = valid
+        # Indices of the valid items; columns row i belongs to item valid_positions[i]
+        self.valid_positions = valid_positions
+        self.columns = columns
+
+
+def validate_batch(items):
+    """
+    Validates every request of a batch and parses the typed columns of the valid ones.
+
+    Returns:
+        BatchValidation
+    """
+    errors = [None] * len(items)
+    valid = np.zeros(len(items), dtype=bool)
+    valid_positions = []
+    coordinates = []
+    for position, item in enumerate(items):
+        error, item_coordinates = _validate(item)
+        if error:
+            errors[position] = error
+        else:
+            valid[position] = True
+            valid_positions.append(position)
+            coordinates.append(item_coordinates)
+
+    columns = RequestColumns(len(valid_positions))
+    if coordinates:
+        (columns.session_latitude[:], columns.session_longitude[:],
+         columns.last_latitude[:], columns.last_longitude[:]) = np.array(coordinates, dtype=np.float64).T
+
+    feature_rows, feature_row_ids = [], []
+    withdrawal_rows, withdrawal_row_ids = [], []
+    for row, position in enumerate(valid_positions):
+        item = items[position]
+
+        # Same acceptance rule as the ML component: exactly the model features, all numeric
+        transaction_data = item["transaction_data"]
+        if isinstance(transaction_data, dict) and transaction_data.keys() == _feature_name_set:
+            values = _get_features(transaction_data)
+            if _NUMERIC_TYPES.issuperset(map(type, values)) or all(isinstance(v, (int, float)) for v in values):
+                feature_rows.append(values)
+                feature_row_ids.append(row)
+
+        if item["transaction_type"] == "withdrawal":
+            withdrawal_data = item["withdrawal_data"]
+            try:
+                withdrawal_rows.append([
+                    convert(withdrawal_data[field]) if field in withdrawal_data else _NAN
+                    for field, convert in _withdrawal_converters
+                ])
+                withdrawal_row_ids.append(row)
+            except (TypeError, ValueError, OverflowError):
+                pass
+
+    if feature_rows:
+        columns.features[feature_row_ids] = np.array(feature_rows, dtype=np.float64)
+        columns.features_ok[feature_row_ids] = True
+    if withdrawal_rows:
+        columns.withdrawal[withdrawal_row_ids] = np.array(withdrawal_rows, dtype=np.float64)
+        columns.withdrawal_ok[withdrawal_row_ids] = True
+
+    return BatchValidation(errors, valid, valid_positions, columns)
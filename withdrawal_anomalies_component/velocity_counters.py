@@ -0,0 +1,281 @@
+"""
+velocity_counters.py - Per-user withdrawal counters kept by the service
+
+Fills "withdrawals_24h", "failed_withdrawals_24h" and "avg_withdrawal_frequency_14d"
+when a request leaves them out, so callers do not have to aggregate their withdrawal
+history for every request:
+
+* withdrawals_24h: withdrawals of the user in the last 24 hours (before this one)
+* failed_withdrawals_24h: of those, the ones reported as failed
+* avg_withdrawal_frequency_14d: withdrawals per day over the last 14 days
+
+Every scored withdrawal counts as a withdrawal of its user_id, at the time it was
+scored. Outcomes (POST /withdrawal_outcomes) add the failures: an outcome for a
+transaction_id scored here lands in that withdrawal's bucket, and counts for the user
+that withdrawal was scored for (whatever user_id the report carries); an outcome for a
+withdrawal the service did not score (another channel, or forgotten) also counts the
+withdrawal itself. The last max_transactions transaction ids are remembered, so a
+withdrawal scored twice or an outcome reported twice is counted once.
+
+Per user, three ring buffers of counters: 24 hourly withdrawal and failure counts and
+14 daily withdrawal counts (one array('I') of 62 slots), with running totals. A window
+ending at time t covers its current bucket and the 23 (13) before it, so its edges
+are rounded to whole hours (days). Moving the rings forward zeroes the buckets that
+fall out of the window, so updates and queries are O(1) (at most 24 + 14 buckets are
+touched; about 7 us per scored withdrawal). Users are kept in an LRU of max_users;
+measured with tracemalloc, about 650 bytes per user with 13-character string ids
+(~650 MB per million users).
+
+The counters are per process, like the device history store: with several gunicorn
+workers each worker counts the withdrawals it scored and the outcomes it received, and
+with the "process" executor mode (or the ASGI "process" pool) single requests are
+scored in child processes that do not see the outcomes. Optionally the state is written to snapshot_path
+every snapshot_interval_seconds and at exit, and restored when it is created (see
+snapshots.py).
+"""
+
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+import numpy as np
+
+from snapshots import Snapshotter, from_json_array, json_array, restore, save_npz
+
+OUTCOMES = ("success", "failed")
+
+HOUR_SECONDS = 3600
+DAY_SECONDS = 86400
+HOURS = 24
+DAYS = 14
+
+# Slot offsets in _UserCounters.counts
+_WITHDRAWALS_HOURLY = 0
+_FAILED_HOURLY = HOURS
+_WITHDRAWALS_DAILY = 2 * HOURS
+_SLOTS = 2 * HOURS + DAYS
+
+
+class _UserCounters:
+    __slots__ = ("counts", "hour", "day", "withdrawals_24h", "failed_24h", "withdrawals_14d")
+
+    def __init__(self, hour, day, counts=None):
+        self.counts = counts if counts is not None else array("I", bytes(4 * _SLOTS))
+        self.hour = hour
+        self.day = day
+        # Running totals (buckets outside the windows are always zero)
+        self.withdrawals_24h = sum(self.counts[_WITHDRAWALS_HOURLY:_FAILED_HOURLY])
+        self.failed_24h = sum(self.counts[_FAILED_HOURLY:_WITHDRAWALS_DAILY])
+        self.withdrawals_14d = sum(self.counts[_WITHDRAWALS_DAILY:])
+
+    def advance(self, hour, day):
+        """Moves the windows forward to end at hour and day, zeroing the buckets that leave them."""
+        counts = self.counts
+        if hour > self.hour:
+            if hour - self.hour >= HOURS:
+                counts[_WITHDRAWALS_HOURLY:_WITHDRAWALS_DAILY] = array("I", bytes(4 * 2 * HOURS))
+                self.withdrawals_24h = self.failed_24h = 0
+            else:
+                for h in range(self.hour + 1, hour + 1):
+                    slot = h % HOURS
+                    self.withdrawals_24h -= counts[_WITHDRAWALS_HOURLY + slot]
+                    self.failed_24h -= counts[_FAILED_HOURLY + slot]
+                    counts[_WITHDRAWALS_HOURLY + slot] = counts[_FAILED_HOURLY + slot] = 0
+            self.hour = hour
+        if day > self.day:
+            if day - self.day >= DAYS:
+                counts[_WITHDRAWALS_DAILY:] = array("I", bytes(4 * DAYS))
+                self.withdrawals_14d = 0
+            else:
+                for d in range(self.day + 1, day + 1):
+                    slot = _WITHDRAWALS_DAILY + d % DAYS
+                    self.withdrawals_14d -= counts[slot]
+                    counts[slot] = 0
+            self.day = day
+
+    def add(self, hour, day, withdrawals, failed):
+        self.advance(hour, day)
+        # Events older than a window (late outcomes) are left out of it
+        if hour > self.hour - HOURS:
+            self.counts[_WITHDRAWALS_HOURLY + hour % HOURS] += withdrawals
+            self.counts[_FAILED_HOURLY + hour % HOURS] += failed
+            self.withdrawals_24h += withdrawals
+            self.failed_24h += failed
+        if day > self.day - DAYS:
+            self.counts[_WITHDRAWALS_DAILY + day % DAYS] += withdrawals
+            self.withdrawals_14d += withdrawals
+
+
+class WithdrawalVelocityCounters:
+    """In-process counters; see the module docstring. clock returns epoch seconds."""
+
+    def __init__(self, max_users=1000000, max_transactions=100000, clock=time.time):
+        self.max_users = max_users
+        self.max_transactions = max_transactions
+        self._clock = clock
+        self._users = OrderedDict()
+        # transaction_id -> [user_id, counted at, outcome or None] of recent withdrawals, oldest first
+        self._transactions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._users)
+
+    def _user(self, user_id, hour, day):
+        counters = self._users.get(user_id)
+        if counters is None:
+            counters = self._users[user_id] = _UserCounters(hour, day)
+            if len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        return counters
+
+    def _query(self, user_id, hour, day):
+        counters = self._users.get(user_id)
+        if counters is None:
+            return 0, 0, 0.0
+        counters.advance(hour, day)
+        return counters.withdrawals_24h, counters.failed_24h, counters.withdrawals_14d / DAYS
+
+    def _remember(self, transaction_id, user_id, counted_at, outcome=None):
+        self._transactions[transaction_id] = [user_id, counted_at, outcome]
+        if len(self._transactions) > self.max_transactions:
+            self._transactions.popitem(last=False)
+
+    def _record(self, user_id, transaction_id, now):
+        if transaction_id is not None:
+            if transaction_id in self._transactions:
+                return
+            self._remember(transaction_id, user_id, now)
+        hour, day = int(now // HOUR_SECONDS), int(now // DAY_SECONDS)
+        self._user(user_id, hour, day).add(hour, day, 1, 0)
+
+    def query(self, user_id):
+        """(withdrawals_24h, failed_withdrawals_24h, avg_withdrawal_frequency_14d) of user_id now."""
+        now = self._clock()
+        with self._lock:
+            return self._query(user_id, int(now // HOUR_SECONDS), int(now // DAY_SECONDS))
+
+    def record_withdrawal(self, user_id, transaction_id=None):
+        """Counts a scored withdrawal of user_id now (once per transaction_id)."""
+        now = self._clock()
+        with self._lock:
+            self._record(user_id, transaction_id, now)
+
+    def query_and_record(self, user_id, transaction_id=None):
+        """query() for the withdrawals before this one, then record_withdrawal() it."""
+        now = self._clock()
+        with self._lock:
+            counts = self._query(user_id, int(now // HOUR_SECONDS), int(now // DAY_SECONDS))
+            self._record(user_id, transaction_id, now)
+            return counts
+
+    def record_outcome(self, user_id, outcome, transaction_id=None):
+        """
+        Records the outcome ("success" or "failed") of a withdrawal of user_id. A known
+        transaction_id counts for the user it was scored for.
+        """
+        if outcome not in OUTCOMES:
+            raise ValueError(f"Unknown withdrawal outcome '{outcome}'. Allowed: {list(OUTCOMES)}")
+        now = self._clock()
+        with self._lock:
+            known = self._transactions.get(transaction_id) if transaction_id is not None else None
+            if known is None:
+                # Not scored here: the outcome also counts the withdrawal
+                withdrawals, counted_at = 1, now
+                if transaction_id is not None:
+                    self._remember(transaction_id, user_id, now, outcome)
+            elif known[2] is None:
+                # Scored here: already counted, at the time it was scored
+                user_id, counted_at = known[0], known[1]
+                withdrawals = 0
+                known[2] = outcome
+            else:
+                return  # outcome already recorded
+            failed = int(outcome == "failed")
+            if withdrawals or failed:
+                self._user(user_id, int(now // HOUR_SECONDS), int(now // DAY_SECONDS)).add(
+                    int(counted_at // HOUR_SECONDS), int(counted_at // DAY_SECONDS), withdrawals, failed)
+
+    def _trim(self):
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+        while len(self._transactions) > self.max_transactions:
+            self._transactions.popitem(last=False)
+
+    def take_over(self, other):
+        """Moves the state of other (counters being replaced) into these counters."""
+        with other._lock, self._lock:
+            self._users.update(other._users)
+            self._transactions.update(other._transactions)
+            self._trim()
+
+    def clear(self):
+        with self._lock:
+            self._users.clear()
+            self._transactions.clear()
+
+    def save(self, path):
+        """Writes the counters and the remembered transactions to path (.npz), replacing it atomically."""
+        with self._lock:
+            user_ids = list(self._users)
+            windows = np.array([(c.hour, c.day) for c in self._users.values()], dtype=np.int64).reshape(-1, 2)
+            counts = np.frombuffer(b"".join(c.counts.tobytes() for c in self._users.values()), dtype=np.uint32)
+            transactions = [[transaction_id, *entry] for transaction_id, entry in self._transactions.items()]
+        save_npz(path, user_ids=json_array(user_ids), windows=windows, counts=counts.reshape(-1, _SLOTS),
+                 transactions=json_array(transactions))
+        return len(user_ids)
+
+    def load(self, path):
+        """Adds the state of a snapshot written by save(); returns the number of users."""
+        with np.load(path) as snapshot:
+            user_ids = from_json_array(snapshot["user_ids"])
+            windows = snapshot["windows"].tolist()
+            counts = snapshot["counts"].astype(np.uint32)
+            transactions = from_json_array(snapshot["transactions"])
+        # The most recently used users (and latest transactions) when the snapshot is larger
+        start = max(len(user_ids) - self.max_users, 0)
+        with self._lock:
+            for user_id, (hour, day), row in zip(user_ids[start:], windows[start:], counts[start:]):
+                self._users[user_id] = _UserCounters(hour, day, array("I", row.tobytes()))
+                self._users.move_to_end(user_id)
+            for transaction_id, user_id, counted_at, outcome in transactions[-self.max_transactions:]:
+                self._transactions[transaction_id] = [user_id, counted_at, outcome]
+            self._trim()
+        return len(user_ids) - start
+
+
+# Counters shared by all requests of this process. They are rebuilt when a config
+# reload changes their settings, keeping their state.
+_counters = None
+_counters_key = None
+_snapshotter = None
+_counters_lock = threading.Lock()
+
+
+def get_withdrawal_velocity_counters(config):
+    """Returns the counters for the given withdrawal settings, or None when they are disabled."""
+    global _counters, _counters_key, _snapshotter
+    if not config.velocity_enabled:
+        return None
+
+    key = config.velocity_key
+    if key != _counters_key:
+        with _counters_lock:
+            if key != _counters_key:
+                counters = WithdrawalVelocityCounters(max_users=config.velocity_max_users,
+                                                      max_transactions=config.velocity_max_transactions)
+                if _snapshotter is not None:
+                    _snapshotter.stop()
+                    _snapshotter = None
+                if _counters is not None:
+                    counters.take_over(_counters)
+                else:
+                    restore(counters, config.velocity_snapshot_path, "withdrawal velocity")
+                if config.velocity_snapshot_path:
+                    _snapshotter = Snapshotter(counters, config.velocity_snapshot_path,
+                                               config.velocity_snapshot_interval_seconds, "withdrawal velocity")
+                _counters, _counters_key = counters, key
+    return _counters
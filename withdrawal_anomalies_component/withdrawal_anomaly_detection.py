@@ -1,25 +1,33 @@
 import logging
-import json
-import os
 
-# Get the directory of the current script (ensures it works even if called from a different location)
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-CONFIG_PATH = os.path.join(BASE_DIR, "config.json")
+import numpy as np
 
-# Load JSON configuration
-with open(CONFIG_PATH, "r") as f:
-    config = json.load(f)
+from config_service import CONFIG_SERVICE
+from withdrawal_anomalies_component.velocity_counters import get_withdrawal_velocity_counters
 
-# Read constants from JSON
-LARGE_WITHDRAWAL_THRESHOLD = config.get("LARGE_WITHDRAWAL_THRESHOLD", 0.5)
-MAX_DAILY_WITHDRAWALS = config.get("MAX_DAILY_WITHDRAWALS", 15)
-MAX_LAUNDERING_THRESHOLD = config.get("MAX_LAUNDERING_THRESHOLD", 6.0)
-MAX_DAILY_FAILED_WITHDRAWALS = config.get("MAX_DAILY_FAILED_WITHDRAWALS", 10)
+_NAN = float("nan")
+
+
+def _velocity_values(withdrawal_data):
+    """avg_withdrawal_frequency_14d, withdrawals_24h, failed_withdrawals_24h; NaN for the ones left out."""
+    return (
+        float(withdrawal_data["avg_withdrawal_frequency_14d"]) if "avg_withdrawal_frequency_14d" in withdrawal_data else _NAN,
+        int(withdrawal_data["withdrawals_24h"]) if "withdrawals_24h" in withdrawal_data else _NAN,
+        int(withdrawal_data["failed_withdrawals_24h"]) if "failed_withdrawals_24h" in withdrawal_data else _NAN,
+    )
 
 
 def detect_withdrawal_anomalies(data, results):
-    """Detects withdrawal anomalies using predefined rules."""
+    """
+    Detects withdrawal anomalies using predefined rules.
+
+    withdrawals_24h, failed_withdrawals_24h and avg_withdrawal_frequency_14d left out of
+    withdrawal_data come from the service's velocity counters (0 when they are disabled),
+    which count every scored withdrawal (not the ones rejected for invalid or negative values).
+    """
     try:
+        # Thresholds (config.json) as currently loaded by the config service
+        config = CONFIG_SERVICE.current.withdrawal
         withdrawal_data = data.get("withdrawal_data", {})
 
         if not withdrawal_data:
@@ -45,23 +53,37 @@ def detect_withdrawal_anomalies(data, results):
             results["withdrawal_anomalies"] = {"error": "Negative values detected in withdrawal_data"}
             return
 
+        # Velocity counters kept by the service: used for the fields the request leaves out.
+        # One call, so concurrent withdrawals of a user each see the ones before them.
+        user_id = data.get("user_id")
+        counters = get_withdrawal_velocity_counters(config) if user_id is not None else None
+        if counters is not None:
+            known_withdrawals_24h, known_failed_24h, known_frequency_14d = counters.query_and_record(
+                user_id, data.get("transaction_id"))
+            if "avg_withdrawal_frequency_14d" not in withdrawal_data:
+                avg_withdrawal_frequency_14d = known_frequency_14d
+            if "withdrawals_24h" not in withdrawal_data:
+                withdrawals_24h = known_withdrawals_24h
+            if "failed_withdrawals_24h" not in withdrawal_data:
+                failed_withdrawals_24h = known_failed_24h
+
         # Convert balance from ether to the withdrawal currency
         current_balance_converted = current_wallet_balance * conversion_rate  
 
         # 1️⃣ Large Withdrawal Score (Scaled)
         large_withdrawal_score = (
-            min(withdrawal_amount / (LARGE_WITHDRAWAL_THRESHOLD * current_balance_converted), 1.0) 
+            min(withdrawal_amount / (config.large_withdrawal_threshold * current_balance_converted), 1.0) 
             if current_balance_converted > 0 else 0.0
         )
 
         # 2️⃣ Withdrawals Limit Score (Binary)
-        withdrawals_limit_flag = int(withdrawals_24h >= MAX_DAILY_WITHDRAWALS)
+        withdrawals_limit_flag = int(withdrawals_24h >= config.max_daily_withdrawals)
 
         # 3️⃣ Money Laundering Score (Scaled)
-        money_laundering_score = min(avg_withdrawal_frequency_14d / MAX_LAUNDERING_THRESHOLD, 1.0)
+        money_laundering_score = min(avg_withdrawal_frequency_14d / config.max_laundering_threshold, 1.0)
 
         # 4️⃣ Failed Withdrawals Score (Binary)
-        failed_withdrawals_limit_flag = int(failed_withdrawals_24h >= MAX_DAILY_FAILED_WITHDRAWALS)
+        failed_withdrawals_limit_flag = int(failed_withdrawals_24h >= config.max_daily_failed_withdrawals)
 
         # Store Results
         results["withdrawal_anomalies"] = {
@@ -74,3 +96,115 @@ def detect_withdrawal_anomalies(data, results):
     except Exception as e:
         logging.error(f"Error in detect_withdrawal_anomalies: {str(e)}", exc_info=True)
         results["withdrawal_anomalies"] = {"error": str(e)}
+
+
+def detect_withdrawal_anomalies_batch(data_list, results_list, columns=None):
+    """
+    Batch variant of detect_withdrawal_anomalies; scores are computed as arrays over the whole batch.
+    Rows marked in columns.withdrawal_ok (validation_logic.RequestColumns) use the values
+    converted during validation instead of the withdrawal_data dicts. Withdrawals are
+    counted by the velocity counters in batch order.
+    """
+    config = CONFIG_SERVICE.current.withdrawal
+    rows = []
+    row_positions = []
+    parsed_positions = []
+
+    for position, data in enumerate(data_list):
+        # Converted during batch validation
+        if columns is not None and columns.withdrawal_ok[position]:
+            parsed_positions.append(position)
+            continue
+
+        results = results_list[position]
+        try:
+            withdrawal_data = data.get("withdrawal_data", {})
+
+            if not withdrawal_data:
+                results["withdrawal_anomalies"] = {}
+                continue
+
+            try:
+                row = (
+                    float(withdrawal_data.get("current_wallet_balance", 0)),
+                    float(withdrawal_data.get("withdrawal_amount", 0)),
+                    float(withdrawal_data.get("conversion_rate", 1)),
+                    *_velocity_values(withdrawal_data),
+                )
+            except ValueError:
+                logging.error("Invalid data types in withdrawal_data")
+                results["withdrawal_anomalies"] = {"error": "Invalid data types in withdrawal_data"}
+                continue
+
+            if any(value < 0 for value in (row[0], row[1], row[3], row[5])):
+                logging.warning("Negative values found in withdrawal_data")
+                results["withdrawal_anomalies"] = {"error": "Negative values detected in withdrawal_data"}
+                continue
+
+            rows.append(row)
+            row_positions.append(position)
+
+        except Exception as e:
+            logging.error(f"Error in detect_withdrawal_anomalies_batch: {str(e)}", exc_info=True)
+            results["withdrawal_anomalies"] = {"error": str(e)}
+
+    values = np.array(rows, dtype=np.float64).reshape(len(rows), 6)
+    if parsed_positions:
+        parsed = columns.withdrawal[parsed_positions]
+        negative = (parsed[:, [0, 1, 3, 5]] < 0).any(axis=1)
+        for position in np.asarray(parsed_positions)[negative].tolist():
+            logging.warning("Negative values found in withdrawal_data")
+            results_list[position]["withdrawal_anomalies"] = {"error": "Negative values detected in withdrawal_data"}
+        values = np.concatenate([values, parsed[~negative]])
+        row_positions += np.asarray(parsed_positions)[~negative].tolist()
+
+    if not row_positions:
+        return
+
+    # Velocity fields left out (NaN) come from the counters, as in detect_withdrawal_anomalies
+    velocity = values[:, 3:6]
+    counters = get_withdrawal_velocity_counters(config)
+    if counters is not None:
+        incomplete = np.isnan(velocity).any(axis=1)
+        for i in np.argsort(row_positions, kind="stable").tolist():
+            data = data_list[row_positions[i]]
+            user_id = data.get("user_id")
+            if user_id is None:
+                continue
+            known_withdrawals_24h, known_failed_24h, known_frequency_14d = counters.query_and_record(
+                user_id, data.get("transaction_id"))
+            if incomplete[i]:
+                known = (known_frequency_14d, known_withdrawals_24h, known_failed_24h)
+                velocity[i] = np.where(np.isnan(velocity[i]), known, velocity[i])
+    velocity[np.isnan(velocity)] = 0
+
+    current_wallet_balance, withdrawal_amount, conversion_rate = values[:, 0], values[:, 1], values[:, 2]
+    avg_withdrawal_frequency_14d, withdrawals_24h, failed_withdrawals_24h = values[:, 3], values[:, 4], values[:, 5]
+
+    current_balance_converted = current_wallet_balance * conversion_rate
+
+    # 1️⃣ Large Withdrawal Score (Scaled), 0.0 where the converted balance is not positive
+    large_withdrawal_score = np.zeros(len(row_positions))
+    positive_balance = current_balance_converted > 0
+    np.minimum(
+        np.divide(withdrawal_amount, config.large_withdrawal_threshold * current_balance_converted,
+                  out=np.zeros(len(row_positions)), where=positive_balance),
+        1.0, out=large_withdrawal_score, where=positive_balance
+    )
+
+    # 2️⃣ Withdrawals Limit Score (Binary)
+    withdrawals_limit_flag = withdrawals_24h >= config.max_daily_withdrawals
+
+    # 3️⃣ Money Laundering Score (Scaled)
+    money_laundering_score = np.minimum(avg_withdrawal_frequency_14d / config.max_laundering_threshold, 1.0)
+
+    # 4️⃣ Failed Withdrawals Score (Binary)
+    failed_withdrawals_limit_flag = failed_withdrawals_24h >= config.max_daily_failed_withdrawals
+
+    for i, position in enumerate(row_positions):
+        results_list[position]["withdrawal_anomalies"] = {
+            "large_withdrawal_score": round(float(large_withdrawal_score[i]), 2),
+            "money_laundering_score": round(float(money_laundering_score[i]), 2),
+            "withdrawals_limit_flag": int(withdrawals_limit_flag[i]),
+            "failed_withdrawals_limit_flag": int(failed_withdrawals_limit_flag[i])
+        }